@@ -14,24 +14,34 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-:mod:`nhlib.calc.disagg` contains :func:`disaggregation` as well as several
-aggregation functions for extracting a specific PMF from the result of
-:func:`disaggregation`.
+:mod:`nhlib.calc.disagg` contains :func:`disaggregation` (and its variants
+:func:`disaggregation_fixed_bins` and :func:`hazard_curves_and_disaggregation`)
+as well as several aggregation functions for extracting a specific PMF
+from the result of :func:`disaggregation`.
+
+Both calculators can optionally produce a :class:`SparseDisaggMatrix`,
+which only keeps non-zero cells of the matrix.
 """
 import numpy
 
+from nhlib import const
 from nhlib.calc import filters
+from nhlib.gsim.base import disaggregate_standard_poe
 from nhlib.site import SiteCollection
+from nhlib.tom import PoissonTOM
+from nhlib.geo.mesh import Mesh
 from nhlib.geo.utils import get_spherical_bounding_box, \
                             get_longitudinal_extent
-from nhlib.geo.geodetic import npoints_between
+from nhlib.geo.geodetic import npoints_between, geodetic_distance
+from nhlib.geo.polygon import get_resampled_coordinates
 
 
 def disaggregation(sources, site, imt, iml, gsims, tom,
                    truncation_level, n_epsilons,
                    mag_bin_width, dist_bin_width, coord_bin_width,
                    source_site_filter=filters.source_site_noop_filter,
-                   rupture_site_filter=filters.rupture_site_noop_filter):
+                   rupture_site_filter=filters.rupture_site_noop_filter,
+                   sparse=False):
     """
     Compute "Disaggregation" matrix representing conditional probability
     distribution of
@@ -91,13 +101,18 @@ def disaggregation(sources, site, imt, iml, gsims, tom,
         Optional source-site filter function. See :mod:`nhlib.calc.filters`.
     :param rupture_site_filter:
         Optional rupture-site filter function. See :mod:`nhlib.calc.filters`.
+    :param sparse:
+        If ``True``, the matrix is returned as :class:`SparseDisaggMatrix`
+        instead of a dense array. It is worth using when bins are fine,
+        since most of the matrix cells are zeros in that case.
 
     :returns:
         A tuple of two items. First is itself a tuple of bin edges information
         for (in specified order) magnitude, distance, longitude, latitude,
         epsilon and tectonic region types.
 
-        Second item is 6d-array representing the full disaggregation matrix.
+        Second item is 6d-array representing the full disaggregation matrix
+        (or :class:`SparseDisaggMatrix` if ``sparse`` is ``True``).
         Dimensions are in the same order as bin edges in the first item
         of the result tuple. The matrix can be used directly by pmf-extractor
         functions.
@@ -107,10 +122,586 @@ def disaggregation(sources, site, imt, iml, gsims, tom,
                                    source_site_filter, rupture_site_filter)
     bin_edges = _define_bins(bins_data, mag_bin_width, dist_bin_width,
                              coord_bin_width, truncation_level, n_epsilons)
-    diss_matrix = _arrange_data_in_bins(bins_data, bin_edges)
+    diss_matrix = _make_matrix(bins_data, bin_edges, sparse)
     return bin_edges, diss_matrix
 
 
+def disaggregation_fixed_bins(
+        sources, site, imt, iml, gsims, tom, truncation_level, bin_edges,
+        source_site_filter=filters.source_site_noop_filter,
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        sparse=False
+    ):
+    """
+    Compute "Disaggregation" matrix, the same one as :func:`disaggregation`
+    does, but using histograms bin edges that are known beforehand.
+
+    Since bin edges don't depend on the values that are being binned,
+    the contribution of each rupture is added to the matrix as soon
+    as it is computed, so the memory needed for the calculation
+    is proportional to the size of the matrix and doesn't depend
+    on the number of ruptures in the source model.
+
+    Parameters ``sources``, ``site``, ``imt``, ``iml``, ``gsims``, ``tom``,
+    ``truncation_level``, ``source_site_filter``, ``rupture_site_filter``
+    and ``sparse`` are the same as for :func:`disaggregation`.
+
+    :param bin_edges:
+        A tuple of bin edges in a format of the first item of the result
+        of :func:`disaggregation` (it can be used as is for disaggregating
+        on a different site or iml with the same bins) or of
+        :func:`get_bin_edges`. Epsilon bins must be defined for the same
+        ``truncation_level``. Tectonic region types bins must include
+        all the tectonic region types of ``sources``. Ruptures that fall
+        outside of bins for magnitude, distance or closest point coordinates
+        don't contribute to the result.
+
+    :returns:
+        A 6d-array, the full disaggregation matrix, which dimensions
+        are defined by ``bin_edges`` (or :class:`SparseDisaggMatrix`
+        if ``sparse`` is ``True``).
+
+    :raises ValueError:
+        If epsilon bins don't match ``truncation_level``, or if one of
+        the sources' tectonic region type is missing in the bins.
+    """
+    eps_bins = bin_edges[4]
+    n_epsilons = len(eps_bins) - 1
+    if not numpy.allclose(eps_bins, numpy.linspace(-truncation_level,
+                                                   truncation_level,
+                                                   n_epsilons + 1)):
+        raise ValueError('epsilon bins do not match truncation level')
+    ruptures_data = _iter_ruptures_data(
+        sources, site, imt, iml, gsims, tom, truncation_level, n_epsilons,
+        source_site_filter, rupture_site_filter
+    )
+    return _bin_ruptures_data(ruptures_data, bin_edges, sparse)
+
+
+def hazard_curves_and_disaggregation(
+        sources, sites, imts, time_span, gsims, truncation_level,
+        disagg_sites, disagg_imt, n_epsilons, mag_bin_width, dist_bin_width,
+        coord_bin_width, iml=None, poe=None,
+        source_site_filter=filters.source_site_noop_filter,
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        sparse=False
+    ):
+    """
+    Compute hazard curves and disaggregation matrices in a single pass
+    over the source model.
+
+    Hazard curves are the same as the ones that
+    :func:`~nhlib.calc.hazard_curve.hazard_curves_poissonian` calculates.
+    Disaggregation matrices are the same as the ones :func:`disaggregation`
+    calculates for each of ``disagg_sites`` given a :class:`Poissonian
+    <nhlib.tom.PoissonTOM>` temporal occurrence model with ``time_span``.
+
+    Ruptures are generated only once. For sites that are disaggregated
+    on, parameters of each rupture (magnitude, distance, closest point,
+    tectonic region type, occurrence probability) and mean and standard
+    deviation of intensity of ``disagg_imt`` are kept in arrays. Once
+    the source model is processed, these are enough for computing the
+    contributions of ruptures to exceedance of an iml, which doesn't
+    need to be known in advance: it can be read from the computed hazard
+    curve for a target probability of exceedance.
+
+    Parameters ``sources``, ``sites``, ``imts``, ``time_span``, ``gsims``,
+    ``truncation_level``, ``source_site_filter`` and ``rupture_site_filter``
+    are the same as for
+    :func:`~nhlib.calc.hazard_curve.hazard_curves_poissonian`. Parameters
+    ``n_epsilons``, ``mag_bin_width``, ``dist_bin_width``,
+    ``coord_bin_width`` and ``sparse`` are the same as for
+    :func:`disaggregation`.
+
+    :param disagg_sites:
+        List of integer indices of sites in ``sites`` to compute
+        disaggregation for.
+    :param disagg_imt:
+        Intensity measure type to disaggregate on. Must be one of the keys
+        of ``imts``.
+    :param iml:
+        Intensity measure level to disaggregate on, the same for all
+        ``disagg_sites``. Must be ``None`` if ``poe`` is given.
+    :param poe:
+        Target probability of exceedance in ``time_span``. If given,
+        an intensity measure level to disaggregate on is found for
+        each site by interpolating site's hazard curve of ``disagg_imt``
+        in log-log space. Target values out of the curve's range take
+        the iml from the curve's end.
+
+    :returns:
+        A tuple of two items. First one is hazard curves, in the same
+        format as :func:`~nhlib.calc.hazard_curve.hazard_curves_poissonian`
+        returns. Second is a list with one item per site in
+        ``disagg_sites``, which is a tuple of an iml that was disaggregated
+        on, bin edges and the matrix (see :func:`disaggregation`), or
+        ``None`` if no rupture affects the site or if ``poe`` is given
+        and site's hazard curve of ``disagg_imt`` is all zeros.
+
+    :raises ValueError:
+        If not exactly one of ``iml`` and ``poe`` is given, if
+        ``disagg_imt`` is not in ``imts``, if ``truncation_level``
+        is not positive or if one of ``gsims`` doesn't support one
+        of ``imts``.
+    """
+    if (iml is None) == (poe is None):
+        raise ValueError('exactly one of iml and poe must be specified')
+    if not disagg_imt in imts:
+        raise ValueError('imt to disaggregate on must be one of imts')
+    if truncation_level is None or truncation_level <= 0:
+        raise ValueError('truncation level must be positive')
+    for gsim in gsims.itervalues():
+        for imt in imts:
+            gsim._check_poes_args(imt, truncation_level)
+
+    curves = dict((imt, numpy.ones([len(sites), len(imts[imt])]))
+                  for imt in imts)
+    tom = PoissonTOM(time_span)
+    disagg_sites = numpy.array(disagg_sites, int)
+    imts_list = list(imts)
+    disagg_imt_idx = imts_list.index(disagg_imt)
+    # parameters of ruptures affecting disaggregation sites, one array
+    # per rupture for each of the columns (see :func:`_get_bins_data`),
+    # tectonic region types are stored as indices in ``trt_names``
+    columns = [[] for _ in _RUPTURES_DATA_COLUMNS]
+    trt_names = []
+
+    total_sites = len(sites)
+    # buffers for expanding probabilities of non-exceedance
+    # from filtered collections, reused for all the ruptures
+    expanded = dict((imt, numpy.empty_like(curves[imt])) for imt in imts)
+    sources_sites = ((source, sites) for source in sources)
+    for source, s_sites in source_site_filter(sources_sites):
+        tect_reg = source.tectonic_region_type
+        gsim = gsims[tect_reg]
+        if not tect_reg in trt_names:
+            trt_names.append(tect_reg)
+        trt_num = trt_names.index(tect_reg)
+        ruptures_sites = ((rupture, s_sites)
+                          for rupture in source.iter_ruptures(tom))
+        for rupture, r_sites in rupture_site_filter(ruptures_sites):
+            prob = rupture.get_probability_one_or_more_occurrences()
+            sctx, rctx, dctx = gsim.make_contexts(r_sites, rupture)
+            # mean values and standard deviations are computed once
+            # and used both for hazard curves and for disaggregation
+            means, [stddevs] = gsim.get_mean_and_stddevs_for_imts(
+                sctx, rctx, dctx, imts_list, [const.StdDev.TOTAL]
+            )
+            for imt, mean, stddev in zip(imts_list, means, stddevs):
+                poes = gsim._get_poes(mean, stddev, imts[imt],
+                                      truncation_level)
+                curves[imt] *= r_sites.expand(
+                    (1 - prob) ** poes, total_sites, placeholder=1,
+                    out=expanded[imt]
+                )
+
+            # find positions of disaggregation sites
+            # in the filtered collection
+            if r_sites.indices is None:
+                r_indices = numpy.arange(total_sites)
+            else:
+                r_indices = r_sites.indices
+            positions = numpy.searchsorted(r_indices, disagg_sites)
+            positions[positions == len(r_indices)] = 0
+            [affected] = (r_indices[positions] == disagg_sites).nonzero()
+            if not len(affected):
+                continue
+            positions = positions[affected]
+
+            mesh = Mesh(r_sites.mesh.lons.take(positions),
+                        r_sites.mesh.lats.take(positions), depths=None)
+            jb_dists = rupture.surface.get_joyner_boore_distance(mesh)
+            closest_points = rupture.surface.get_closest_points(mesh)
+            num = len(affected)
+            rupture_columns = (
+                affected, numpy.repeat(rupture.mag, num), jb_dists,
+                closest_points.lons, closest_points.lats,
+                numpy.repeat(trt_num, num),
+                numpy.repeat(rupture.get_probability_one_occurrence(), num),
+                means[disagg_imt_idx].take(positions),
+                stddevs[disagg_imt_idx].take(positions)
+            )
+            for column, values in zip(columns, rupture_columns):
+                column.append(values)
+
+    for imt in imts:
+        curves[imt] = 1 - curves[imt]
+
+    # group ruptures data by site, keeping the order of ruptures
+    # within each site's data
+    if columns[0]:
+        columns = [numpy.concatenate(column) for column in columns]
+    else:
+        columns = [numpy.zeros(0, dtype)
+                   for dtype in _RUPTURES_DATA_COLUMNS]
+    order = numpy.argsort(columns[0], kind='mergesort')
+    columns = [column.take(order) for column in columns]
+    bounds = numpy.searchsorted(columns[0],
+                                numpy.arange(len(disagg_sites) + 1))
+
+    results = []
+    for i, site_idx in enumerate(disagg_sites):
+        start, stop = bounds[i], bounds[i + 1]
+        if start == stop:
+            results.append(None)
+            continue
+        if poe is not None:
+            site_iml = _interpolate_iml(imts[disagg_imt],
+                                        curves[disagg_imt][site_idx], poe)
+            if site_iml is None:
+                results.append(None)
+                continue
+        else:
+            site_iml = iml
+        site_columns = [column[start:stop] for column in columns[1:]]
+        bins_data = _get_bins_data(site_columns, trt_names, gsims, site_iml,
+                                   truncation_level, n_epsilons)
+        bin_edges = _define_bins(bins_data, mag_bin_width, dist_bin_width,
+                                 coord_bin_width, truncation_level,
+                                 n_epsilons)
+        diss_matrix = _make_matrix(bins_data, bin_edges, sparse)
+        results.append((site_iml, bin_edges, diss_matrix))
+
+    return curves, results
+
+
+def get_bin_edges(sources, site, mag_bin_width, dist_bin_width,
+                  coord_bin_width, truncation_level, n_epsilons):
+    """
+    Define bin edges for :func:`disaggregation_fixed_bins` from the source
+    model itself, without generating ruptures.
+
+    Magnitude bins cover magnitudes of all the sources' MFDs. Longitude
+    and latitude bins cover bounding box of sources' :meth:`rupture
+    enclosing polygons
+    <nhlib.source.base.SeismicSource.get_rupture_enclosing_polygon>`.
+    Distance bins start from zero and end at the most distant point
+    of those polygons. Tectonic region types bins follow the order
+    in which they appear in ``sources`` for the first time.
+
+    :param sources:
+        A list of seismic sources. Note that unlike in :func:`disaggregation`
+        it can not be a generator because sources need to be iterated over
+        twice: for defining bin edges and then for actual disaggregation.
+    :param site:
+        :class:`~nhlib.site.Site` of interest.
+
+    Other parameters are the same as for :func:`disaggregation`.
+
+    :returns:
+        A tuple of bin edges in the same format as the first item
+        of :func:`disaggregation` result.
+    """
+    mags = []
+    lons = []
+    lats = []
+    trt_bins = []
+    for source in sources:
+        source_mags = [mag for (mag, rate)
+                       in source.get_annual_occurrence_rates()]
+        mags.extend((min(source_mags), max(source_mags)))
+        polygon = source.get_rupture_enclosing_polygon()
+        # resample polygon's sides because great circle arcs between
+        # the vertices can reach further than vertices themselves
+        poly_lons, poly_lats = get_resampled_coordinates(polygon.lons,
+                                                         polygon.lats)
+        lons.extend(poly_lons)
+        lats.extend(poly_lats)
+        if not source.tectonic_region_type in trt_bins:
+            trt_bins.append(source.tectonic_region_type)
+
+    lons = numpy.array(lons, float)
+    lats = numpy.array(lats, float)
+    max_dist = geodetic_distance(site.location.longitude,
+                                 site.location.latitude, lons, lats).max()
+
+    bins_data = (numpy.array(mags, float), numpy.array([0, max_dist]),
+                 lons, lats, None, None, trt_bins)
+    return _define_bins(bins_data, mag_bin_width, dist_bin_width,
+                        coord_bin_width, truncation_level, n_epsilons)
+
+
+def _bin_ruptures_data(ruptures_data, bin_edges, sparse=False):
+    """
+    Arrange ruptures data in bins which edges are known beforehand
+    and create a normalized disaggregation matrix.
+
+    :param ruptures_data:
+        An iterable of tuples in a format of :func:`_iter_ruptures_data`
+        items. Ruptures that fall outside of bins are ignored.
+    :param bin_edges:
+        Tuple of bin edges, see :func:`disaggregation_fixed_bins`.
+    :param sparse:
+        If ``True``, only non-zero cells are collected and returned
+        as :class:`SparseDisaggMatrix`. Otherwise a dense array is returned.
+    :raises ValueError:
+        If rupture's tectonic region type is missing in the bins.
+    """
+    mag_bins, dist_bins, lon_bins, lat_bins, eps_bins, trt_bins = bin_edges
+    trt_nums = dict((trt, num) for (num, trt) in enumerate(trt_bins))
+    # it is convenient to bin longitude values as extents from the first
+    # bin edge, since those are monotonically increasing even if bins
+    # cross the international date line
+    west = lon_bins[0]
+    lon_extents = get_longitudinal_extent(west, numpy.array(lon_bins))
+
+    shape = (len(mag_bins) - 1, len(dist_bins) - 1, len(lon_extents) - 1,
+             len(lat_bins) - 1, len(eps_bins) - 1, len(trt_bins))
+    if sparse:
+        # maps indices of all the dimensions but epsilon to an array
+        # of joint probabilities, one per epsilon bin
+        cells = {}
+    else:
+        diss_matrix = numpy.zeros(shape)
+
+    for mag, dist, lon, lat, tect_reg, joint_probs in ruptures_data:
+        if not tect_reg in trt_nums:
+            raise ValueError('tectonic region type %r is not in bins'
+                             % tect_reg)
+        idx = (_get_bin_index(mag, mag_bins),
+               _get_bin_index(dist, dist_bins),
+               _get_bin_index(get_longitudinal_extent(west, lon),
+                              lon_extents),
+               _get_bin_index(lat, lat_bins))
+        if None in idx:
+            # rupture is outside of bins
+            continue
+        if sparse:
+            key = idx + (trt_nums[tect_reg], )
+            if key in cells:
+                cells[key] = cells[key] + joint_probs
+            else:
+                cells[key] = joint_probs
+        else:
+            diss_matrix[idx + (slice(None), trt_nums[tect_reg])] \
+                += joint_probs
+
+    if sparse:
+        diss_matrix = SparseDisaggMatrix.from_cells(shape, cells)
+    diss_matrix /= diss_matrix.sum()
+
+    return diss_matrix
+
+
+class SparseDisaggMatrix(object):
+    """
+    Sparse representation of disaggregation matrix.
+
+    Only non-zero cells of the matrix are stored, in coordinate list
+    format: an array of cells' indices along with an array of their
+    values. Objects of this class can be used in place of dense matrices
+    by all the PMF-extractor functions.
+
+    :param shape:
+        Shape of the full 6d matrix, a tuple of numbers of magnitude,
+        distance, longitude, latitude, epsilon and tectonic region type bins.
+    :param indices:
+        2d integer array of shape ``(N, 6)``, indices of non-zero cells
+        in the full matrix.
+    :param values:
+        1d array of ``N`` values of those cells.
+    """
+    def __init__(self, shape, indices, values):
+        self.shape = tuple(shape)
+        self.indices = numpy.array(indices, int).reshape((-1, len(shape)))
+        self.values = numpy.array(values, float)
+        assert len(self.indices) == len(self.values)
+
+    @classmethod
+    def from_cells(cls, shape, cells):
+        """
+        Create a sparse matrix from a dictionary of cells.
+
+        :param shape:
+            Shape of the full matrix.
+        :param cells:
+            Dictionary mapping a tuple of indices along all the dimensions
+            except epsilon to 1d array of values for all epsilon bins.
+        """
+        indices = []
+        values = []
+        for key in sorted(cells):
+            probs = cells[key]
+            for i_eps in numpy.flatnonzero(probs):
+                indices.append(key[:4] + (i_eps, ) + key[4:])
+                values.append(probs[i_eps])
+        return cls(shape, indices, values)
+
+    @classmethod
+    def from_dense(cls, matrix):
+        """
+        Create a sparse matrix from a dense array, keeping non-zero cells.
+        """
+        indices = numpy.transpose(numpy.nonzero(matrix))
+        return cls(matrix.shape, indices, matrix[matrix != 0])
+
+    @property
+    def nnz(self):
+        """
+        Number of non-zero cells.
+        """
+        return len(self.values)
+
+    def sum(self):
+        """
+        Return sum of all the cells of the matrix.
+        """
+        return self.values.sum()
+
+    def __idiv__(self, value):
+        self.values /= value
+        return self
+
+    __itruediv__ = __idiv__
+
+    def todense(self):
+        """
+        Create a full dense 6d disaggregation matrix.
+        """
+        matrix = numpy.zeros(self.shape)
+        matrix[tuple(self.indices.T)] = self.values
+        return matrix
+
+    def fold(self, axes):
+        """
+        Fold the matrix to a PMF of a subset of its dimensions.
+
+        :param axes:
+            Sorted sequence of indices of dimensions to keep.
+        :returns:
+            Dense array with one dimension per axis in ``axes``, values
+            are sums over all the other dimensions.
+        """
+        shape = tuple(self.shape[axis] for axis in axes)
+        if not self.nnz:
+            return numpy.zeros(shape)
+        flat_indices = numpy.ravel_multi_index(
+            tuple(self.indices[:, axis] for axis in axes), shape
+        )
+        pmf = numpy.bincount(flat_indices, weights=self.values,
+                             minlength=numpy.prod(shape))
+        return pmf.reshape(shape)
+
+
+def _interpolate_iml(imls, curve, poe):
+    """
+    Find intensity measure level corresponding to a given probability
+    of exceedance on a hazard curve.
+
+    Interpolation is done in log-log space, zero values of the curve
+    are ignored. Probabilities that are out of the curve's range get
+    the iml of the curve's respective end.
+
+    :param imls:
+        Intensity measure levels of the curve, in increasing order.
+    :param curve:
+        Probabilities of exceedance of ``imls``.
+    :param poe:
+        Target probability of exceedance.
+    :returns:
+        Float iml, or ``None`` if all values of the curve are zero.
+    """
+    imls = numpy.array(imls, float)
+    curve = numpy.array(curve, float)
+    nonzero = curve > 0
+    if not nonzero.any():
+        return None
+    # probabilities of exceedance decrease with iml growth
+    # and interpolation needs increasing values, so reverse
+    # the curve
+    log_imls = numpy.log(imls[nonzero])[::-1]
+    log_poes = numpy.log(curve[nonzero])[::-1]
+    return numpy.exp(numpy.interp(numpy.log(poe), log_poes, log_imls))
+
+
+#: Types of columns of ruptures data kept by
+#: :func:`hazard_curves_and_disaggregation`: index of a site in
+#: disaggregation sites, magnitude, distance, longitude and latitude
+#: of the closest point, index of tectonic region type, probability
+#: of one occurrence, mean and standard deviation of intensity.
+_RUPTURES_DATA_COLUMNS = (int, float, float, float, float, int, float,
+                          float, float)
+
+
+def _get_bins_data(columns, trt_names, gsims, iml, truncation_level,
+                   n_epsilons):
+    """
+    Create bins data in the format of :func:`_collect_bins_data` from
+    parameters of ruptures kept by :func:`hazard_curves_and_disaggregation`.
+
+    :param columns:
+        List of arrays of ruptures data for one site, in the order
+        of :data:`_RUPTURES_DATA_COLUMNS` without the site index.
+    :param trt_names:
+        List of tectonic region types which the indices in ``columns``
+        refer to.
+    """
+    mags, dists, lons, lats, trt_indices, p_rups, means, stddevs = columns
+
+    # tectonic region types bins follow the order in which they appear
+    # in site's data for the first time
+    trt_indices_bins, first, trt_nums = numpy.unique(
+        trt_indices, return_index=True, return_inverse=True
+    )
+    order = numpy.argsort(first)
+    trt_bins = [trt_names[trt_index]
+                for trt_index in trt_indices_bins.take(order)]
+    trt_nums = numpy.argsort(order).take(trt_nums)
+
+    # iml in distribution space depends on gsim (that is, on tectonic
+    # region type) as gsims can have different intensity distributions
+    dist_imls = numpy.empty(len(mags))
+    for trt_num, tect_reg in enumerate(trt_bins):
+        dist_imls[trt_nums == trt_num] = \
+            gsims[tect_reg].to_distribution_values(iml)
+    poes_given_rup_eps = disaggregate_standard_poe(
+        (dist_imls - means) / stddevs, truncation_level, n_epsilons
+    )
+    joint_probs = poes_given_rup_eps * p_rups.reshape((-1, 1))
+
+    return mags, dists, lons, lats, joint_probs, trt_nums, trt_bins
+
+
+def _make_matrix(bins_data, bin_edges, sparse):
+    """
+    Create disaggregation matrix, either dense one or
+    :class:`SparseDisaggMatrix`, from bins data and bin edges.
+    """
+    if not sparse:
+        return _arrange_data_in_bins(bins_data, bin_edges)
+    mags, dists, lons, lats, joint_probs, tect_reg_types, trt_bins \
+        = bins_data
+    ruptures_data = ((mags[i], dists[i], lons[i], lats[i],
+                      trt_bins[tect_reg_types[i]], joint_probs[i])
+                     for i in xrange(len(mags)))
+    return _bin_ruptures_data(ruptures_data, bin_edges, sparse=True)
+
+
+def _get_bin_index(value, bins):
+    """
+    Find an index of a histogram bin ``value`` falls into.
+
+    Bins are closed on the right hand side, the first bin is closed
+    on both sides.
+
+    :param value:
+        Float number to find the bin for.
+    :param bins:
+        Sorted array of bin edges.
+    :returns:
+        Integer index of the bin or ``None`` if the value lies outside
+        of bins.
+    """
+    idx = numpy.searchsorted(bins, value) - 1
+    if idx == -1 and numpy.allclose(value, bins[0]):
+        # value is equal to the lower edge of the first bin
+        # (possibly up to a floating point imprecision)
+        return 0
+    if not 0 <= idx < len(bins) - 1:
+        return None
+    return idx
+
+
 def _collect_bins_data(sources, site, imt, iml, gsims, tom,
                        truncation_level, n_epsilons,
                        source_site_filter, rupture_site_filter):
@@ -128,12 +719,51 @@ def _collect_bins_data(sources, site, imt, iml, gsims, tom,
     lats = []
     tect_reg_types = []
     joint_probs = []
-    sitecol = SiteCollection([site])
-    sitemesh = sitecol.mesh
 
     _next_trt_num = 0
     trt_nums = {}
 
+    for mag, dist, lon, lat, tect_reg, poes in _iter_ruptures_data(
+            sources, site, imt, iml, gsims, tom, truncation_level, n_epsilons,
+            source_site_filter, rupture_site_filter):
+        if not tect_reg in trt_nums:
+            trt_nums[tect_reg] = _next_trt_num
+            _next_trt_num += 1
+
+        mags.append(mag)
+        dists.append(dist)
+        lons.append(lon)
+        lats.append(lat)
+        tect_reg_types.append(trt_nums[tect_reg])
+        joint_probs.append(poes)
+
+    mags = numpy.array(mags, float)
+    dists = numpy.array(dists, float)
+    lons = numpy.array(lons, float)
+    lats = numpy.array(lats, float)
+    tect_reg_types = numpy.array(tect_reg_types, int)
+    joint_probs = numpy.array(joint_probs, float)
+
+    trt_bins = [
+        trt for (num, trt) in sorted((num, trt)
+                                     for (trt, num) in trt_nums.items())
+    ]
+
+    return mags, dists, lons, lats, joint_probs, tect_reg_types, trt_bins
+
+
+def _iter_ruptures_data(sources, site, imt, iml, gsims, tom,
+                        truncation_level, n_epsilons,
+                        source_site_filter, rupture_site_filter):
+    """
+    Process the source model and generate values of magnitude, distance,
+    closest point longitude and latitude, tectonic region type and joint
+    probabilities of rupture occurrence and iml exceedance (one value
+    per epsilon bin) for each rupture, one rupture at a time.
+    """
+    sitecol = SiteCollection([site])
+    sitemesh = sitecol.mesh
+
     sources_sites = ((source, sitecol) for source in sources)
     # here we ignore filtered site collection because either it is the same
     # as the original one (with one site), or the source/rupture is filtered
@@ -142,22 +772,12 @@ def _collect_bins_data(sources, site, imt, iml, gsims, tom,
         tect_reg = source.tectonic_region_type
         gsim = gsims[tect_reg]
 
-        if not tect_reg in trt_nums:
-            trt_nums[tect_reg] = _next_trt_num
-            _next_trt_num += 1
-        tect_reg = trt_nums[tect_reg]
-
         ruptures_sites = ((rupture, s_sites)
                           for rupture in source.iter_ruptures(tom))
         for rupture, r_sites in rupture_site_filter(ruptures_sites):
             # extract rupture parameters of interest
-            mags.append(rupture.mag)
             [jb_dist] = rupture.surface.get_joyner_boore_distance(sitemesh)
-            dists.append(jb_dist)
             [closest_point] = rupture.surface.get_closest_points(sitemesh)
-            lons.append(closest_point.longitude)
-            lats.append(closest_point.latitude)
-            tect_reg_types.append(tect_reg)
 
             # compute conditional probability of exceeding iml given
             # the current rupture, and different epsilon level, that is
@@ -172,21 +792,9 @@ def _collect_bins_data(sources, site, imt, iml, gsims, tom,
 
             # compute joint probability of rupture occurrence and
             # iml exceedance for the different epsilon levels
-            joint_probs.append(poes_given_rup_eps * p_rup)
-
-    mags = numpy.array(mags, float)
-    dists = numpy.array(dists, float)
-    lons = numpy.array(lons, float)
-    lats = numpy.array(lats, float)
-    tect_reg_types = numpy.array(tect_reg_types, int)
-    joint_probs = numpy.array(joint_probs, float)
-
-    trt_bins = [
-        trt for (num, trt) in sorted((num, trt)
-                                     for (trt, num) in trt_nums.items())
-    ]
-
-    return mags, dists, lons, lats, joint_probs, tect_reg_types, trt_bins
+            yield (rupture.mag, jb_dist, closest_point.longitude,
+                   closest_point.latitude, tect_reg,
+                   poes_given_rup_eps * p_rup)
 
 
 def _define_bins(bins_data, mag_bin_width, dist_bin_width,
@@ -283,23 +891,29 @@ def _arrange_data_in_bins(bins_data, bin_edges):
     return diss_matrix
 
 
+def _fold(matrix, axes):
+    """
+    Fold either dense or sparse disaggregation matrix to a PMF,
+    keeping dimensions ``axes`` and summing over all the other ones.
+    """
+    if isinstance(matrix, SparseDisaggMatrix):
+        return matrix.fold(axes)
+    other_axes = tuple(axis for axis in xrange(len(matrix.shape))
+                       if not axis in axes)
+    return matrix.sum(axis=other_axes)
+
+
 def mag_pmf(matrix):
     """
     Fold full disaggregation matrix to magnitude PMF.
 
+    This and other PMF-extractor functions accept either dense 6d array
+    or :class:`SparseDisaggMatrix`.
+
     :returns:
         1d array, a histogram representing magnitude PMF.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    mag_pmf = numpy.zeros(nmags)
-    for i in xrange(nmags):
-        mag_pmf[i] = sum(matrix[i][j][k][l][m][n]
-                         for j in xrange(ndists)
-                         for k in xrange(nlons)
-                         for l in xrange(nlats)
-                         for m in xrange(neps)
-                         for n in xrange(ntrts))
-    return mag_pmf
+    return _fold(matrix, (0,))
 
 
 def dist_pmf(matrix):
@@ -309,16 +923,7 @@ def dist_pmf(matrix):
     :returns:
         1d array, a histogram representing distance PMF.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    dist_pmf = numpy.zeros(ndists)
-    for j in xrange(ndists):
-        dist_pmf[j] = sum(matrix[i][j][k][l][m][n]
-                          for i in xrange(nmags)
-                          for k in xrange(nlons)
-                          for l in xrange(nlats)
-                          for m in xrange(neps)
-                          for n in xrange(ntrts))
-    return dist_pmf
+    return _fold(matrix, (1,))
 
 
 def trt_pmf(matrix):
@@ -328,16 +933,7 @@ def trt_pmf(matrix):
     :returns:
         1d array, a histogram representing tectonic region type PMF.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    trt_pmf = numpy.zeros(ntrts)
-    for n in xrange(ntrts):
-        trt_pmf[n] = sum(matrix[i][j][k][l][m][n]
-                         for i in xrange(nmags)
-                         for j in xrange(ndists)
-                         for k in xrange(nlons)
-                         for l in xrange(nlats)
-                         for m in xrange(neps))
-    return trt_pmf
+    return _fold(matrix, (5,))
 
 
 def mag_dist_pmf(matrix):
@@ -348,16 +944,7 @@ def mag_dist_pmf(matrix):
         2d array. First dimension represents magnitude histogram bins,
         second one -- distance histogram bins.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    mag_dist_pmf = numpy.zeros((nmags,ndists))
-    for i in xrange(nmags):
-        for j in xrange(ndists):
-            mag_dist_pmf[i][j] = sum(matrix[i][j][k][l][m][n]
-                                     for k in xrange(nlons)
-                                     for l in xrange(nlats)
-                                     for m in xrange(neps)
-                                     for n in xrange(ntrts))
-    return mag_dist_pmf
+    return _fold(matrix, (0, 1))
 
 
 def mag_dist_eps_pmf(matrix):
@@ -369,16 +956,7 @@ def mag_dist_eps_pmf(matrix):
         second one -- distance histogram bins, third one -- epsilon
         histogram bins.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    mag_dist_eps_pmf = numpy.zeros((nmags,ndists,neps))
-    for i in xrange(nmags):
-        for j in xrange(ndists):
-            for m in xrange(neps):
-                mag_dist_eps_pmf[i][j][m] = sum(matrix[i][j][k][l][m][n]
-                                                for k in xrange(nlons)
-                                                for l in xrange(nlats)
-                                                for n in xrange(ntrts))
-    return mag_dist_eps_pmf
+    return _fold(matrix, (0, 1, 4))
 
 
 def lon_lat_pmf(matrix):
@@ -389,16 +967,7 @@ def lon_lat_pmf(matrix):
         2d array. First dimension represents longitude histogram bins,
         second one -- latitude histogram bins.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    lon_lat_pmf = numpy.zeros((nlons,nlats))
-    for k in xrange(nlons):
-        for l in xrange(nlats):
-            lon_lat_pmf[k][l] = sum(matrix[i][j][k][l][m][n]
-                                    for i in xrange(nmags)
-                                    for j in xrange(ndists)
-                                    for m in xrange(neps)
-                                    for n in xrange(ntrts))
-    return lon_lat_pmf
+    return _fold(matrix, (2, 3))
 
 
 def mag_lon_lat_pmf(matrix):
@@ -410,16 +979,7 @@ def mag_lon_lat_pmf(matrix):
         second one -- longitude histogram bins, third one -- latitude
         histogram bins.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    mag_lon_lat_pmf = numpy.zeros((nmags,nlons,nlats))
-    for i in xrange(nmags):
-        for k in xrange(nlons):
-            for l in xrange(nlats):
-                mag_lon_lat_pmf[i][k][l] = sum(matrix[i][j][k][l][m][n]
-                                               for j in xrange(ndists)
-                                               for m in xrange(neps)
-                                               for n in xrange(ntrts))
-    return mag_lon_lat_pmf
+    return _fold(matrix, (0, 2, 3))
 
 
 def lon_lat_trt_pmf(matrix):
@@ -431,13 +991,4 @@ def lon_lat_trt_pmf(matrix):
         3d array. Dimension represent longitude, latitude and tectonic region
         type histogram bins respectively.
     """
-    nmags, ndists, nlons, nlats, neps, ntrts = matrix.shape
-    lon_lat_trt_pmf = numpy.zeros((nlons,nlats,ntrts))
-    for k in xrange(nlons):
-        for l in xrange(nlats):
-            for n in xrange(ntrts):
-                lon_lat_trt_pmf[k][l][n] = sum(matrix[i][j][k][l][m][n]
-                                               for i in xrange(nmags)
-                                               for j in xrange(ndists)
-                                               for m in xrange(neps))
-    return lon_lat_trt_pmf
+    return _fold(matrix, (2, 3, 5))
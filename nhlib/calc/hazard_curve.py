@@ -25,7 +25,8 @@ from nhlib.calc import filters
 def hazard_curves_poissonian(
         sources, sites, imts, time_span, gsims, truncation_level,
         source_site_filter=filters.source_site_noop_filter,
-        rupture_site_filter=filters.rupture_site_noop_filter
+        rupture_site_filter=filters.rupture_site_noop_filter,
+        source_contributions=False
     ):
     """
     Compute hazard curves on a list of sites, given a set of seismic sources
@@ -64,6 +65,14 @@ def hazard_curves_poissonian(
         Optional source-site filter function. See :mod:`nhlib.calc.filters`.
     :param rupture_site_filter:
         Optional rupture-site filter function. See :mod:`nhlib.calc.filters`.
+    :param source_contributions:
+        If ``True``, hazard curves are also computed for each source
+        separately, in the same run. Can also be a function that takes
+        a source object and returns a hashable key of the group it belongs
+        to, in which case curves are computed for groups of sources.
+        Either way the return value changes to a tuple of two items,
+        see below. ``False`` (the default) or ``None`` mean that only
+        total curves are computed.
 
     :returns:
         Dictionary mapping intensity measure type objects (same keys
@@ -72,27 +81,124 @@ def hazard_curves_poissonian(
         are the same as in ``sites`` parameter) and the second one
         differentiates IMLs (the order and length are the same as
         corresponding value in ``imts`` dict).
+
+        If ``source_contributions`` is ``True`` or a function, the result
+        is not a dictionary but a tuple ``(curves, groups)`` of two items:
+        the dictionary described above and a dictionary mapping
+        source ids (or group keys) to tuples of two items. First one
+        is a sorted array of indices of sites that were not filtered
+        out for that source (group). Second is a dictionary of hazard
+        curves of the same structure as total curves dictionary, but
+        with arrays holding only rows of those sites. Total probability
+        of exceedance is one minus product of probabilities of
+        non-exceedance from all the groups.
+
+    :raises ValueError:
+        If ``source_contributions`` is neither a boolean, ``None``
+        nor a callable.
     """
+    if source_contributions is True:
+        get_group = lambda source: source.source_id
+    elif source_contributions is False or source_contributions is None:
+        get_group = None
+    elif callable(source_contributions):
+        get_group = source_contributions
+    else:
+        raise ValueError('source_contributions must be True, False '
+                         'or a function')
     curves = dict((imt, numpy.ones([len(sites), len(imts[imt])]))
                   for imt in imts)
     tom = PoissonTOM(time_span)
+    # maps group keys to tuples of site indices and dictionaries
+    # of probabilities of non-exceedance
+    groups = {}
 
     total_sites = len(sites)
+    # buffers for expanding probabilities of non-exceedance
+    # from filtered collections, reused for all the ruptures
+    expanded = dict((imt, numpy.empty_like(curves[imt])) for imt in imts)
     sources_sites = ((source, sites) for source in sources)
     for source, s_sites in source_site_filter(sources_sites):
+        if get_group:
+            s_indices = _get_indices(s_sites)
+            source_curves = dict(
+                (imt, numpy.ones([len(s_sites), len(imts[imt])]))
+                for imt in imts
+            )
         ruptures_sites = ((rupture, s_sites)
                           for rupture in source.iter_ruptures(tom))
         for rupture, r_sites in rupture_site_filter(ruptures_sites):
             prob = rupture.get_probability_one_or_more_occurrences()
             gsim = gsims[rupture.tectonic_region_type]
             sctx, rctx, dctx = gsim.make_contexts(r_sites, rupture)
+            if get_group:
+                # rows of source's curves for sites affected by rupture
+                positions = s_indices.searchsorted(_get_indices(r_sites))
+            # compute poes for all imts at once
+            imts_poes = gsim.get_poes_for_imts(sctx, rctx, dctx, imts,
+                                               truncation_level)
             for imt in imts:
-                poes = gsim.get_poes(sctx, rctx, dctx, imt, imts[imt],
-                                     truncation_level)
+                non_exceedance = (1 - prob) ** imts_poes[imt]
                 curves[imt] *= r_sites.expand(
-                    (1 - prob) ** poes, total_sites, placeholder=1
+                    non_exceedance, total_sites, placeholder=1,
+                    out=expanded[imt]
                 )
+                if get_group:
+                    source_curves[imt][positions] *= non_exceedance
+        if get_group:
+            _add_to_group(groups, get_group(source), s_indices,
+                          source_curves)
 
     for imt in imts:
         curves[imt] = 1 - curves[imt]
-    return curves
+    if not get_group:
+        return curves
+
+    for group_indices, group_curves in groups.itervalues():
+        for imt in imts:
+            group_curves[imt] = 1 - group_curves[imt]
+    return curves, groups
+
+
+def _get_indices(sites):
+    """
+    Return an array of indices of ``sites`` in the original
+    (unfiltered) site collection.
+    """
+    if sites.indices is None:
+        return numpy.arange(len(sites))
+    return sites.indices
+
+
+def _add_to_group(groups, key, indices, curves):
+    """
+    Combine probabilities of non-exceedance of a source with the ones
+    of its group.
+
+    :param groups:
+        Dictionary mapping group keys to tuples of site indices
+        and dictionaries of probabilities of non-exceedance.
+        Gets updated in place.
+    :param key:
+        Group key.
+    :param indices:
+        Sorted array of indices of sites the source interacts with.
+    :param curves:
+        Dictionary mapping imts to arrays of probabilities
+        of non-exceedance for sites in ``indices``.
+    """
+    if not key in groups:
+        groups[key] = (indices, curves)
+        return
+    group_indices, group_curves = groups[key]
+    if not numpy.array_equal(indices, group_indices):
+        union = numpy.union1d(group_indices, indices)
+        for imt in group_curves:
+            new_curves = numpy.ones([len(union), group_curves[imt].shape[1]])
+            new_curves[union.searchsorted(group_indices)] = group_curves[imt]
+            group_curves[imt] = new_curves
+        group_indices = union
+        groups[key] = (group_indices, group_curves)
+    positions = group_indices.searchsorted(indices)
+    for imt in curves:
+        group_curves[imt][positions] *= curves[imt]
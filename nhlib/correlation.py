@@ -70,8 +70,10 @@ class JB2009CorrelationModel(object):
             # both cases, eq. (19)
             b = 22.0 + 3.7 * period
 
-        # eq. (20)
-        return numpy.exp((- 3.0 / b) * distances)
+        # eq. (20), calculated in place in order not to waste memory
+        # on a temporary matrix
+        distances *= - 3.0 / b
+        return numpy.exp(distances, distances)
 
     def get_lower_triangle_correlation_matrix(self, sites, imt):
         """
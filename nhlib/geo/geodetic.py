@@ -23,6 +23,12 @@ import numpy
 #: Earth radius in km.
 EARTH_RADIUS = 6371.0
 
+#: Memory budget, in bytes, for temporary arrays of pure-python
+#: implementations of :func:`min_distance` and :func:`min_geodetic_distance`.
+#: Target points are processed in blocks small enough for the matrices
+#: of distances between a block and all the mesh points to fit the budget.
+MIN_DISTANCE_MEMORY_BUDGET = 32 * 1024 ** 2
+
 
 def geodetic_distance(lons1, lats1, lons2, lats2):
     """
@@ -89,7 +95,7 @@ def distance(lons1, lats1, depths1, lons2, lats2, depths2):
     return numpy.sqrt(hdist ** 2 + vdist ** 2)
 
 
-def min_geodetic_distance(mlons, mlats, slons, slats):
+def min_geodetic_distance(mlons, mlats, slons, slats, srad=None):
     """
     Same as :func:`min_distance`, but calculates only minimum geodetic distance
     (doesn't accept depth values) and doesn't support ``indices=True`` mode.
@@ -98,26 +104,26 @@ def min_geodetic_distance(mlons, mlats, slons, slats):
     for calculating the minimum distance between first mesh and each point
     of the second mesh when both are defined on the earth surface.
     """
-    mlons, mlats, slons, slats = _prepare_coords(mlons, mlats, slons, slats)
+    mlons, mlats, slons, slats, cos_slats = _prepare_site_coords(
+        mlons, mlats, slons, slats, srad
+    )
     orig_shape = slons.shape
-    if slons.ndim == 0:
-        slons = slons.reshape((1, ))
-        slats = slats.reshape((1, ))
+    mlons, mlats = mlons.reshape(-1), mlats.reshape(-1)
+    slons, slats = slons.reshape(-1), slats.reshape(-1)
     cos_mlats = numpy.cos(mlats)
-    cos_slats = numpy.cos(slats)
-
-    result = numpy.fromiter(
-        (
-            # next five lines are the same as in geodetic_distance()
-            numpy.arcsin(numpy.sqrt(
-                numpy.sin((mlats - slats[i]) / 2.0) ** 2.0
-                + cos_mlats * cos_slats[i]
-                  * numpy.sin((mlons - slons[i]) / 2.0) ** 2.0
-            ).clip(-1., 1.)).min()
-            for i in xrange(len(slats))
-        ),
-        dtype=float, count=len(slats)
-    ) * (2 * EARTH_RADIUS)
+    cos_slats = cos_slats.reshape(-1)
+
+    result = numpy.empty(len(slats))
+    for block in _site_blocks(len(mlats), len(slats)):
+        # arcsin and sqrt are both monotonic, so it is enough
+        # to find the minimum of the haversine
+        result[block] = _haversine_block(
+            mlons, mlats, cos_mlats,
+            slons[block], slats[block], cos_slats[block]
+        ).min(axis=1)
+    # the rest is the same as in geodetic_distance()
+    result = numpy.arcsin(numpy.sqrt(result).clip(-1., 1.))
+    result *= 2 * EARTH_RADIUS
 
     if not orig_shape:
         # original target point was a scalar, so return scalar as well
@@ -127,7 +133,8 @@ def min_geodetic_distance(mlons, mlats, slons, slats):
         return result.reshape(orig_shape)
 
 
-def min_distance(mlons, mlats, mdepths, slons, slats, sdepths, indices=False):
+def min_distance(mlons, mlats, mdepths, slons, slats, sdepths, indices=False,
+                 srad=None):
     """
     Calculate the minimum distance between a collection of points and a point.
 
@@ -155,6 +162,12 @@ def min_distance(mlons, mlats, mdepths, slons, slats, sdepths, indices=False):
         form of ``mlons``, ``mlats`` and ``mdepths`` that is closest to a
         point from ``slons``, ``slats`` and ``sdepths``. There is one integer
         index per point in second triple of coordinates.
+    :param srad:
+        Optional tuple of three numpy arrays of the same shape as ``slons``:
+        longitudes and latitudes of the second collection in radians
+        and cosines of latitudes. If provided, these are used instead
+        of converting ``slons`` and ``slats`` (which should represent
+        the same points). See :meth:`nhlib.geo.mesh.Mesh.get_rad_coords`.
     :returns:
         Minimum distance in km or indices of closest points, depending on
         ``indices`` parameter. Result value is a scalar if ``slons``, ``slats``
@@ -162,7 +175,9 @@ def min_distance(mlons, mlats, mdepths, slons, slats, sdepths, indices=False):
         of those three otherwise.
     """
     assert not indices or mlons.ndim > 0
-    mlons, mlats, slons, slats = _prepare_coords(mlons, mlats, slons, slats)
+    mlons, mlats, slons, slats, cos_slats = _prepare_site_coords(
+        mlons, mlats, slons, slats, srad
+    )
     mdepths = numpy.array(mdepths, float)
     sdepths = numpy.array(sdepths, float)
     assert mlons.shape == mdepths.shape
@@ -178,26 +193,34 @@ def min_distance(mlons, mlats, mdepths, slons, slats, sdepths, indices=False):
     sdepths = sdepths.reshape(-1)
 
     cos_mlats = numpy.cos(mlats)
-    cos_slats = numpy.cos(slats)
-
-    dist_squares = (
-        # next five lines are the same as in geodetic_distance()
-        (numpy.arcsin(numpy.sqrt(
-            numpy.sin((mlats - slats[i]) / 2.0) ** 2.0
-            + cos_mlats * cos_slats[i]
-              * numpy.sin((mlons - slons[i]) / 2.0) ** 2.0
-        ).clip(-1., 1.)) * (2 * EARTH_RADIUS)) ** 2
-        + (mdepths - sdepths[i]) ** 2
-        for i in xrange(len(slats))
-    )
+    cos_slats = cos_slats.reshape(-1)
+
     if not indices:
-        result = numpy.fromiter((numpy.sqrt(numpy.min(dist_sq))
-                                 for dist_sq in dist_squares),
-                                dtype=float, count=len(slats))
+        result = numpy.empty(len(slats), dtype=float)
     else:
-        result = numpy.fromiter((numpy.argmin(dsq, axis=-1)
-                                 for dsq in dist_squares),
-                                dtype=int, count=len(slats))
+        result = numpy.empty(len(slats), dtype=int)
+    for block in _site_blocks(len(mlats), len(slats)):
+        dist_sq = _haversine_block(
+            mlons, mlats, cos_mlats,
+            slons[block], slats[block], cos_slats[block]
+        )
+        # next lines are the same as in geodetic_distance()
+        # and distance(), but done in place
+        numpy.sqrt(dist_sq, dist_sq)
+        dist_sq.clip(-1., 1., dist_sq)
+        numpy.arcsin(dist_sq, dist_sq)
+        dist_sq *= 2 * EARTH_RADIUS
+        numpy.square(dist_sq, dist_sq)
+        vdist_sq = numpy.subtract.outer(sdepths[block], mdepths)
+        numpy.square(vdist_sq, vdist_sq)
+        dist_sq += vdist_sq
+        del vdist_sq
+        if not indices:
+            result[block] = dist_sq.min(axis=1)
+        else:
+            result[block] = dist_sq.argmin(axis=1)
+    if not indices:
+        numpy.sqrt(result, result)
 
     if not orig_shape:
         # original target point was a scalar, so return scalar as well
@@ -414,6 +437,133 @@ def distance_to_arc(alon, alat, aazimuth, plons, plats):
     return (numpy.pi / 2 - angle) * EARTH_RADIUS
 
 
+def equirectangular_filter(lon, lat, slons, slats, radius, srad=None):
+    """
+    Find out which of target points are within ``radius`` km along the earth
+    surface from the reference point without calculating exact distances
+    for most of them.
+
+    Geodetic distance ``d`` between two points is defined by the haversine
+    ``h = sin(d / 2R) ** 2 = sin(dlat / 2) ** 2 + k * sin(dlon / 2) ** 2``,
+    where ``R`` is the earth radius, ``dlat`` and ``dlon`` are differences
+    between latitudes and longitudes (the latter taken the shortest way
+    around the globe) and ``k`` is the product of cosines of latitudes
+    of two points. Replacing sines by their arguments gives the squared
+    equirectangular (local projection) distance
+    ``e = (dlat / 2) ** 2 + k * (dlon / 2) ** 2``, which requires no
+    trigonometry once cosines of target points' latitudes are known.
+    Since ``x ** 2 - x ** 4 / 3 <= sin(x) ** 2 <= x ** 2`` holds for any
+    ``x``, the exact value is bounded by
+    ``e - ((dlat / 2) ** 4 + k * (dlon / 2) ** 4) / 3 <= h <= e``.
+    Points for which upper bound is within the radius are certainly closer,
+    points for which lower bound is over the radius are certainly farther.
+    For the rest, the uncertainty band, exact distance has to be calculated.
+    Far from the poles the band is approximately
+    ``radius ** 3 / (24 * R ** 2 * cos(lat) ** 2)`` km thick, that is
+    28 meters for radius of 300 km around a point on the equator.
+    It gets wider when the radius approaches the pole, as the difference
+    in longitudes is no longer small there.
+
+    :param lon, lat:
+        Coordinates of the reference point in decimal degrees.
+    :param slons, slats:
+        Numpy arrays of coordinates of target points in decimal degrees.
+    :param radius:
+        Distance in km.
+    :param srad:
+        Optional tuple of precomputed longitudes and latitudes of target
+        points in radians and cosines of latitudes, see :func:`min_distance`.
+    :returns:
+        Tuple of two numpy arrays of booleans of the same shape as ``slons``.
+        The first one has ``True`` for points that are closer than
+        ``radius`` km to the reference point, the second one for points
+        in the uncertainty band.
+    """
+    if srad is None:
+        slons = numpy.radians(slons)
+        slats = numpy.radians(slats)
+        cos_slats = numpy.cos(slats)
+    else:
+        slons, slats, cos_slats = srad
+    if radius >= numpy.pi * EARTH_RADIUS:
+        # radius covers the whole globe
+        return (numpy.ones(slons.shape, dtype=bool),
+                numpy.zeros(slons.shape, dtype=bool))
+    lon, lat = numpy.radians(lon), numpy.radians(lat)
+    threshold = numpy.sin(radius / (2.0 * EARTH_RADIUS)) ** 2
+
+    half_dlat_sq = slats - lat
+    half_dlat_sq /= 2.0
+    numpy.square(half_dlat_sq, half_dlat_sq)
+    half_dlon_sq = slons - lon
+    numpy.abs(half_dlon_sq, half_dlon_sq)
+    half_dlon_sq %= 2 * numpy.pi
+    numpy.minimum(half_dlon_sq, 2 * numpy.pi - half_dlon_sq, half_dlon_sq)
+    half_dlon_sq /= 2.0
+    numpy.square(half_dlon_sq, half_dlon_sq)
+    cos_prod = cos_slats * numpy.cos(lat)
+
+    upper = half_dlon_sq * cos_prod
+    upper += half_dlat_sq
+    numpy.square(half_dlat_sq, half_dlat_sq)
+    numpy.square(half_dlon_sq, half_dlon_sq)
+    half_dlon_sq *= cos_prod
+    half_dlat_sq += half_dlon_sq
+    half_dlat_sq /= 3.0
+    lower = upper - half_dlat_sq
+
+    # margins protect from rounding errors in the bounds
+    closer = upper <= threshold * (1 - 1e-9)
+    unsure = lower <= threshold * (1 + 1e-9)
+    unsure &= ~closer
+    return closer, unsure
+
+
+def _site_blocks(num_mesh_points, num_sites):
+    """
+    Split the collection of target points in blocks small enough to keep
+    temporary arrays of pure-python implementations of :func:`min_distance`
+    and :func:`min_geodetic_distance` within
+    :data:`MIN_DISTANCE_MEMORY_BUDGET`.
+
+    :returns:
+        Generator of slice objects, covering all the target points.
+    """
+    # there are up to three (sites in block x mesh points) arrays
+    # of doubles alive at the same time
+    block_size = MIN_DISTANCE_MEMORY_BUDGET // (3 * 8 * num_mesh_points)
+    block_size = max(block_size, 1)
+    for start in xrange(0, num_sites, block_size):
+        yield slice(start, start + block_size)
+
+
+def _haversine_block(mlons, mlats, cos_mlats, slons, slats, cos_slats):
+    """
+    Calculate the haversine of the central angle between each point
+    of a block of target points and each point of a mesh.
+
+    All the parameters are 1d numpy arrays, coordinates are in radians.
+
+    :returns:
+        2d numpy array of shape ``(len(slons), len(mlons))``, a square
+        of the sine of half the central angle. Geodetic distance is
+        ``2 * EARTH_RADIUS * arcsin(sqrt(result))``.
+    """
+    result = numpy.subtract.outer(slats, mlats)
+    result /= 2.0
+    numpy.sin(result, result)
+    numpy.square(result, result)
+    sin_dlon = numpy.subtract.outer(slons, mlons)
+    sin_dlon /= 2.0
+    numpy.sin(sin_dlon, sin_dlon)
+    numpy.square(sin_dlon, sin_dlon)
+    cos_prod = numpy.multiply.outer(cos_slats, cos_mlats)
+    cos_prod *= sin_dlon
+    del sin_dlon
+    result += cos_prod
+    return result
+
+
 def _prepare_coords(lons1, lats1, lons2, lats2):
     """
     Convert two pairs of spherical coordinates in decimal degrees
@@ -429,6 +579,24 @@ def _prepare_coords(lons1, lats1, lons2, lats2):
     return lons1, lats1, lons2, lats2
 
 
+def _prepare_site_coords(mlons, mlats, slons, slats, srad):
+    """
+    Convert coordinates of mesh points to radians and get coordinates
+    of target points in radians along with cosines of their latitudes,
+    either from precomputed tuple ``srad`` or from ``slons`` and ``slats``.
+    """
+    if srad is None:
+        mlons, mlats, slons, slats = _prepare_coords(mlons, mlats,
+                                                     slons, slats)
+        cos_slats = numpy.cos(slats)
+    else:
+        mlons = numpy.array(numpy.radians(mlons))
+        mlats = numpy.array(numpy.radians(mlats))
+        assert mlons.shape == mlats.shape
+        slons, slats, cos_slats = srad
+    return mlons, mlats, slons, slats, cos_slats
+
+
 try:
     from nhlib.geo import _geodetic_speedups
 except ImportError:
@@ -438,29 +606,79 @@ except ImportError:
 else:
     from nhlib import speedups
 
-    def _c_min_geodetic_distance(mlons, mlats, slons, slats):
-        mlons, mlats, slons, slats = _prepare_coords(mlons, mlats,
-                                                     slons, slats)
+    def _c_min_distance_chunked(mlons, mlats, mdepths,
+                                slons, slats, sdepths, indices):
+        """
+        Call the C extension, splitting the target points between threads
+        if :data:`nhlib.speedups.THREADS` allows so.
+
+        All the coordinates are expected to be in radians already.
+        """
+        if speedups.THREADS <= 1 or slons.size < 2 * speedups.MIN_CHUNK_SIZE:
+            return _geodetic_speedups.min_distance(mlons, mlats, mdepths,
+                                                   slons, slats, sdepths,
+                                                   indices)
+        shape = slons.shape
+        slons, slats = slons.ravel(), slats.ravel()
+        if sdepths.ndim:
+            sdepths = sdepths.ravel()
+
+        def chunk(sl):
+            return _geodetic_speedups.min_distance(
+                mlons, mlats, mdepths, slons[sl], slats[sl],
+                sdepths[sl] if sdepths.ndim else sdepths, indices
+            )
+        return speedups.map_chunks(chunk, slons.size).reshape(shape)
+
+    def _c_min_geodetic_distance(mlons, mlats, slons, slats, srad=None):
+        # the extension doesn't use cosines of latitudes
+        mlons, mlats, slons, slats, _ = _prepare_site_coords(
+            mlons, mlats, slons, slats, srad
+        )
         mdepths = sdepths = numpy.array(0.0)
-        return _geodetic_speedups.min_distance(mlons, mlats, mdepths,
-                                               slons, slats, sdepths,
-                                               indices=False)
+        return _c_min_distance_chunked(mlons, mlats, mdepths,
+                                       slons, slats, sdepths, False)
+
+    def _min_geodetic_distance_size(mlons, mlats, slons, slats, srad=None):
+        return numpy.size(mlons) * numpy.size(slons)
 
-    speedups.register(min_geodetic_distance, _c_min_geodetic_distance)
-    del _c_min_geodetic_distance
+    def _min_geodetic_distance_sample(size):
+        # mesh of up to a hundred points and as many target
+        # points as needed to get the problem of requested size
+        mlons = numpy.linspace(10, 11, min(size, 100))
+        slons = numpy.linspace(9, 12, max(size // len(mlons), 1))
+        return (mlons, mlons * 0.5, slons, slons * 0.5), {}
+
+    speedups.register(min_geodetic_distance, _c_min_geodetic_distance,
+                      size=_min_geodetic_distance_size,
+                      sample=_min_geodetic_distance_sample)
+    del _c_min_geodetic_distance, _min_geodetic_distance_size, \
+        _min_geodetic_distance_sample
 
 
     def _c_min_distance(mlons, mlats, mdepths,
-                        slons, slats, sdepths, indices=False):
+                        slons, slats, sdepths, indices=False, srad=None):
         assert not indices or mlons.ndim > 0
-        mlons, mlats, slons, slats = _prepare_coords(mlons, mlats,
-                                                     slons, slats)
+        mlons, mlats, slons, slats, _ = _prepare_site_coords(
+            mlons, mlats, slons, slats, srad
+        )
         mdepths = numpy.array(mdepths, float)
         sdepths = numpy.array(sdepths, float)
         assert mlons.shape == mdepths.shape
         assert slons.shape == sdepths.shape
-        return _geodetic_speedups.min_distance(mlons, mlats, mdepths,
-                                               slons, slats, sdepths, indices)
-
-    speedups.register(min_distance, _c_min_distance)
-    del _c_min_distance
+        return _c_min_distance_chunked(mlons, mlats, mdepths,
+                                       slons, slats, sdepths, indices)
+
+    def _min_distance_size(mlons, mlats, mdepths, slons, slats, sdepths,
+                           indices=False, srad=None):
+        return numpy.size(mlons) * numpy.size(slons)
+
+    def _min_distance_sample(size):
+        mlons = numpy.linspace(10, 11, min(size, 100))
+        slons = numpy.linspace(9, 12, max(size // len(mlons), 1))
+        return (mlons, mlons * 0.5, mlons * 10,
+                slons, slons * 0.5, slons * 0), {}
+
+    speedups.register(min_distance, _c_min_distance,
+                      size=_min_distance_size, sample=_min_distance_sample)
+    del _c_min_distance, _min_distance_size, _min_distance_sample
@@ -19,8 +19,10 @@ Module :mod:`nhlib.geo.mesh` defines classes :class:`Mesh` and its subclass
 :class:`RectangularMesh`.
 """
 import numpy
+import scipy.spatial
 import shapely.geometry
 import shapely.ops
+import shapely.prepared
 
 from nhlib.geo.point import Point
 from nhlib.geo import geodetic
@@ -50,6 +52,32 @@ class Mesh(object):
     #: approximation is required -- set to 5 meters.
     DIST_TOLERANCE = 0.005
 
+    #: Projection and enclosing polygon of the mesh used for calculating
+    #: Joyner-Boore distance, see :meth:`_get_jb_geometry`.
+    _jb_geometry = None
+
+    #: Minimum product of numbers of points in this mesh and in the target
+    #: one for :meth:`get_min_distance` and :meth:`get_closest_points`
+    #: to use a spatial tree instead of brute force search,
+    #: see :meth:`_kdtree_min_distance`.
+    KDTREE_THRESHOLD = 1000000
+    #: Number of nearest neighbours to query from the spatial tree
+    #: for each target point.
+    KDTREE_NEIGHBOURS = 8
+
+    #: Spatial tree of the mesh points, see :meth:`_get_kdtree`.
+    _kdtree = None
+
+    #: Memory budget in bytes for intermediate storage
+    #: of :meth:`get_distance_matrix`.
+    DISTANCE_MATRIX_BLOCK_MEMORY = 64 * 1024 ** 2
+
+    #: Coordinates in radians and cosines of latitudes,
+    #: see :meth:`get_rad_coords`.
+    _rad_coords = None
+    #: Cartesian coordinates of the points, see :meth:`get_cartesian`.
+    _cartesian = None
+
     def __init__(self, lons, lats, depths):
         assert (isinstance(lons, numpy.ndarray)
                 and isinstance(lats, numpy.ndarray)
@@ -143,6 +171,47 @@ class Mesh(object):
         """
         return self.lons.size
 
+    def get_rad_coords(self):
+        """
+        Get coordinates of the mesh points in radians along with cosines
+        of latitudes.
+
+        Values are calculated only once for the mesh and reused in all
+        the subsequent calls, so the mesh is assumed not to be modified
+        in place. This saves trigonometry when calculating distances
+        to the same mesh (typically the one of a site collection)
+        from many ruptures.
+
+        :returns:
+            Tuple of three numpy arrays of the same shape as the mesh:
+            longitudes and latitudes in radians and cosines of latitudes.
+            Suitable for ``srad`` parameter of
+            :func:`nhlib.geo.geodetic.min_distance` and
+            :func:`nhlib.geo.geodetic.min_geodetic_distance`.
+        """
+        if self._rad_coords is None:
+            lons = numpy.radians(self.lons)
+            lats = numpy.radians(self.lats)
+            self._rad_coords = (lons, lats, numpy.cos(lats))
+        return self._rad_coords
+
+    def get_cartesian(self):
+        """
+        Get position vectors of the mesh points in Cartesian space.
+
+        Values are calculated only once for the mesh, see
+        :meth:`get_rad_coords`.
+
+        :returns:
+            Numpy array of the shape of the mesh plus one dimension of size
+            3, as returned by :func:`nhlib.geo.utils.spherical_to_cartesian`.
+        """
+        if self._cartesian is None:
+            self._cartesian = geo_utils.spherical_to_cartesian(
+                self.lons, self.lats, self.depths
+            )
+        return self._cartesian
+
     def get_min_distance(self, mesh):
         """
         Compute and return the minimum distance from the mesh to each point
@@ -156,7 +225,9 @@ class Mesh(object):
         this mesh to each point of the target mesh and returns the lowest found
         for each.
 
-        Uses :func:`nhlib.geo.geodetic.min_distance`.
+        Uses :func:`nhlib.geo.geodetic.min_distance` or, if the product
+        of sizes of both meshes is over :attr:`KDTREE_THRESHOLD`,
+        :meth:`_kdtree_min_distance`.
         """
         return self._geodetic_min_distance(mesh, indices=False)
 
@@ -183,7 +254,8 @@ class Mesh(object):
         # depends on mesh spacing. but the difference can be neglected
         # if calculated geodetic distance is over some threshold.
         distances = geodetic.min_geodetic_distance(self.lons, self.lats,
-                                                   mesh.lons, mesh.lats)
+                                                   mesh.lons, mesh.lats,
+                                                   mesh.get_rad_coords())
 
         # here we find the points for which calculated mesh-to-mesh
         # distance is below a threshold. this threshold is arbitrary:
@@ -223,16 +295,12 @@ class Mesh(object):
         # to polygon distance, which gives the most accurate value
         # of distance in km (and that value is zero for points inside
         # the polygon).
-        proj, polygon = self._get_proj_enclosing_polygon()
-        if not isinstance(polygon, shapely.geometry.Polygon):
-            # either line or point is our enclosing polygon. draw
-            # a square with side of 10 m around in order to have
-            # a proper polygon instead.
-            polygon = polygon.buffer(self.DIST_TOLERANCE, 1)
+        proj, polygon, prepared = self._get_jb_geometry()
         mesh_lons, mesh_lats = mesh.lons.take(idxs), mesh.lats.take(idxs)
         mesh_xx, mesh_yy = proj(mesh_lons, mesh_lats)
-        distances_2d = geo_utils.point_to_polygon_distance(polygon,
-                                                           mesh_xx, mesh_yy)
+        distances_2d = geo_utils.point_to_polygon_distance(
+            polygon, mesh_xx, mesh_yy, prepared
+        )
 
         # replace geodetic distance values for points-closer-than-the-threshold
         # by more accurate point-to-polygon distance values.
@@ -240,6 +308,31 @@ class Mesh(object):
 
         return distances
 
+    def _get_jb_geometry(self):
+        """
+        Get projection and enclosing polygon of the mesh for calculating
+        Joyner-Boore distance.
+
+        Geometries are created only once for the mesh and reused in all
+        the subsequent calls, so the mesh is assumed not to be modified
+        in place.
+
+        :returns:
+            Tuple of three items: projection function, shapely polygon
+            (see :meth:`_get_proj_enclosing_polygon`) and shapely prepared
+            geometry for the same polygon.
+        """
+        if self._jb_geometry is None:
+            proj, polygon = self._get_proj_enclosing_polygon()
+            if not isinstance(polygon, shapely.geometry.Polygon):
+                # either line or point is our enclosing polygon. draw
+                # a square with side of 10 m around in order to have
+                # a proper polygon instead.
+                polygon = polygon.buffer(self.DIST_TOLERANCE, 1)
+            self._jb_geometry = (proj, polygon,
+                                 shapely.prepared.prep(polygon))
+        return self._jb_geometry
+
     def get_closest_points(self, mesh):
         """
         Find closest point of this mesh for each one in ``mesh``.
@@ -249,7 +342,8 @@ class Mesh(object):
             points from this one at respective indices.
 
         This method is in general very similar to :meth:`get_min_distance`
-        and uses the same :func:`nhlib.geo.geodetic.min_distance` internally.
+        and uses the same :func:`nhlib.geo.geodetic.min_distance` internally
+        (or a spatial tree for big meshes, see :meth:`_kdtree_min_distance`).
         """
         idxs = self._geodetic_min_distance(mesh, indices=True)
         lons = self.lons.take(idxs)
@@ -270,40 +364,188 @@ class Mesh(object):
             depths2 = numpy.zeros_like(mesh.lons)
         else:
             depths2 = mesh.depths
+        if len(self) * len(mesh) > self.KDTREE_THRESHOLD:
+            return self._kdtree_min_distance(mesh, depths2, indices)
         return geodetic.min_distance(self.lons, self.lats, depths1,
-                                     mesh.lons, mesh.lats, depths2, indices)
+                                     mesh.lons, mesh.lats, depths2, indices,
+                                     mesh.get_rad_coords())
 
-    def get_distance_matrix(self):
+    def _get_kdtree(self):
+        """
+        Get the spatial tree of points of the mesh in 3d Cartesian space
+        (see :func:`nhlib.geo.utils.spherical_to_cartesian`).
+
+        The tree is built only once for the mesh and reused in all
+        the subsequent calls, so the mesh is assumed not to be modified
+        in place.
+
+        :returns:
+            Tuple of :class:`scipy.spatial.cKDTree` and flattened arrays
+            of longitudes, latitudes and depths of the mesh points.
+        """
+        if self._kdtree is None:
+            lons = self.lons.reshape(-1)
+            lats = self.lats.reshape(-1)
+            if self.depths is None:
+                depths = numpy.zeros_like(lons)
+            else:
+                depths = self.depths.reshape(-1)
+            vectors = geo_utils.spherical_to_cartesian(lons, lats, depths)
+            self._kdtree = (scipy.spatial.cKDTree(vectors),
+                            lons, lats, depths)
+        return self._kdtree
+
+    def _kdtree_min_distance(self, mesh, depths, indices):
+        """
+        Find the minimum distance (or index of the closest point) from
+        this mesh to each of target points using spatial tree.
+
+        For each target point :attr:`KDTREE_NEIGHBOURS` nearest mesh points
+        are found in Cartesian space and the exact distance is then
+        calculated to each of them the same way as in
+        :func:`nhlib.geo.geodetic.distance`. Straight-line distance between
+        two points is never longer than the distance along the earth surface
+        combined with depth difference (as long as the points are not above
+        the surface), so if the farthest of the neighbours is not closer
+        in Cartesian space than the closest one is along the surface,
+        no other point of the mesh can be closer. Target points for which
+        that doesn't hold are processed by brute force. So the result
+        is the same as of :func:`nhlib.geo.geodetic.min_distance`
+        up to floating point rounding (which is below a micrometer);
+        indices can only differ if several mesh points are equally distant
+        from the target one.
+
+        :param mesh:
+            :class:`Mesh` of target points.
+        :param depths:
+            Numpy array of depths of target points, zeros if ``mesh``
+            doesn't have them.
+        :param indices:
+            Same as in :func:`nhlib.geo.geodetic.min_distance`.
+        :returns:
+            Numpy array of the same shape as ``mesh`` with distances
+            in km or indices of points in flattened mesh.
+        """
+        tree, mlons, mlats, mdepths = self._get_kdtree()
+        shape = mesh.shape
+        lons = mesh.lons.reshape(-1)
+        lats = mesh.lats.reshape(-1)
+        depths = depths.reshape(-1)
+        num_neighbours = min(self.KDTREE_NEIGHBOURS, len(mlons))
+        vectors = mesh.get_cartesian().reshape((-1, 3))
+        chords, candidates = tree.query(vectors, num_neighbours)
+        if num_neighbours == 1:
+            chords = chords.reshape((-1, 1))
+            candidates = candidates.reshape((-1, 1))
+        dists = geodetic.distance(
+            mlons[candidates], mlats[candidates], mdepths[candidates],
+            lons.reshape((-1, 1)), lats.reshape((-1, 1)),
+            depths.reshape((-1, 1))
+        )
+        closest = dists.argmin(axis=1)
+        rows = numpy.arange(len(lons))
+        result = dists[rows, closest]
+
+        if num_neighbours < len(mlons):
+            # points above the surface are farther from the earth center
+            # and straight lines between them can be longer than
+            # the distance along the surface. take that into account
+            min_depth = min(mdepths.min(), depths.min(), 0)
+            scale = (geodetic.EARTH_RADIUS - min_depth) / geodetic.EARTH_RADIUS
+            # add a margin for rounding errors of Cartesian coordinates
+            [unsure] = (chords[:, -1] < result * scale * (1 + 1e-9)).nonzero()
+        else:
+            unsure = []
+
+        if indices:
+            result = candidates[rows, closest]
+        if len(unsure):
+            result[unsure] = geodetic.min_distance(
+                mlons, mlats, mdepths,
+                lons[unsure], lats[unsure], depths[unsure], indices
+            )
+        return result.reshape(shape)
+
+    def get_distance_matrix(self, out=None, dtype=float, condensed=False):
         """
         Compute and return distances between each pairs of points in the mesh.
 
         This method requires that all the points lie on Earth surface (have
         zero depth) and coordinate arrays are one-dimensional.
 
+        The matrix is filled in by blocks of rows, so that intermediate
+        storage doesn't exceed :attr:`DISTANCE_MATRIX_BLOCK_MEMORY`.
+        Since the matrix is symmetric, only the cells on and above the main
+        diagonal are actually calculated.
+
         .. warning::
             Because of its quadratic space and time complexity this method
             is safe to use for meshes of up to several thousand points. For
-            mesh of 10k points it needs ~800 Mb for just the resulting matrix
-            and four times that much for intermediate storage.
-
+            mesh of 10k points it needs ~800 Mb for the resulting matrix
+            of doubles. Use ``dtype``, ``condensed`` and ``out`` (which can
+            be a :class:`numpy.memmap`) parameters to reduce the memory
+            footprint for bigger meshes.
+
+        :param out:
+            Optional preallocated numpy array of the expected shape (see
+            below) to store the result in. If provided, ``dtype`` is ignored.
+        :param dtype:
+            Numpy dtype for the result array, defaults to double.
+            Single precision floats give the error of a few meters
+            for distances of thousands of kilometers.
+        :param condensed:
+            If ``True``, only the part above the main diagonal is stored,
+            in a form of one-dimensional array of ``n * (n - 1) / 2``
+            distances, where ``n`` is the number of points in the mesh.
+            Distance between points ``i`` and ``j`` (where ``i < j``)
+            has the index ``i * (2 * n - i - 1) / 2 + j - i - 1``, which
+            is the same as in :func:`scipy.spatial.distance.squareform`.
         :returns:
-            Two-dimensional numpy array, square matrix of distances. The matrix
-            has zeros on main diagonal and positive distances in kilometers
-            on all other cells. That is, value in cell (3, 5) is the distance
-            between mesh's points 3 and 5 in km, and it is equal to value
-            in cell (5, 3).
+            Two-dimensional numpy matrix, square matrix of distances. The
+            matrix has zeros on main diagonal and positive distances in
+            kilometers on all other cells. That is, value in cell (3, 5) is
+            the distance between mesh's points 3 and 5 in km, and it is equal
+            to value in cell (5, 3). If ``condensed`` is ``True``,
+            one-dimensional numpy array is returned instead.
 
         Uses :func:`nhlib.geo.geodetic.geodetic_distance`.
         """
         assert self.lons.ndim == 1
         assert self.depths is None or (self.depths == 0).all()
-        distances = geodetic.geodetic_distance(
-            self.lons.reshape(self.lons.shape + (1, )),
-            self.lats.reshape(self.lats.shape + (1, )),
-            self.lons,
-            self.lats
-        )
-        return numpy.matrix(distances, copy=False)
+        num_points = len(self.lons)
+        if condensed:
+            shape = (num_points * (num_points - 1) // 2, )
+        else:
+            shape = (num_points, num_points)
+        if out is None:
+            out = numpy.empty(shape, dtype)
+        else:
+            assert out.shape == shape
+
+        # geodetic_distance() needs up to five temporary arrays
+        # of doubles of the size of the block
+        block_size = self.DISTANCE_MATRIX_BLOCK_MEMORY // (5 * 8 * num_points)
+        block_size = max(block_size, 1)
+        for start in xrange(0, num_points, block_size):
+            stop = min(start + block_size, num_points)
+            block = geodetic.geodetic_distance(
+                self.lons[start:stop].reshape((-1, 1)),
+                self.lats[start:stop].reshape((-1, 1)),
+                self.lons[start:],
+                self.lats[start:]
+            )
+            if condensed:
+                for i in xrange(start, stop):
+                    offset = i * (2 * num_points - i - 1) // 2
+                    out[offset:offset + num_points - i - 1] = \
+                            block[i - start, i - start + 1:]
+            else:
+                out[start:stop, start:] = block
+                out[start:, start:stop] = block.transpose()
+
+        if condensed:
+            return out
+        return numpy.matrix(out, copy=False)
 
     def _get_proj_convex_hull(self):
         """
@@ -275,11 +275,32 @@ class Point(object):
             distances to points of the mesh. Points of the mesh that
             lie exactly ``radius`` km away from this point also have
             ``True`` in their indices.
+
+        If the mesh doesn't have depths, most of the points are classified
+        without calculating exact distances, using
+        :func:`~nhlib.geo.geodetic.equirectangular_filter`. The result
+        is the same.
         """
-        dists = geodetic.distance(self.longitude, self.latitude, self.depth,
-                                  mesh.lons, mesh.lats,
-                                  0 if mesh.depths is None else mesh.depths)
-        return dists <= radius
+        if mesh.depths is not None:
+            dists = geodetic.distance(self.longitude, self.latitude,
+                                      self.depth, mesh.lons, mesh.lats,
+                                      mesh.depths)
+            return dists <= radius
+        if self.depth > radius:
+            return numpy.zeros(mesh.shape, dtype=bool)
+        # vertical distance is the same for all the points of the mesh,
+        # so we can find the radius along the earth surface
+        hradius = (radius ** 2 - self.depth ** 2) ** 0.5
+        closer, unsure = geodetic.equirectangular_filter(
+            self.longitude, self.latitude, mesh.lons, mesh.lats, hradius,
+            mesh.get_rad_coords()
+        )
+        if unsure.any():
+            dists = geodetic.distance(self.longitude, self.latitude,
+                                      self.depth, mesh.lons[unsure],
+                                      mesh.lats[unsure], 0)
+            closer[unsure] = dists <= radius
+        return closer
 
     @classmethod
     def from_vector(cls, vector):
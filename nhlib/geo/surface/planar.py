@@ -248,8 +248,16 @@ class PlanarSurface(BaseSurface):
             and surface's plane in km, "x" and "y" coordinates of points'
             projections to the plane (in a surface's coordinate space).
         """
-        points = geo_utils.spherical_to_cartesian(lons, lats, depths)
+        return self._project_points(
+            geo_utils.spherical_to_cartesian(lons, lats, depths)
+        )
 
+    def _project_points(self, points):
+        """
+        Same as :meth:`_project`, but takes Cartesian coordinates
+        of points, as returned by
+        :func:`~nhlib.geo.utils.spherical_to_cartesian`.
+        """
         # uses method from http://www.9math.com/book/projection-point-plane
         dists = (self.normal * points).sum(axis=-1) + self.d
         t0 = - dists
@@ -290,7 +298,7 @@ class PlanarSurface(BaseSurface):
         # the surface (translating coordinates of the projections to a local
         # 2d space) and at the same time calculate the distance to that
         # plane.
-        dists, xx, yy = self._project(mesh.lons, mesh.lats, mesh.depths)
+        dists, xx, yy = self._project_points(mesh.get_cartesian())
         # the actual resulting distance is a square root of squares
         # of a distance from a point to a plane that contains the surface
         # and a distance from a projection of that point on that plane
@@ -371,7 +379,7 @@ class PlanarSurface(BaseSurface):
         This is an optimized version specific to planar surface that doesn't
         make use of the mesh.
         """
-        dists, xx, yy = self._project(mesh.lons, mesh.lats, mesh.depths)
+        dists, xx, yy = self._project_points(mesh.get_cartesian())
         mxx = xx.clip(0, self.length)
         myy = yy.clip(0, self.width)
         dists.fill(0)
@@ -453,7 +461,8 @@ class PlanarSurface(BaseSurface):
         # corners' projections (we might not need all of those but it's
         # better to do that calculation once for all).
         dists_to_corners = geodetic.min_geodetic_distance(
-            self.corner_lons, self.corner_lats, mesh.lons, mesh.lats
+            self.corner_lons, self.corner_lats, mesh.lons, mesh.lats,
+            mesh.get_rad_coords()
         )
 
         # extract from ``dists_to_arcs`` signs (represent relative positions
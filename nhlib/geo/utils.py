@@ -315,7 +315,7 @@ def normalized(vector):
     return vector / length
 
 
-def point_to_polygon_distance(polygon, pxx, pyy):
+def point_to_polygon_distance(polygon, pxx, pyy, prepared=None):
     """
     Calculate the distance to polygon for each point of the collection
     on the 2d Cartesian plane.
@@ -327,6 +327,10 @@ def point_to_polygon_distance(polygon, pxx, pyy):
         the distance from.
     :param pyy:
         Same structure as ``pxx``, but with ordinate values.
+    :param prepared:
+        Optional shapely prepared geometry created from ``polygon``.
+        If provided, it is used to quickly find points that lie inside
+        the polygon, for which the distance is not computed.
     :returns:
         Numpy array of distances in units of coordinate system. Points
         that lie inside the polygon have zero distance.
@@ -337,11 +341,15 @@ def point_to_polygon_distance(polygon, pxx, pyy):
     if pxx.ndim == 0:
         pxx = pxx.reshape((1, ))
         pyy = pyy.reshape((1, ))
-    result = numpy.array([
-        polygon.distance(shapely.geometry.Point(pxx.item(i), pyy.item(i)))
-        for i in xrange(pxx.size)
-    ])
-    return result.reshape(pxx.shape)
+    points = (shapely.geometry.Point(pxx.item(i), pyy.item(i))
+              for i in xrange(pxx.size))
+    if prepared is None:
+        result = [polygon.distance(point) for point in points]
+    else:
+        result = [0.0 if prepared.intersects(point)
+                  else polygon.distance(point)
+                  for point in points]
+    return numpy.array(result).reshape(pxx.shape)
 
 
 try:
@@ -353,13 +361,37 @@ except ImportError:
 else:
     from nhlib import speedups
 
-    def _c_point_to_polygon_distance(polygon, pxx, pyy):
+    def _c_point_to_polygon_distance(polygon, pxx, pyy, prepared=None):
         pxx = numpy.array(pxx, float)
         pyy = numpy.array(pyy, float)
         cxx, cyy = numpy.array(polygon.exterior).transpose()
-        return _utils_speedups.point_to_polygon_distance(
-            cxx, cyy, pxx, pyy
-        )
-
-    speedups.register(point_to_polygon_distance, _c_point_to_polygon_distance)
-    del _c_point_to_polygon_distance
+        if speedups.THREADS <= 1 or pxx.size < 2 * speedups.MIN_CHUNK_SIZE:
+            return _utils_speedups.point_to_polygon_distance(
+                cxx, cyy, pxx, pyy
+            )
+        # the extension releases the GIL, so chunks of target points
+        # can be processed in parallel threads
+        shape = pxx.shape
+        pxx, pyy = pxx.ravel(), pyy.ravel()
+
+        def chunk(sl):
+            return _utils_speedups.point_to_polygon_distance(
+                cxx, cyy, pxx[sl], pyy[sl]
+            )
+        return speedups.map_chunks(chunk, pxx.size).reshape(shape)
+
+    def _point_to_polygon_distance_size(polygon, pxx, pyy, prepared=None):
+        return len(polygon.exterior.coords) * numpy.size(pxx)
+
+    def _point_to_polygon_distance_sample(size):
+        # a square and as many target points as needed to get
+        # the problem of requested size
+        polygon = shapely.geometry.Polygon([(0, 0), (1, 0), (1, 1), (0, 1)])
+        pxx = numpy.linspace(-1, 2, max(size // 5, 1))
+        return (polygon, pxx, pxx[::-1]), {}
+
+    speedups.register(point_to_polygon_distance, _c_point_to_polygon_distance,
+                      size=_point_to_polygon_distance_size,
+                      sample=_point_to_polygon_distance_sample)
+    del _c_point_to_polygon_distance, _point_to_polygon_distance_size, \
+        _point_to_polygon_distance_sample
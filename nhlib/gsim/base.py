@@ -21,8 +21,9 @@ from __future__ import division
 
 import abc
 import math
+import threading
+import collections
 
-import scipy.stats
 from scipy.special import ndtr
 import numpy
 
@@ -107,6 +108,40 @@ class GroundShakingIntensityModel(object):
     #: object attributes with same names. Values are in kilometers.
     REQUIRES_DISTANCES = abc.abstractproperty()
 
+    #: Maximum number of entries in the memo of terms that depend only
+    #: on rupture parameters, see :meth:`_get_rupture_terms`.
+    RUPTURE_TERMS_CACHE_SIZE = 1000
+
+    #: Rupture parameters that are used as a key for the memo of
+    #: rupture terms along with intensity measure type.
+    RUPTURE_TERMS_KEY = ('mag', 'rake', 'dip', 'ztor')
+
+    #: Memo of rupture terms and the lock guarding it, created
+    #: for each GSIM object on first use, see
+    #: :meth:`_get_rupture_terms_memo`.
+    _rupture_terms = _rupture_terms_lock = None
+    #: Lock guarding creation of memos of all GSIM objects.
+    _memo_creation_lock = threading.Lock()
+
+    def __getstate__(self):
+        """
+        Return the state for pickling and copying, leaving out
+        the memo of rupture terms and its lock (locks can't be pickled).
+        """
+        state = self.__dict__.copy()
+        state.pop('_rupture_terms', None)
+        state.pop('_rupture_terms_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restore the state. The memo of rupture terms is created again
+        on first use.
+        """
+        self.__dict__.update(state)
+        self.__dict__.pop('_rupture_terms', None)
+        self.__dict__.pop('_rupture_terms_lock', None)
+
     @abc.abstractmethod
     def get_mean_and_stddevs(self, sites, rup, dists, imt, stddev_types):
         """
@@ -159,7 +194,8 @@ class GroundShakingIntensityModel(object):
         compute interim steps).
         """
 
-    def get_poes(self, sctx, rctx, dctx, imt, imls, truncation_level):
+    def get_poes(self, sctx, rctx, dctx, imt, imls, truncation_level,
+                 approximate=False):
         """
         Calculate and return probabilities of exceedance (PoEs) of one or more
         intensity measure levels (IMLs) of one intensity measure type (IMT)
@@ -202,6 +238,15 @@ class GroundShakingIntensityModel(object):
             value and is defined in units of sigmas. The resulting PoEs
             for that mode are values of complementary cumulative distribution
             function of that truncated Gaussian applied to IMLs.
+        :param approximate:
+            If ``True``, normal cumulative distribution function is not
+            computed exactly but is interpolated from a precomputed table
+            (see :func:`_approx_ndtr`). Resulting PoEs differ from exact
+            ones by no more than ``1e-7`` (for truncation levels below
+            ``0.5`` the bound is looser, see :func:`_truncnorm_sf`).
+            Besides, for positive truncation level PoEs of IMLs lying
+            outside of the truncation range are not computed at all,
+            since they are exactly 0 or 1.
 
         :returns:
             A dictionary of the same structure as parameter ``imts`` (see
@@ -214,31 +259,137 @@ class GroundShakingIntensityModel(object):
             float number, and if ``imts`` dictionary contain wrong or
             unsupported IMTs (see :attr:`DEFINED_FOR_INTENSITY_MEASURE_TYPES`).
         """
+        self._check_poes_args(imt, truncation_level)
+        if truncation_level == 0:
+            # zero truncation mode, standard deviation is not needed
+            mean, _ = self.get_mean_and_stddevs(sctx, rctx, dctx, imt, [])
+            stddev = None
+        else:
+            mean, [stddev] = self.get_mean_and_stddevs(sctx, rctx, dctx, imt,
+                                                       [const.StdDev.TOTAL])
+        return self._get_poes(mean, stddev, imls, truncation_level,
+                              approximate)
+
+    def get_mean_and_stddevs_for_imts(self, sites, rup, dists, imts,
+                                      stddev_types):
+        """
+        Calculate and return mean values of intensity distributions and
+        their standard deviations for several intensity measure types
+        at once.
+
+        The default implementation just calls :meth:`get_mean_and_stddevs`
+        for each IMT. GSIMs can override it for computing intermediate
+        values that don't depend on IMT only once and for operating
+        on coefficients of all IMTs together (see
+        :meth:`CoeffsTable.get_coeffs_for_imts`).
+
+        :param imts:
+            List of intensity measure type objects.
+
+        Other parameters are the same as for :meth:`get_mean_and_stddevs`.
+
+        :returns:
+            A tuple of two items. First is 2d numpy array of mean values,
+            first dimension represents IMTs (in the same order as in
+            ``imts``) and the second -- sites. Second item is a list of
+            2d arrays of standard deviations of the same shape, one array
+            for each type in ``stddev_types``.
+        """
+        means = []
+        stddevs = [[] for _ in stddev_types]
+        for imt in imts:
+            mean, imt_stddevs = self.get_mean_and_stddevs(sites, rup, dists,
+                                                          imt, stddev_types)
+            means.append(mean)
+            for i, stddev in enumerate(imt_stddevs):
+                stddevs[i].append(stddev)
+        return numpy.array(means), [numpy.array(arr) for arr in stddevs]
+
+    def get_poes_for_imts(self, sctx, rctx, dctx, imts, truncation_level,
+                          approximate=False):
+        """
+        Calculate and return probabilities of exceedance of intensity
+        measure levels of several intensity measure types at once.
+
+        Mean values and standard deviations for all the IMTs are computed
+        in one call to :meth:`get_mean_and_stddevs_for_imts`.
+
+        :param imts:
+            Dictionary mapping intensity measure type objects to lists
+            of intensity measure levels.
+
+        Other parameters are the same as for :meth:`get_poes`.
+
+        :returns:
+            A dictionary of the same structure as parameter ``imts``.
+            Instead of lists of IMLs values of the dictionary are 2d numpy
+            arrays of corresponding PoEs, first dimension represents sites
+            and the second represents IMLs.
+
+        :raises ValueError:
+            In the same cases as :meth:`get_poes`.
+        """
+        imts_list = list(imts)
+        for imt in imts_list:
+            self._check_poes_args(imt, truncation_level)
+        if truncation_level == 0:
+            means, _ = self.get_mean_and_stddevs_for_imts(
+                sctx, rctx, dctx, imts_list, []
+            )
+            stddevs = [None] * len(imts_list)
+        else:
+            means, [stddevs] = self.get_mean_and_stddevs_for_imts(
+                sctx, rctx, dctx, imts_list, [const.StdDev.TOTAL]
+            )
+        return dict(
+            (imt, self._get_poes(mean, stddev, imts[imt], truncation_level,
+                                 approximate))
+            for (imt, mean, stddev) in zip(imts_list, means, stddevs)
+        )
+
+    def _check_poes_args(self, imt, truncation_level):
+        """
+        Check arguments of :meth:`get_poes`.
+
+        :raises ValueError:
+            If ``imt`` is not supported or if ``truncation_level``
+            has a wrong value.
+        """
         if truncation_level is not None and truncation_level < 0:
             raise ValueError('truncation level must be zero, positive number '
                              'or None')
         self._check_imt(imt)
 
+    def _get_poes(self, mean, stddev, imls, truncation_level,
+                  approximate=False):
+        """
+        Compute probabilities of exceedance of ``imls`` given mean values
+        and standard deviations of intensity distribution on sites.
+
+        :param mean:
+            1d array of mean values, one per site.
+        :param stddev:
+            1d array of total standard deviations, ignored if
+            ``truncation_level`` is zero.
+
+        See :meth:`get_poes` for description of other parameters and
+        the result value.
+        """
+        imls = self.to_distribution_values(imls)
+        mean = mean.reshape(mean.shape + (1, ))
         if truncation_level == 0:
             # zero truncation mode, just compare imls to mean
-            imls = self.to_distribution_values(imls)
-            mean, _ = self.get_mean_and_stddevs(sctx, rctx, dctx, imt, [])
-            mean = mean.reshape(mean.shape + (1, ))
             return (imls <= mean).astype(float)
         else:
             # use real normal distribution
             assert (const.StdDev.TOTAL
                     in self.DEFINED_FOR_STANDARD_DEVIATION_TYPES)
-            imls = self.to_distribution_values(imls)
-            mean, [stddev] = self.get_mean_and_stddevs(sctx, rctx, dctx, imt,
-                                                       [const.StdDev.TOTAL])
-            mean = mean.reshape(mean.shape + (1, ))
             stddev = stddev.reshape(stddev.shape + (1, ))
             values = (imls - mean) / stddev
             if truncation_level is None:
-                return _norm_sf(values)
+                return _norm_sf(values, approximate)
             else:
-                return _truncnorm_sf(truncation_level, values)
+                return _truncnorm_sf(truncation_level, values, approximate)
 
     def disaggregate_poe(self, sctx, rctx, dctx, imt, iml,
                          truncation_level, n_epsilons):
@@ -249,17 +400,23 @@ class GroundShakingIntensityModel(object):
         If ``truncation_level = 3``, ``n_epsilons = 3``, bin edges are
         ``-3 .. -1``, ``-1 .. +1`` and ``+1 .. +3``.
 
+        :param iml:
+            Either a single intensity level (a float value in units of
+            ``imt``) or a list of those, in which case contributions are
+            computed for all the levels at once.
         :param n_epsilons:
             Integer number of bins to split truncated Gaussian distribution to.
 
         Other parameters are the same as for :meth:`get_poes`, with
-        differences that ``iml`` is only one single intensity level
-        and ``truncation_level`` is required to be positive.
+        difference that ``truncation_level`` is required to be positive.
 
         :returns:
             Contribution to probability of exceedance of ``iml`` coming
-            from different sigma bands in a form of 1d numpy array with
-            ``n_epsilons`` floats between 0 and 1.
+            from different sigma bands in a form of numpy array of floats
+            between 0 and 1. If ``iml`` is a scalar, the array is 2d
+            with first dimension representing sites and second one --
+            ``n_epsilons`` bins. If ``iml`` is a list, result is a 3d array
+            of shape ``(sites, imls, n_epsilons)``.
         """
         if not truncation_level > 0:
             raise ValueError('truncation level must be positive')
@@ -272,46 +429,13 @@ class GroundShakingIntensityModel(object):
         # compute iml value with respect to standard (mean=0, std=1)
         # normal distributions
         iml = self.to_distribution_values(iml)
+        if iml.ndim > 0:
+            # several imls, add a dimension for them
+            mean = mean.reshape(mean.shape + (1, ))
+            stddev = stddev.reshape(stddev.shape + (1, ))
         standard_imls = (iml - mean) / stddev
-
-        distribution = scipy.stats.truncnorm(- truncation_level,
-                                             truncation_level)
-        epsilons = numpy.linspace(- truncation_level, truncation_level,
-                                  n_epsilons + 1)
-        # compute epsilon bins contributions
-        contribution_by_bands = distribution.cdf(epsilons[1:]) \
-                                - distribution.cdf(epsilons[:-1])
-
-        # take the minimum epsilon larger than standard_iml
-        iml_bin_indices = numpy.searchsorted(epsilons, standard_imls)
-
-        return numpy.array([
-            # take full disaggregated distribution for the case of
-            # ``iml <= mean - truncation_level * stddev``
-            contribution_by_bands
-            if idx <= 0 else
-
-            # take zeros if ``iml >= mean + truncation_level * stddev``
-            numpy.zeros(n_epsilons)
-            if idx >= n_epsilons else
-
-            # for other cases (when ``iml`` falls somewhere in the
-            # histogram):
-            numpy.concatenate((
-                # take zeros for bins that are on the left hand side
-                # from the bin ``iml`` falls into,
-                numpy.zeros(idx - 1),
-                # ... area of the portion of the bin containing ``iml``
-                # (the portion is limited on the left hand side by
-                # ``iml`` and on the right hand side by the bin edge),
-                [distribution.sf(standard_imls[i])
-                 - contribution_by_bands[idx:].sum()],
-                # ... and all bins on the right go unchanged.
-                contribution_by_bands[idx:]
-            ))
-
-            for i, idx in enumerate(iml_bin_indices)
-        ])
+        return disaggregate_standard_poe(standard_imls, truncation_level,
+                                         n_epsilons)
 
     @abc.abstractmethod
     def to_distribution_values(self, values):
@@ -380,14 +504,7 @@ class GroundShakingIntensityModel(object):
                                  (type(self).__name__, param))
             setattr(dctx, param, dist)
 
-        sctx = SitesContext()
-        for param in self.REQUIRES_SITES_PARAMETERS:
-            try:
-                value = getattr(site_collection, param)
-            except AttributeError:
-                raise ValueError('%s requires unknown site parameter %r' %
-                                 (type(self).__name__, param))
-            setattr(sctx, param, value)
+        sctx = self._make_sites_context(site_collection)
 
         rctx = RuptureContext()
         for param in self.REQUIRES_RUPTURE_PARAMETERS:
@@ -408,6 +525,153 @@ class GroundShakingIntensityModel(object):
 
         return sctx, rctx, dctx
 
+    def _make_sites_context(self, site_collection):
+        """
+        Create :class:`SitesContext` with site parameters required by GSIM
+        from :class:`~nhlib.site.SiteCollection` object.
+
+        :raises ValueError:
+            If any of declared required site parameters is unknown.
+        """
+        sctx = SitesContext()
+        for param in self.REQUIRES_SITES_PARAMETERS:
+            try:
+                value = getattr(site_collection, param)
+            except AttributeError:
+                raise ValueError('%s requires unknown site parameter %r' %
+                                 (type(self).__name__, param))
+            setattr(sctx, param, value)
+        sctx.site_collection = site_collection
+        return sctx
+
+    def _compute_site_terms(self, sites, imt):
+        """
+        Compute terms of GSIM equations that depend only on site parameters.
+
+        GSIMs that have such terms can override this method and use
+        :meth:`_get_site_terms` in :meth:`get_mean_and_stddevs` to avoid
+        recomputing them for each rupture.
+
+        :param sites:
+            :class:`SitesContext` object.
+        :param imt:
+            Intensity measure type object.
+        :returns:
+            Dictionary mapping names of terms to numpy arrays with one value
+            per site, or ``None`` if GSIM has no such terms (which is what
+            the base class implementation returns).
+        """
+        return None
+
+    def _get_site_terms(self, sites, imt):
+        """
+        Get terms computed by :meth:`_compute_site_terms`, cached
+        per site collection and intensity measure type.
+
+        Terms are cached if ``sites`` context was created by
+        :meth:`make_contexts`, otherwise they are just computed.
+
+        :returns:
+            Dictionary of terms, or ``None`` if GSIM has no site terms.
+        """
+        sitecol = getattr(sites, 'site_collection', None)
+        if sitecol is None:
+            return self._compute_site_terms(sites, imt)
+        compute = lambda sitecol: self._compute_site_terms(
+            self._make_sites_context(sitecol), imt
+        )
+        return sitecol.get_cached_values((self, imt), compute)
+
+    def _compute_rupture_terms(self, rup, imt):
+        """
+        Compute terms of GSIM equations that depend only on rupture
+        parameters listed in :attr:`RUPTURE_TERMS_KEY`.
+
+        GSIMs that have such terms can override this method and use
+        :meth:`_get_rupture_terms` in :meth:`get_mean_and_stddevs` to avoid
+        recomputing them when the same rupture is evaluated for several
+        batches of sites.
+
+        :param rup:
+            :class:`RuptureContext` object.
+        :param imt:
+            Intensity measure type object.
+        :returns:
+            Dictionary mapping names of terms to scalar values, or ``None``
+            if GSIM has no such terms (which is what the base class
+            implementation returns).
+        """
+        return None
+
+    def _get_rupture_terms_memo(self):
+        """
+        Return the memo of rupture terms and the lock guarding it,
+        creating them on first call.
+
+        The memo is created lazily rather than in the constructor,
+        so subclasses don't have to call it.
+        """
+        lock = self._rupture_terms_lock
+        if lock is None:
+            with self._memo_creation_lock:
+                if self._rupture_terms_lock is None:
+                    self._rupture_terms = collections.OrderedDict()
+                    self._rupture_terms_lock = threading.Lock()
+                lock = self._rupture_terms_lock
+        return self._rupture_terms, lock
+
+    def _get_rupture_terms(self, rup, imt):
+        """
+        Get terms computed by :meth:`_compute_rupture_terms`, memoized
+        by intensity measure type and values of rupture parameters
+        from :attr:`RUPTURE_TERMS_KEY`.
+
+        The memo keeps up to :attr:`RUPTURE_TERMS_CACHE_SIZE` entries,
+        the oldest one is evicted when it is full.
+
+        :returns:
+            Dictionary of terms, or ``None`` if GSIM has no rupture terms.
+        """
+        key = (imt, ) + tuple(getattr(rup, param, None)
+                              for param in self.RUPTURE_TERMS_KEY)
+        memo, lock = self._get_rupture_terms_memo()
+        with lock:
+            if key in memo:
+                return memo[key]
+        terms = self._compute_rupture_terms(rup, imt)
+        if terms is None:
+            # nothing worth memoizing
+            return None
+        with lock:
+            if len(memo) >= self.RUPTURE_TERMS_CACHE_SIZE:
+                memo.popitem(last=False)
+            memo[key] = terms
+        return terms
+
+    def _get_rupture_terms_for_imts(self, rup, imts):
+        """
+        Get rupture terms (see :meth:`_get_rupture_terms`) for several
+        intensity measure types.
+
+        :returns:
+            Dictionary mapping names of terms to 2d numpy arrays of shape
+            ``(len(imts), 1)``, that is columns broadcastable against
+            arrays with one row per IMT (like coefficients from
+            :meth:`CoeffsTable.get_coeffs_for_imts`). Terms that are
+            missing for some of IMTs are omitted, so the dictionary
+            is empty if GSIM has no rupture terms.
+        """
+        imts_terms = [self._get_rupture_terms(rup, imt) for imt in imts]
+        if not imts_terms or None in imts_terms:
+            return {}
+        # only terms that are available for all the IMTs are returned
+        names = set.intersection(*(set(terms) for terms in imts_terms))
+        return dict(
+            (name, numpy.array([terms[name] for terms in imts_terms],
+                               dtype=float).reshape(-1, 1))
+            for name in names
+        )
+
     def _check_imt(self, imt):
         """
         Make sure that ``imt`` is valid and is supported by this GSIM.
@@ -419,7 +683,58 @@ class GroundShakingIntensityModel(object):
                              (type(imt).__name__, type(self).__name__))
 
 
-def _truncnorm_sf(truncation_level, values):
+#: Step of the table of standard normal CDF values used by
+#: :func:`_approx_ndtr`.
+NDTR_TABLE_STEP = 1e-3
+#: The table covers the range ``[-NDTR_TABLE_LIMIT, NDTR_TABLE_LIMIT]``,
+#: CDF values outside of it are less than ``1e-9`` away from 0 or 1.
+NDTR_TABLE_LIMIT = 6.0
+_NDTR_TABLE = ndtr(numpy.linspace(
+    - NDTR_TABLE_LIMIT, NDTR_TABLE_LIMIT,
+    int(round(2 * NDTR_TABLE_LIMIT / NDTR_TABLE_STEP)) + 1
+))
+_NDTR_TABLE_SLOPES = numpy.diff(_NDTR_TABLE)
+
+
+def _approx_ndtr(values):
+    """
+    Approximate cumulative distribution function of standard normal
+    distribution.
+
+    Values are linearly interpolated from a precomputed table with
+    :data:`NDTR_TABLE_STEP`. The interpolation error is bounded by
+    ``NDTR_TABLE_STEP ** 2 / 8`` times the maximum of the second derivative
+    of the CDF (which is about ``0.242``), that is about ``3e-8``.
+    The maximum absolute difference from :func:`scipy.special.ndtr`
+    is therefore guaranteed to be less than ``1e-7``.
+
+    :param values:
+        Numpy array (or a scalar) of values to compute CDF for.
+    :returns:
+        Numpy array of CDF values of the same shape as ``values``.
+
+    >>> from scipy.special import ndtr
+    >>> values = numpy.linspace(-10, 10, 10001)
+    >>> abs(_approx_ndtr(values) - ndtr(values)).max() < 1e-7
+    True
+    """
+    # position of values in the table in units of table steps
+    pos = numpy.array(values, dtype=float)
+    pos *= 1.0 / NDTR_TABLE_STEP
+    pos += NDTR_TABLE_LIMIT / NDTR_TABLE_STEP
+    # values outside of the table are clipped to its borders. the upper
+    # border is nudged inside so that index of the table interval
+    # is always valid
+    numpy.clip(pos, 0, len(_NDTR_TABLE_SLOPES) * (1 - 1e-12), out=pos)
+    idx = pos.astype(numpy.intp)
+    # now turn positions into interpolated values in place
+    pos -= idx
+    pos *= _NDTR_TABLE_SLOPES.take(idx)
+    pos += _NDTR_TABLE.take(idx)
+    return pos
+
+
+def _truncnorm_sf(truncation_level, values, approximate=False):
     """
     Survival function for truncated normal distribution.
 
@@ -432,13 +747,35 @@ def _truncnorm_sf(truncation_level, values):
     :param values:
         Numpy array of values as input to a survival function for the given
         distribution.
+    :param approximate:
+        If ``True``, use :func:`_approx_ndtr` instead of exact CDF
+        and only compute survival function for values inside
+        the truncation range. Note that the approximation error
+        of CDF gets divided by the normalizing factor ``Z``, so
+        it stays below ``1e-7`` only for truncation levels starting
+        from about ``0.5``.
     :returns:
         Numpy array of survival function results in a range between 0 and 1.
 
     >>> from scipy.stats import truncnorm
     >>> truncnorm(-3, 3).sf(0.12345) == _truncnorm_sf(3, 0.12345)
     True
+    >>> _truncnorm_sf(3, numpy.array([-4, 4]), approximate=True)
+    array([1., 0.])
     """
+    if approximate:
+        values = numpy.asarray(values, dtype=float)
+        # survival function is exactly 1 to the left of the truncation
+        # range and 0 to the right of it, so compute it only for values
+        # that are inside, using the same formula as below
+        result = (values <= - truncation_level).astype(float)
+        inside = numpy.abs(values) < truncation_level
+        phi_b = ndtr(truncation_level)
+        z = phi_b * 2 - 1
+        result[inside] = ((phi_b - _approx_ndtr(values[inside])) / z) \
+                         .clip(0.0, 1.0)
+        return result
+
     # notation from http://en.wikipedia.org/wiki/Truncated_normal_distribution.
     # given that mu = 0 and sigma = 1, we have alpha = a and beta = b.
 
@@ -466,14 +803,14 @@ def _truncnorm_sf(truncation_level, values):
     return ((phi_b - ndtr(values)) / z).clip(0.0, 1.0)
 
 
-def _norm_sf(values):
+def _norm_sf(values, approximate=False):
     """
     Survival function for normal distribution.
 
     Assumes zero mean and standard deviation equal to one.
 
-    ``values`` parameter and the return value are the same
-    as in :func:`_truncnorm_sf`.
+    ``values``, ``approximate`` parameters and the return value
+    are the same as in :func:`_truncnorm_sf`.
 
     >>> from scipy.stats import norm
     >>> norm.sf(0.12345) == _norm_sf(0.12345)
@@ -485,9 +822,52 @@ def _norm_sf(values):
     # the integral between ``[x, +infinity]`` (that is the survival
     # function) is equal to the integral between ``[-infinity, -x]``
     # (that is the CDF at ``- x``).
+    if approximate:
+        return _approx_ndtr(- values)
     return ndtr(- values)
 
 
+def disaggregate_standard_poe(standard_imls, truncation_level, n_epsilons):
+    """
+    Disaggregate PoE of standard intensity levels in different contributions
+    each coming from ``n_epsilons`` bins of truncated normal distribution.
+
+    This is what :meth:`GroundShakingIntensityModel.disaggregate_poe` does
+    once mean and standard deviation are known. It allows to repeat
+    disaggregation for different levels without recalculating those.
+
+    :param standard_imls:
+        Numpy array of intensity levels with respect to standard (zero mean,
+        unit standard deviation) normal distribution, that is values
+        of ``(iml - mean) / stddev`` in distribution space.
+    :param truncation_level:
+        Positive float number, truncation of the distribution in units
+        of sigma.
+    :param n_epsilons:
+        Integer number of bins to split the distribution to.
+    :returns:
+        Numpy array of contributions of shape ``standard_imls.shape +
+        (n_epsilons, )``.
+    """
+    standard_imls = standard_imls.reshape(standard_imls.shape + (1, ))
+
+    epsilons = numpy.linspace(- truncation_level, truncation_level,
+                              n_epsilons + 1)
+    # the part of each epsilon bin that contributes to the exceedance
+    # of iml is the one lying above standard iml. so the lower limit
+    # of integration is standard iml clipped to the bin range: this
+    # gives the full bin for bins that are on the right hand side
+    # from the one ``iml`` falls into, the portion limited by ``iml``
+    # for the bin containing it and zero-width interval for bins
+    # on the left hand side.
+    lower_limits = standard_imls.clip(epsilons[:-1], epsilons[1:])
+    contributions = (_truncnorm_sf(truncation_level, lower_limits)
+                     - _truncnorm_sf(truncation_level, epsilons[1:]))
+    # take zeros if ``iml`` falls in the last epsilon bin or above it
+    contributions[standard_imls[..., 0] > epsilons[-2]] = 0
+    return contributions
+
+
 class GMPE(GroundShakingIntensityModel):
     """
     Ground-Motion Prediction Equation is a subclass of generic
@@ -542,8 +922,13 @@ class SitesContext(object):
     <GroundShakingIntensityModel.REQUIRES_SITES_PARAMETERS>` does it need.
     Only those required parameters are made available in a result context
     object.
+
+    Attribute ``site_collection`` references
+    :class:`~nhlib.site.SiteCollection` object the context is created for.
+    It is used for caching values that depend only on sites.
     """
-    __slots__ = ('vs30', 'vs30measured', 'z1pt0', 'z2pt5')
+    __slots__ = ('vs30', 'vs30measured', 'z1pt0', 'z2pt5',
+                 'site_collection')
 
 
 class DistancesContext(object):
@@ -679,7 +1064,25 @@ class CoeffsTable(object):
     Traceback (most recent call last):
         ...
     KeyError: SA(period=0.01, damping=5)
+
+    Coefficients are also available as numpy arrays with one value per
+    column, which is convenient for vectorized calculations. Positions
+    of coefficients in arrays are available by name from :attr:`columns`:
+
+    >>> ct.columns['c']
+    2
+    >>> ct.get_vector(imt.PGD()).tolist()
+    [7.6, 12.0, 0.0, 44.1]
+    >>> vectors = ct.get_vectors([imt.PGA(), imt.SA(period=0.2, damping=5)])
+    >>> vectors.shape
+    (2, 4)
+    >>> '%.5f' % vectors[1, ct.columns['a']]
+    '7.29073'
     """
+    #: Maximum number of interpolated coefficients sets to keep in memory.
+    #: When exceeded, the ones that were interpolated earliest are dropped.
+    INTERPOLATION_CACHE_SIZE = 1000
+
     def __init__(self, **kwargs):
         if not 'table' in kwargs:
             raise TypeError('CoeffsTable requires "table" kwarg')
@@ -690,16 +1093,20 @@ class CoeffsTable(object):
         header = table.pop(0).split()
         if not header[0].upper() == "IMT":
             raise ValueError('first column in a table must be IMT')
-        coeff_names = header[1:]
+        self.coeff_names = coeff_names = header[1:]
+        self.columns = dict((name, i) for (i, name) in enumerate(coeff_names))
         self.sa_coeffs = {}
         self.non_sa_coeffs = {}
+        self._vectors = {}
         for row in table:
             row = row.split()
             imt_name = row[0].upper()
             if imt_name == 'SA':
                 raise ValueError('specify period as float value '
                                  'to declare SA IMT')
-            imt_coeffs = dict(zip(coeff_names, map(float, row[1:])))
+            vector = numpy.array(map(float, row[1:]))
+            vector.flags.writeable = False
+            imt_coeffs = dict(zip(coeff_names, vector.tolist()))
             try:
                 sa_period = float(imt_name)
             except:
@@ -713,6 +1120,22 @@ class CoeffsTable(object):
                                     'for tables defining SA')
                 imt = imt_module.SA(sa_period, sa_damping)
                 self.sa_coeffs[imt] = imt_coeffs
+            self._vectors[imt] = vector
+
+        # for each damping: sorted array of periods and 2d array
+        # of coefficients vectors in the same order, for interpolation
+        self._sa_periods = {}
+        for damping in set(imt.damping for imt in self.sa_coeffs):
+            imts = sorted(imt for imt in self.sa_coeffs
+                          if imt.damping == damping)
+            self._sa_periods[damping] = (
+                numpy.array([imt.period for imt in imts]),
+                numpy.array([self._vectors[imt] for imt in imts])
+            )
+        # maps interpolated SA imts to tuples of coefficients vector
+        # and dictionary, see :meth:`_get_interpolated`
+        self._interpolated = collections.OrderedDict()
+        self._lock = threading.Lock()
 
     def __getitem__(self, imt):
         """
@@ -721,6 +1144,9 @@ class CoeffsTable(object):
         or the dictionary of interpolated coefficients, if ``imt``
         is of type :class:`~nhlib.imt.SA` and interpolation is possible.
 
+        Results of interpolation are memoized, so the same dictionary
+        object is returned for the same ``imt``. It must not be modified.
+
         :raises KeyError:
             If ``imt`` is not available in the table and no interpolation
             can be done.
@@ -733,27 +1159,94 @@ class CoeffsTable(object):
         except KeyError:
             pass
 
-        max_below = min_above = None
-        for unscaled_imt in self.sa_coeffs.keys():
-            if unscaled_imt.damping != imt.damping:
-                continue
-            if unscaled_imt.period > imt.period:
-                if min_above is None or unscaled_imt.period < min_above.period:
-                    min_above = unscaled_imt
-            elif unscaled_imt.period < imt.period:
-                if max_below is None or unscaled_imt.period > max_below.period:
-                    max_below = unscaled_imt
-        if max_below is None or min_above is None:
+        return self._get_interpolated(imt)[1]
+
+    def get_vector(self, imt):
+        """
+        Return coefficients corresponding to ``imt`` as a read-only numpy
+        array, one value per column. Positions of coefficients in it are
+        available from :attr:`columns` dictionary.
+
+        :raises KeyError:
+            In the same cases as :meth:`__getitem__`.
+        """
+        try:
+            return self._vectors[imt]
+        except KeyError:
+            if not isinstance(imt, imt_module.SA):
+                raise
+        return self._get_interpolated(imt)[0]
+
+    def get_coeffs_for_imts(self, imts):
+        """
+        Return coefficients for several IMTs in a form suitable for
+        vectorized calculation of GSIM equations for all of them at once.
+
+        :param imts:
+            List of intensity measure type objects.
+        :returns:
+            Dictionary mapping coefficient names to 2d numpy arrays
+            of shape ``(len(imts), 1)``, so that they broadcast against
+            1d arrays of per-site values giving results with first
+            dimension representing IMTs and second -- sites.
+        :raises KeyError:
+            If coefficients for any of ``imts`` are not available.
+        """
+        vectors = self.get_vectors(imts)
+        return dict((name, vectors[:, [i]])
+                    for (name, i) in self.columns.iteritems())
+
+    def get_vectors(self, imts):
+        """
+        Return coefficients for several IMTs at once.
+
+        :param imts:
+            List of intensity measure type objects.
+        :returns:
+            2d numpy array, first dimension represents IMTs (in the same
+            order as in ``imts``), second one -- coefficients (with
+            positions from :attr:`columns` dictionary).
+        :raises KeyError:
+            If coefficients for any of ``imts`` are not available.
+        """
+        return numpy.array([self.get_vector(imt) for imt in imts])
+
+    def _get_interpolated(self, imt):
+        """
+        Get coefficients for SA ``imt`` which is not in the table
+        by interpolating them between the ones for closest higher
+        and closest lower period.
+
+        Interpolated coefficients are memoized. This method is thread-safe.
+
+        :returns:
+            A tuple of coefficients vector and dictionary.
+        """
+        with self._lock:
+            if imt in self._interpolated:
+                return self._interpolated[imt]
+
+        if not imt.damping in self._sa_periods:
+            raise KeyError(imt)
+        periods, vectors = self._sa_periods[imt.damping]
+        idx = numpy.searchsorted(periods, imt.period)
+        if idx == 0 or idx == len(periods):
             raise KeyError(imt)
 
         # ratio tends to 1 when target period tends to a minimum
         # known period above and to 0 if target period is close
         # to maximum period below.
-        ratio = ((math.log(imt.period) - math.log(max_below.period))
-                 / (math.log(min_above.period) - math.log(max_below.period)))
-        max_below = self.sa_coeffs[max_below]
-        min_above = self.sa_coeffs[min_above]
-        return dict(
-            (co, (min_above[co] - max_below[co]) * ratio + max_below[co])
-            for co in max_below.keys()
-        )
+        ratio = ((math.log(imt.period) - math.log(periods[idx - 1]))
+                 / (math.log(periods[idx]) - math.log(periods[idx - 1])))
+        max_below = vectors[idx - 1]
+        min_above = vectors[idx]
+        vector = (min_above - max_below) * ratio + max_below
+        vector.flags.writeable = False
+        result = (vector, dict(zip(self.coeff_names, vector.tolist())))
+
+        with self._lock:
+            if len(self._interpolated) >= self.INTERPOLATION_CACHE_SIZE:
+                # drop the oldest one
+                self._interpolated.popitem(last=False)
+            self._interpolated[imt] = result
+        return result
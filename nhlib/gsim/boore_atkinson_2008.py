@@ -80,21 +80,83 @@ class BooreAtkinson2008(GMPE):
         # extracting dictionary of coefficients specific to required
         # intensity measure type.
         C = self.COEFFS[imt]
+        # linear site amplification term and non-linear slope
+        # depend only on sites, so they are cached per site collection
+        site_terms = self._get_site_terms(sites, imt)
+        # magnitude scaling depends only on rupture, so it is memoized
+        mag_scaling = self._get_rupture_terms(rup, imt)['mag_scaling']
+        return self._compute_mean_and_stddevs(
+            sites, rup, dists, C, mag_scaling, site_terms['lin'],
+            site_terms['bnl'], stddev_types
+        )
+
+    def get_mean_and_stddevs_for_imts(self, sites, rup, dists, imts,
+                                      stddev_types):
+        """
+        See the method of the same name of
+        :class:`~nhlib.gsim.base.GroundShakingIntensityModel`
+        for spec of input and result values.
+
+        Equations are evaluated for all the IMTs together, with
+        coefficients arranged in columns (see
+        :meth:`~nhlib.gsim.base.CoeffsTable.get_coeffs_for_imts`).
+        Reference PGA for the non-linear site amplification term
+        doesn't depend on IMT, so it is computed only once per call.
+        """
+        C = self.COEFFS.get_coeffs_for_imts(imts)
+        site_terms = [self._get_site_terms(sites, imt) for imt in imts]
+        lin = np.array([terms['lin'] for terms in site_terms])
+        bnl = np.array([terms['bnl'] for terms in site_terms])
+        mag_scaling = self._get_rupture_terms_for_imts(rup, imts)
+        return self._compute_mean_and_stddevs(
+            sites, rup, dists, C, mag_scaling['mag_scaling'], lin, bnl,
+            stddev_types
+        )
+
+    def _compute_mean_and_stddevs(self, sites, rup, dists, C, mag_scaling,
+                                  lin, bnl, stddev_types):
+        """
+        Compute mean and standard deviations given coefficients ``C``,
+        magnitude scaling term ``mag_scaling`` and site terms: linear
+        site amplification ``lin`` and non-linear slope ``bnl``.
 
+        Coefficients can be either scalars for a single IMT or columns
+        for several IMTs, in which case ``mag_scaling`` is a column too
+        and ``lin`` and ``bnl`` are 2d arrays with one row per IMT.
+        """
         # equation 1, pag 106, without sigma term, that is only the first 3
         # terms. The third term (site amplification) is computed as given in
         # equation (6), that is the sum of a linear term - equation (7) - and
         # a non-linear one - equations (8a) to (8c).
         # Mref, Rref values are given in the caption to table 6, pag 119.
-        mean = self._compute_magnitude_scaling(rup, C) + \
+        mean = mag_scaling + \
             self._compute_distance_scaling(rup, dists, C) + \
-            self._get_site_amplification_linear(sites, C) + \
-            self._get_site_amplification_non_linear(sites, rup, dists, C)
+            lin + \
+            self._get_site_amplification_non_linear(rup, dists, bnl)
 
         stddevs = self._get_stddevs(C, stddev_types, num_sites=len(sites.vs30))
 
         return mean, stddevs
 
+    def _compute_site_terms(self, sites, imt):
+        """
+        Compute linear site amplification term and non-linear slope factor.
+        See :meth:`superclass method
+        <nhlib.gsim.base.GroundShakingIntensityModel._compute_site_terms>`.
+        """
+        C = self.COEFFS[imt]
+        return {'lin': self._get_site_amplification_linear(sites, C),
+                'bnl': self._compute_non_linear_slope(sites, C)}
+
+    def _compute_rupture_terms(self, rup, imt):
+        """
+        Compute magnitude scaling term.
+        See :meth:`superclass method
+        <nhlib.gsim.base.GroundShakingIntensityModel._compute_rupture_terms>`.
+        """
+        C = self.COEFFS[imt]
+        return {'mag_scaling': self._compute_magnitude_scaling(rup, C)}
+
     def _get_stddevs(self, C, stddev_types, num_sites):
         """
         Return standard deviations as defined in table 8, pag 121.
@@ -125,13 +187,13 @@ class BooreAtkinson2008(GMPE):
         Compute magnitude-scaling term, equations (5a) and (5b), pag 107.
         """
         U, SS, NS, RS = self._get_fault_type_dummy_variables(rup)
-        if rup.mag <= C['Mh']:
-            return C['e1'] * U + C['e2'] * SS + C['e3'] * NS + C['e4'] * RS + \
-                C['e5'] * (rup.mag - C['Mh']) + \
-                C['e6'] * (rup.mag - C['Mh']) ** 2
-        else:
-            return C['e1'] * U + C['e2'] * SS + C['e3'] * NS + C['e4'] * RS + \
-                C['e7'] * (rup.mag - C['Mh'])
+        # coefficients can be arrays (one value per IMT),
+        # so choose between equations (5a) and (5b) elementwise
+        return C['e1'] * U + C['e2'] * SS + C['e3'] * NS + C['e4'] * RS + \
+            np.where(rup.mag <= C['Mh'],
+                     C['e5'] * (rup.mag - C['Mh']) +
+                     C['e6'] * (rup.mag - C['Mh']) ** 2,
+                     C['e7'] * (rup.mag - C['Mh']))
 
     def _get_fault_type_dummy_variables(self, rup):
         """
@@ -165,10 +227,11 @@ class BooreAtkinson2008(GMPE):
         """
         return C['blin'] * np.log(sites.vs30 / 760.0)
 
-    def _get_site_amplification_non_linear(self, sites, rup, dists, C):
+    def _get_site_amplification_non_linear(self, rup, dists, bnl):
         """
         Compute site amplification non-linear term,
-        equations (8a) to (13d), pag 108-109.
+        equations (8a) to (13d), pag 108-109, given non-linear slope
+        ``bnl`` from :meth:`_compute_non_linear_slope`.
         """
 
         # Median PGA in g for Vref = 760.0, without site amplification,
@@ -181,16 +244,21 @@ class BooreAtkinson2008(GMPE):
         # ERRATUM: 27 August 2008. Tom Blake pointed out that the caption to
         # Table 6 should read "Distance-scaling coefficients (Mref=4.5 and
         # Rref=1.0 km for all periods)".
-        C_pga = self.COEFFS[PGA()]
-        pga4nl = np.exp(self._compute_magnitude_scaling(rup, C_pga) +
-                        self._compute_distance_scaling(rup, dists, C_pga))
-
-        # non linear slope
-        bnl = self._compute_non_linear_slope(sites, C)
+        pga4nl = self._compute_pga4nl(rup, dists)
 
         # compute the actual non-linear term
         return self._compute_non_linear_term(pga4nl, bnl)
 
+    def _compute_pga4nl(self, rup, dists):
+        """
+        Compute reference PGA (in g) for the rupture and distances
+        contexts.
+        """
+        C_pga = self.COEFFS[PGA()]
+        mag_scaling = self._get_rupture_terms(rup, PGA())['mag_scaling']
+        return np.exp(mag_scaling +
+                      self._compute_distance_scaling(rup, dists, C_pga))
+
     def _compute_non_linear_slope(self, sites, C):
         """
         Compute non-linear slope factor,
@@ -224,17 +292,18 @@ class BooreAtkinson2008(GMPE):
         equation (8a) to (8c), pag 108.
         """
 
-        fnl = np.zeros(len(pga4nl))
         a1 = 0.03
         a2 = 0.09
         pga_low = 0.06
 
+        # ``bnl`` can have a row per IMT
+        pga4nl, bnl = np.broadcast_arrays(pga4nl, bnl)
+
         # equation (8a)
-        idx = pga4nl <= a1
-        fnl[idx] = bnl[idx] * np.log(pga_low / 0.1)
+        fnl = bnl * np.log(pga_low / 0.1)
 
         # equation (8b)
-        idx = np.where((pga4nl > a1) & (pga4nl <= a2))
+        idx = (pga4nl > a1) & (pga4nl <= a2)
         delta_x = np.log(a2 / a1)
         delta_y = bnl[idx] * np.log(a2 / pga_low)
         c = (3 * delta_y - bnl[idx] * delta_x) / delta_x ** 2
@@ -76,64 +76,169 @@ class ChiouYoungs2008(GMPE):
         # extracting dictionary of coefficients specific to required
         # intensity measure type.
         C = self.COEFFS[imt]
+        # terms of eq. 10 and eq. 13b that depend only on sites
+        # are cached per site collection
+        site_terms = self._get_site_terms(sites, imt)
+        # and terms that depend only on rupture are memoized
+        rup_terms = self._get_rupture_terms(rup, imt)
+        return self._compute_mean_and_stddevs(sites, rup, dists, C,
+                                              site_terms, rup_terms,
+                                              stddev_types)
+
+    def get_mean_and_stddevs_for_imts(self, sites, rup, dists, imts,
+                                      stddev_types):
+        """
+        See the method of the same name of
+        :class:`~nhlib.gsim.base.GroundShakingIntensityModel`
+        for spec of input and result values.
+
+        Equations are evaluated for all the IMTs together, with
+        coefficients arranged in columns (see
+        :meth:`~nhlib.gsim.base.CoeffsTable.get_coeffs_for_imts`),
+        so intermediate values that depend only on rupture and distances
+        are computed once.
+        """
+        C = self.COEFFS.get_coeffs_for_imts(imts)
+        imts_site_terms = [self._get_site_terms(sites, imt) for imt in imts]
+        site_terms = dict(
+            (name, np.array([terms[name] for terms in imts_site_terms]))
+            for name in imts_site_terms[0]
+        )
+        rup_terms = self._get_rupture_terms_for_imts(rup, imts)
+        return self._compute_mean_and_stddevs(sites, rup, dists, C,
+                                              site_terms, rup_terms,
+                                              stddev_types)
+
+    def _compute_mean_and_stddevs(self, sites, rup, dists, C, site_terms,
+                                  rup_terms, stddev_types):
+        """
+        Compute mean and standard deviations given coefficients ``C``,
+        site terms (see :meth:`_compute_site_terms`) and rupture terms
+        (see :meth:`_compute_rupture_terms`).
+
+        Coefficients can be either scalars for a single IMT or columns
+        for several IMTs, in which case site terms are 2d arrays with
+        one row per IMT and rupture terms are columns.
+        """
         # intensity on a reference soil is used for both mean
         # and stddev calculations.
-        ln_y_ref = self._get_ln_y_ref(rup, dists, C)
-        # exp1 and exp2 are parts of eq. 10 and eq. 13b,
-        # calculate it once for both.
-        exp1 = np.exp(C['phi3'] * (sites.vs30.clip(-np.inf, 1130) - 360))
+        ln_y_ref = self._get_ln_y_ref(rup, dists, C, rup_terms)
+        exp1 = site_terms['exp1']
+        # exp2 is a part of eq. 10 and eq. 13b
         exp2 = np.exp(C['phi3'] * (1130 - 360))
 
-        mean = self._get_mean(sites, C, ln_y_ref, exp1, exp2)
-        stddevs = self._get_stddevs(sites, rup, C, stddev_types,
+        mean = self._get_mean(C, ln_y_ref, exp1, exp2, site_terms['linear'],
+                              site_terms['z1pt0'])
+        stddevs = self._get_stddevs(sites, rup_terms, C, stddev_types,
                                     ln_y_ref, exp1, exp2)
         return mean, stddevs
 
-    def _get_mean(self, sites, C, ln_y_ref, exp1, exp2):
+    def _compute_rupture_terms(self, rup, imt):
         """
-        Add site effects to an intensity.
+        Compute terms of eq. 13a, 19 and 20 that depend only on
+        magnitude, rake, dip and depth to top of rupture.
+        See :meth:`superclass method
+        <nhlib.gsim.base.GroundShakingIntensityModel._compute_rupture_terms>`.
+        """
+        C = self.COEFFS[imt]
+        # reverse faulting flag
+        Frv = 1 if 30 <= rup.rake <= 150 else 0
+        # normal faulting flag
+        Fnm = 1 if -120 <= rup.rake <= -60 else 0
+        # aftershock flag. always zero since we only consider main shock
+        AS = 0
+        mag_test = min(max(rup.mag, 5.0), 7.0) - 5.0
+        return {
+            # first and second lines of eq. 13a
+            'source': (
+                C['c1']
+                  + (C['c1a'] * Frv
+                       + C['c1b'] * Fnm
+                       + C['c7'] * (rup.ztor - 4))
+                    * (1 - AS)
+                + (C['c10'] + C['c7a'] * (rup.ztor - 4)) * AS
+                + C['c2'] * (rup.mag - 6)
+                  + ((C['c2'] - C['c3']) / C['cn'])
+                    * np.log(1 + np.exp(C['cn'] * (C['cm'] - rup.mag)))
+            ),
+            # part of the third line of eq. 13a
+            'near_source': C['c5'] * np.cosh(
+                C['c6'] * max(rup.mag - C['chm'], 0)
+            ),
+            # part of the fifth line of eq. 13a
+            'anelastic': (C['cg1']
+                          + C['cg2'] / np.cosh(max(rup.mag - C['cg3'], 0))),
+            # part of the sixth line of eq. 13a
+            'hanging_wall': np.cos(np.radians(rup.dip)) ** 2 / C['c9a'],
+            # eq. 19 to calculate inter-event standard error
+            'tau': C['tau1'] + (C['tau2'] - C['tau1']) / 2 * mag_test,
+            # first line of eq. 20
+            'sigma': (C['sig1']
+                      + 0.5 * (C['sig2'] - C['sig1']) * mag_test
+                      + C['sig4'] * AS)
+        }
 
-        Implements eq. 13b.
+    def _compute_site_terms(self, sites, imt):
+        """
+        Compute terms of eq. 13b that depend only on vs30 and z1pt0.
+        See :meth:`superclass method
+        <nhlib.gsim.base.GroundShakingIntensityModel._compute_site_terms>`.
         """
+        C = self.COEFFS[imt]
         # we do not support estimating of basin depth and instead
         # rely on it being available (since we require it).
         z1pt0 = sites.z1pt0
+        return {
+            # exp1 is a part of eq. 10 and eq. 13b
+            'exp1': np.exp(C['phi3'] * (sites.vs30.clip(-np.inf, 1130)
+                                        - 360)),
+            # linear term from the first line of eq. 13b
+            'linear': C['phi1'] * np.log(sites.vs30 / 1130).clip(-np.inf, 0),
+            # third line of eq. 13b
+            'z1pt0': (C['phi5']
+                      * (1.0 - 1.0 / np.cosh(C['phi6']
+                               * (z1pt0 - C['phi7']).clip(0, np.inf)))
+                      + C['phi8'] / np.cosh(0.15 * (z1pt0 - 15).clip(0,
+                                                                   np.inf)))
+        }
 
+    def _get_mean(self, C, ln_y_ref, exp1, exp2, linear_term, z1pt0_term):
+        """
+        Add site effects to an intensity.
+
+        Implements eq. 13b, given precomputed site terms (see
+        :meth:`_compute_site_terms`).
+        """
         # we consider random variables being zero since we want
         # to find the exact mean value.
         eta = epsilon = 0
 
         ln_y = (
             # first line of eq. 13b
-            ln_y_ref + C['phi1'] * np.log(sites.vs30 / 1130).clip(-np.inf, 0)
+            ln_y_ref + linear_term
             # second line
             + C['phi2'] * (exp1 - exp2)
               * np.log((np.exp(ln_y_ref) + C['phi4']) / C['phi4'])
             # third line
-            + C['phi5']
-              * (1.0 - 1.0 / np.cosh(C['phi6']
-                       * (z1pt0 - C['phi7']).clip(0, np.inf)))
-            + C['phi8'] / np.cosh(0.15 * (z1pt0 - 15).clip(0, np.inf))
+            + z1pt0_term
             # fourth line
             + eta + epsilon
         )
         return ln_y
 
-    def _get_stddevs(self, sites, rup, C, stddev_types, ln_y_ref, exp1, exp2):
+    def _get_stddevs(self, sites, rup_terms, C, stddev_types, ln_y_ref,
+                     exp1, exp2):
         """
         Get standard deviation for a given intensity on reference soil.
 
         Implements equations 19, 20 and 21 for inter-event, intra-event
         and total standard deviations respectively.
         """
-        # aftershock flag is zero, we consider only main shock.
-        AS = 0
         Fmeasured = sites.vs30measured
         Finferred = 1 - sites.vs30measured
 
         # eq. 19 to calculate inter-event standard error
-        mag_test = min(max(rup.mag, 5.0), 7.0) - 5.0
-        tau = C['tau1'] + (C['tau2'] - C['tau1']) / 2 * mag_test
+        tau = rup_terms['tau']
 
         # b and c coeffs from eq. 10
         b = C['phi2'] * (exp1 - exp2)
@@ -144,9 +249,7 @@ class ChiouYoungs2008(GMPE):
         NL = b * y_ref / (y_ref + c)
         sigma = (
             # first line of eq. 20
-            (C['sig1']
-               + 0.5 * (C['sig2'] - C['sig1']) * mag_test
-               + C['sig4'] * AS)
+            rup_terms['sigma']
             # second line
             * np.sqrt((C['sig3'] * Finferred + 0.7 * Fmeasured)
                       + (1 + NL) ** 2)
@@ -165,49 +268,30 @@ class ChiouYoungs2008(GMPE):
                 ret.append(np.abs((1 + NL) * tau))
         return ret
 
-    def _get_ln_y_ref(self, rup, dists, C):
+    def _get_ln_y_ref(self, rup, dists, C, rup_terms):
         """
         Get an intensity on a reference soil.
 
-        Implements eq. 13a.
+        Implements eq. 13a, given terms that depend only on rupture
+        (see :meth:`_compute_rupture_terms`).
         """
-        # reverse faulting flag
-        Frv = 1 if 30 <= rup.rake <= 150 else 0
-        # normal faulting flag
-        Fnm = 1 if -120 <= rup.rake <= -60 else 0
         # hanging wall flag
         Fhw = (dists.rx >= 0)
-        # aftershock flag. always zero since we only consider main shock
-        AS = 0
 
         ln_y_ref = (
-            # first line of eq. 13a
-            C['c1']
-              + (C['c1a'] * Frv
-                   + C['c1b'] * Fnm
-                   + C['c7'] * (rup.ztor - 4))
-                * (1 - AS)
-            + (C['c10'] + C['c7a'] * (rup.ztor - 4)) * AS
-            # second line
-            + C['c2'] * (rup.mag - 6)
-              + ((C['c2'] - C['c3']) / C['cn'])
-                * np.log(1 + np.exp(C['cn'] * (C['cm'] - rup.mag)))
+            # first and second lines of eq. 13a
+            rup_terms['source']
             # third line
             + C['c4']
-              * np.log(dists.rrup
-                       + C['c5']
-                         * np.cosh(C['c6'] * max(rup.mag - C['chm'], 0)))
+              * np.log(dists.rrup + rup_terms['near_source'])
             # fourth line
             + (C['c4a'] - C['c4'])
               * np.log(np.sqrt(dists.rrup ** 2 + C['crb'] ** 2))
             # fifth line
-            + (C['cg1'] + C['cg2'] / (np.cosh(max(rup.mag - C['cg3'], 0))))
-              * dists.rrup
+            + rup_terms['anelastic'] * dists.rrup
             # sixth line
             + C['c9'] * Fhw
-              * np.tanh(dists.rx
-                        * (np.cos(np.radians(rup.dip)) ** 2)
-                        / C['c9a'])
+              * np.tanh(dists.rx * rup_terms['hanging_wall'])
               * (1 - np.sqrt(dists.rjb ** 2 + rup.ztor ** 2)
                   / (dists.rrup + 0.001))
         )
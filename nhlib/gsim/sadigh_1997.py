@@ -77,106 +77,184 @@ class SadighEtAl1997(GMPE):
         <nhlib.gsim.base.GroundShakingIntensityModel.get_mean_and_stddevs>`
         for spec of input and result values.
         """
+        return self._compute_mean_and_stddevs(
+            sites, rup, dists, lambda table: table[imt],
+            self._get_rupture_terms(rup, imt), stddev_types,
+            shape=sites.vs30.shape
+        )
+
+    def get_mean_and_stddevs_for_imts(self, sites, rup, dists, imts,
+                                      stddev_types):
+        """
+        See the method of the same name of
+        :class:`~nhlib.gsim.base.GroundShakingIntensityModel`
+        for spec of input and result values.
+
+        Equations are evaluated for all the IMTs together, with
+        coefficients arranged in columns (see
+        :meth:`~nhlib.gsim.base.CoeffsTable.get_coeffs_for_imts`).
+        """
+        return self._compute_mean_and_stddevs(
+            sites, rup, dists, lambda table: table.get_coeffs_for_imts(imts),
+            self._get_rupture_terms_for_imts(rup, imts), stddev_types,
+            shape=(len(imts), ) + sites.vs30.shape
+        )
+
+    def _compute_mean_and_stddevs(self, sites, rup, dists, get_coeffs,
+                                  rup_terms, stddev_types, shape):
+        """
+        Compute mean and standard deviations.
+
+        :param get_coeffs:
+            Function that takes a coefficients table and returns
+            coefficients from it for the IMT (or IMTs) of interest.
+        :param rup_terms:
+            Dictionary of terms that depend only on rupture, see
+            :meth:`_compute_rupture_terms`.
+        :param shape:
+            Shape of the result arrays.
+        """
         assert all(stddev_type in self.DEFINED_FOR_STANDARD_DEVIATION_TYPES
                    for stddev_type in stddev_types)
 
-        # GMPE differentiates strike-slip, reverse and normal ruptures,
-        # but combines normal and strike-slip into one category. See page 180.
-        is_reverse = (45 <= rup.rake <= 135)
-
-        stddevs = [numpy.zeros_like(sites.vs30) for _ in stddev_types]
-        means = numpy.zeros_like(sites.vs30)
+        stddevs = [numpy.zeros(shape) for _ in stddev_types]
+        means = numpy.zeros(shape)
 
         [rocks_i] = (sites.vs30 > self.ROCK_VS30).nonzero()
         if len(rocks_i):
             rrup = dists.rrup.take(rocks_i)
-            mean_rock = self._get_mean_rock(rup.mag, rup.rake, rrup,
-                                            is_reverse, imt)
-            means.put(rocks_i, mean_rock)
+            C = get_coeffs(self._get_rock_coeffs_table(rup.mag))
+            means[..., rocks_i] = self._get_mean_rock(rrup, C, rup_terms)
             for stddev_arr in stddevs:
-                stddev_rock = self._get_stddev_rock(rup.mag, imt)
-                stddev_arr.put(rocks_i, stddev_rock)
+                stddev_arr[..., rocks_i] = rup_terms['rock_stddev']
 
         [soils_i] = (sites.vs30 <= self.ROCK_VS30).nonzero()
         if len(soils_i):
             rrup = dists.rrup.take(soils_i)
-            mean_soil = self._get_mean_deep_soil(rup.mag, rup.rake, rrup,
-                                                 is_reverse, imt)
-            means.put(soils_i, mean_soil)
+            means[..., soils_i] = self._get_mean_deep_soil(rrup, rup_terms)
             for stddev_arr in stddevs:
-                stddev_soil = self._get_stddev_deep_soil(rup.mag, imt)
-                stddev_arr.put(soils_i, stddev_soil)
+                stddev_arr[..., soils_i] = rup_terms['soil_stddev']
 
         return means, stddevs
 
-    def _get_mean_deep_soil(self, mag, rake, rrup, is_reverse, imt):
+    def _compute_rupture_terms(self, rup, imt):
         """
-        Calculate and return the mean intensity for deep soil sites.
+        Compute terms of equations for rock and deep soil sites that
+        depend only on magnitude and rake.
+        See :meth:`superclass method
+        <nhlib.gsim.base.GroundShakingIntensityModel._compute_rupture_terms>`.
+        """
+        mag = rup.mag
+        # GMPE differentiates strike-slip, reverse and normal ruptures,
+        # but combines normal and strike-slip into one category. See page 180.
+        is_reverse = (45 <= rup.rake <= 135)
+        terms = {}
+
+        # tables for rock and deep soil sites are defined for different
+        # sets of periods, so terms are omitted for the kind of sites
+        # that ``imt`` is not supported for. that makes the error occur
+        # only if there are such sites
+        try:
+            C = self._get_rock_coeffs_table(mag)[imt]
+            C_stderr = self.COEFFS_ROCK_STDDERR[imt]
+        except KeyError:
+            pass
+        else:
+            # table 2
+            rock_mag = (C['c1'] + C['c2'] * mag
+                        + C['c3'] * ((8.5 - mag) ** 2.5))
+            if is_reverse:
+                # footnote in table 2 says that for reverse ruptures
+                # the mean amplitude value should be multiplied by 1.2
+                rock_mag += 0.1823215567939546  # == log(1.2)
+            terms['rock_mag'] = rock_mag
+            terms['rock_exp'] = numpy.exp(C['c5'] + C['c6'] * mag)
+            terms['rock_stddev'] = self._get_stddev_rock(mag, C_stderr)
 
-        Implements an equation from table 4.
+        try:
+            C = self.COEFFS_SOIL[imt]
+        except KeyError:
+            pass
+        else:
+            # table 4
+            if mag <= self.NEAR_FIELD_SATURATION_MAG:
+                c4 = self.COEFFS_SOIL_IMT_INDEPENDENT['c4lowmag']
+                c5 = self.COEFFS_SOIL_IMT_INDEPENDENT['c5lowmag']
+            else:
+                c4 = self.COEFFS_SOIL_IMT_INDEPENDENT['c4himag']
+                c5 = self.COEFFS_SOIL_IMT_INDEPENDENT['c5himag']
+            c2 = self.COEFFS_SOIL_IMT_INDEPENDENT['c2']
+            if is_reverse:
+                c1 = self.COEFFS_SOIL_IMT_INDEPENDENT['c1r']
+                c6 = C['c6r']
+            else:
+                c1 = self.COEFFS_SOIL_IMT_INDEPENDENT['c1ss']
+                c6 = C['c6ss']
+            terms['soil_mag'] = (c1 + c2 * mag + c6
+                                 + C['c7'] * ((8.5 - mag) ** 2.5))
+            terms['soil_exp'] = c4 * numpy.exp(c5 * mag)
+            terms['soil_stddev'] = self._get_stddev_deep_soil(mag, C)
+
+        return terms
+
+    def _get_rock_coeffs_table(self, mag):
+        """
+        Return coefficients table for rock sites: one of
+        :attr:`COEFFS_ROCK_LOWMAG` and :attr:`COEFFS_ROCK_HIMAG`,
+        depending on magnitude.
         """
         if mag <= self.NEAR_FIELD_SATURATION_MAG:
-            c4 = self.COEFFS_SOIL_IMT_INDEPENDENT['c4lowmag']
-            c5 = self.COEFFS_SOIL_IMT_INDEPENDENT['c5lowmag']
+            return self.COEFFS_ROCK_LOWMAG
         else:
-            c4 = self.COEFFS_SOIL_IMT_INDEPENDENT['c4himag']
-            c5 = self.COEFFS_SOIL_IMT_INDEPENDENT['c5himag']
-        c2 = self.COEFFS_SOIL_IMT_INDEPENDENT['c2']
+            return self.COEFFS_ROCK_HIMAG
+
+    def _get_mean_deep_soil(self, rrup, rup_terms):
+        """
+        Calculate and return the mean intensity for deep soil sites.
+
+        Implements an equation from table 4, given terms
+        that depend only on rupture (see :meth:`_compute_rupture_terms`).
+        """
         c3 = self.COEFFS_SOIL_IMT_INDEPENDENT['c3']
-        C = self.COEFFS_SOIL[imt]
-        if is_reverse:
-            c1 = self.COEFFS_SOIL_IMT_INDEPENDENT['c1r']
-            c6 = C['c6r']
-        else:
-            c1 = self.COEFFS_SOIL_IMT_INDEPENDENT['c1ss']
-            c6 = C['c6ss']
-        return (c1 + c2 * mag + c6 + C['c7'] * ((8.5 - mag) ** 2.5)
-                - c3 * numpy.log(rrup + c4 * numpy.exp(c5 * mag)))
+        return (rup_terms['soil_mag']
+                - c3 * numpy.log(rrup + rup_terms['soil_exp']))
 
-    def _get_mean_rock(self, mag, rake, rrup, is_reverse, imt):
+    def _get_mean_rock(self, rrup, C, rup_terms):
         """
         Calculate and return the mean intensity for rock sites.
 
-        Implements an equation from table 2.
+        Implements an equation from table 2, given terms that depend
+        only on rupture (see :meth:`_compute_rupture_terms`). ``C``
+        is coefficients from one of tables :attr:`COEFFS_ROCK_LOWMAG`
+        and :attr:`COEFFS_ROCK_HIMAG`, depending on magnitude.
         """
-        if mag <= self.NEAR_FIELD_SATURATION_MAG:
-            C = self.COEFFS_ROCK_LOWMAG[imt]
-        else:
-            C = self.COEFFS_ROCK_HIMAG[imt]
-        mean = (
-            C['c1'] + C['c2'] * mag + C['c3'] * ((8.5 - mag) ** 2.5)
-            + C['c4'] * numpy.log(rrup + numpy.exp(C['c5'] + C['c6'] * mag))
+        return (
+            rup_terms['rock_mag']
+            + C['c4'] * numpy.log(rrup + rup_terms['rock_exp'])
             + C['c7'] * numpy.log(rrup + 2)
         )
-        if is_reverse:
-            # footnote in table 2 says that for reverse ruptures
-            # the mean amplitude value should be multiplied by 1.2
-            mean += 0.1823215567939546  # == log(1.2)
-        return mean
 
-    def _get_stddev_rock(self, mag, imt):
+    def _get_stddev_rock(self, mag, C):
         """
         Calculate and return total standard deviation for rock sites.
 
-        Implements formulae from table 3.
+        Implements formulae from table 3. ``C`` is coefficients
+        from :attr:`COEFFS_ROCK_STDDERR`.
         """
-        C = self.COEFFS_ROCK_STDDERR[imt]
-        if mag > C['maxmag']:
-            return C['maxsigma']
-        else:
-            return C['sigma0'] + C['magfactor'] * mag
+        return numpy.where(mag > C['maxmag'],
+                           C['maxsigma'], C['sigma0'] + C['magfactor'] * mag)
 
-    def _get_stddev_deep_soil(self, mag, imt):
+    def _get_stddev_deep_soil(self, mag, C):
         """
         Calculate and return total standard deviation for deep soil sites.
 
-        Implements formulae from the last column of table 4.
+        Implements formulae from the last column of table 4. ``C``
+        is coefficients from :attr:`COEFFS_SOIL`.
         """
         # footnote from table 4 says that stderr for magnitudes over 7
         # is equal to one of magnitude 7.
         if mag > 7:
             mag = 7
-        C = self.COEFFS_SOIL[imt]
         return C['sigma0'] + C['magfactor'] * mag
 
     #: Coefficients tables for rock sites (table 2), for magnitude
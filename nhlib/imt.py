@@ -44,6 +44,11 @@ class _IMT(tuple):
         salt = hash(('IMT', cls.__name__))
         return tuple.__new__(cls, args + (salt, ))
 
+    def __getnewargs__(self):
+        # salt is added by __new__, so it must not be passed to it
+        # when unpickling or copying
+        return tuple(self[:-1])
+
     def __repr__(self):
         return '%s(%s)' % (type(self).__name__,
                            ', '.join('%s=%s' % (field, getattr(self, field))
@@ -16,6 +16,9 @@
 """
 Module :mod:`nhlib.site` defines :class:`Site`.
 """
+import os
+import collections
+
 import numpy
 
 from nhlib.geo.mesh import Mesh
@@ -60,6 +63,51 @@ class Site(object):
         self.z2pt5 = z2pt5
 
 
+class _FilteredValue(object):
+    """
+    Descriptor of a :class:`SiteCollection` attribute that is extracted
+    for :meth:`filtered <SiteCollection.filter>` collections from
+    the original collection when it is accessed for the first time.
+
+    The extracted value is stored in the instance dictionary, so this
+    descriptor is not involved anymore in the following lookups.
+    Unfiltered collections set the attributes in constructors and
+    never use the descriptor.
+
+    :param name:
+        Name of the attribute, either ``'mesh'`` or a name of a site
+        parameter.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, col, owner):
+        if col is None:
+            return self
+        root = col._root
+        if self.name == 'mesh':
+            root_mesh = root.mesh
+            value = Mesh(col._take(root_mesh.lons), col._take(root_mesh.lats),
+                         depths=None)
+            arrays = (value.lons, value.lats)
+            # radians and cosines of the root mesh are computed once
+            # and shared by all the filtered collections, Cartesian
+            # coordinates are shared if the root has them already
+            value._rad_coords = tuple(
+                col._take(arr) for arr in root_mesh.get_rad_coords()
+            )
+            if root_mesh._cartesian is not None:
+                value._cartesian = col._take(root_mesh._cartesian)
+        else:
+            value = col._take(getattr(root, self.name))
+            arrays = (value, )
+        # do the same as in :meth:`SiteCollection._set_read_only`
+        for arr in arrays:
+            arr.flags.writeable = False
+        col.__dict__[self.name] = value
+        return value
+
+
 class SiteCollection(object):
     """
     A collection of :class:`sites <Site>`.
@@ -70,8 +118,25 @@ class SiteCollection(object):
     :param sites:
         A list of instances of :class:`Site` class.
     """
+    mesh = _FilteredValue('mesh')
+    vs30 = _FilteredValue('vs30')
+    vs30measured = _FilteredValue('vs30measured')
+    z1pt0 = _FilteredValue('z1pt0')
+    z2pt5 = _FilteredValue('z2pt5')
+
+    #: Slice of sites of the original collection that this filtered
+    #: collection consists of, if they form a contiguous range.
+    #: ``None`` otherwise.
+    _slice = None
+
+    #: Maximum number of entries in the cache of :meth:`get_cached_values`
+    #: of each collection.
+    CACHED_VALUES_SIZE = 200
+
     def __init__(self, sites):
         self.indices = None
+        self._root = None
+        self._cached_values = collections.OrderedDict()
         self.vs30 = numpy.zeros(len(sites))
         self.vs30measured = numpy.zeros(len(sites), dtype=bool)
         self.z1pt0 = self.vs30.copy()
@@ -88,18 +153,155 @@ class SiteCollection(object):
             lats[i] = sites[i].location.latitude
 
         self.mesh = Mesh(lons, lats, depths=None)
+        self._set_read_only()
+
+    @classmethod
+    def from_arrays(cls, lons, lats, vs30, vs30measured, z1pt0, z2pt5):
+        """
+        Create a collection directly from arrays of site parameters,
+        without creating :class:`Site` objects.
+
+        Arrays that already have the right dtype (``float`` for all
+        the parameters except ``vs30measured``, which is ``bool``)
+        are not copied: the collection keeps read-only views on them.
+        Note that changes made to the original arrays are therefore
+        visible in the collection.
+
+        :param lons:
+            1d array of longitudes of sites.
+        :param lats:
+            1d array of latitudes of sites.
+
+        Other parameters are 1d arrays of values of :class:`Site`
+        attributes of the same names. All the arrays must have
+        the same length.
+
+        :returns:
+            A new :class:`SiteCollection` instance.
+        :raises ValueError:
+            If arrays have different lengths or are empty, or if any of
+            ``vs30``, ``z1pt0`` or ``z2pt5`` values is zero or negative.
+        """
+        # ``view()`` makes read-only flags apply to the collection's
+        # arrays only, leaving the ones passed in untouched
+        lons, lats, vs30, z1pt0, z2pt5 = [
+            numpy.asarray(arr, dtype=float).view()
+            for arr in (lons, lats, vs30, z1pt0, z2pt5)
+        ]
+        vs30measured = numpy.asarray(vs30measured, dtype=bool).view()
+        arrays = (lons, lats, vs30, vs30measured, z1pt0, z2pt5)
+        if any(arr.ndim != 1 for arr in arrays) \
+                or len(set(len(arr) for arr in arrays)) != 1:
+            raise ValueError('site parameters must be 1d arrays '
+                             'of the same length')
+        if not len(lons):
+            raise ValueError('at least one site is required')
+        for name, arr in [('vs30', vs30), ('z1pt0', z1pt0),
+                          ('z2pt5', z2pt5)]:
+            if not (arr > 0).all():
+                raise ValueError('%s must be positive' % name)
+
+        col = object.__new__(cls)
+        col.indices = None
+        col._root = None
+        col._cached_values = collections.OrderedDict()
+        col.vs30 = vs30
+        col.vs30measured = vs30measured
+        col.z1pt0 = z1pt0
+        col.z2pt5 = z2pt5
+        col.mesh = Mesh(lons, lats, depths=None)
+        col._set_read_only()
+        return col
+
+    @classmethod
+    def from_structured_array(cls, array):
+        """
+        Create a collection from a numpy structured array.
+
+        :param array:
+            1d structured array with fields named after parameters
+            of :meth:`from_arrays`, like the one of :attr:`DTYPE`.
+            Fields of matching dtypes are used without copying.
+        :returns:
+            A new :class:`SiteCollection` instance.
+        :raises ValueError:
+            If the array lacks some of the fields or in the same cases
+            as :meth:`from_arrays`.
+        """
+        names = cls.DTYPE.names
+        if array.dtype.names is None \
+                or not set(names).issubset(array.dtype.names):
+            raise ValueError('structured array must have fields %s'
+                             % ', '.join(names))
+        return cls.from_arrays(*[array[name] for name in names])
+
+    def save(self, dirname):
+        """
+        Save the collection to a directory in a binary form, one ``.npy``
+        file per site parameter (see :attr:`DTYPE` for file names).
+
+        The collection can be loaded back with :meth:`load`. Note that
+        for :meth:`filtered <filter>` collections only the sites that
+        passed the filter are saved, original indices are not.
+
+        :param dirname:
+            Path to a directory to save files to. It is created
+            if it doesn't exist, existing files are overwritten.
+        """
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        arrays = {'lons': self.mesh.lons, 'lats': self.mesh.lats,
+                  'vs30': self.vs30, 'vs30measured': self.vs30measured,
+                  'z1pt0': self.z1pt0, 'z2pt5': self.z2pt5}
+        for name in self.DTYPE.names:
+            numpy.save(os.path.join(dirname, name + '.npy'), arrays[name])
+
+    @classmethod
+    def load(cls, dirname, mmap=True):
+        """
+        Load a collection saved by :meth:`save`.
+
+        :param dirname:
+            Path to a directory with the collection's files.
+        :param mmap:
+            If ``True`` (the default), files are memory-mapped read-only
+            instead of being read into memory. Data is then loaded lazily
+            by the operating system, and pages are shared between all the
+            processes that map the same files.
+        :returns:
+            A new :class:`SiteCollection` instance.
+        :raises IOError:
+            If any of the files is missing.
+        :raises ValueError:
+            In the same cases as :meth:`from_arrays`.
+        """
+        mmap_mode = 'r' if mmap else None
+        return cls.from_arrays(*[
+            numpy.load(os.path.join(dirname, name + '.npy'),
+                       mmap_mode=mmap_mode)
+            for name in cls.DTYPE.names
+        ])
+
+    #: Numpy dtype of a structured array with all the site parameters,
+    #: see :meth:`from_structured_array`.
+    DTYPE = numpy.dtype([('lons', float), ('lats', float), ('vs30', float),
+                         ('vs30measured', bool), ('z1pt0', float),
+                         ('z2pt5', float)])
 
-        # protect arrays from being accidentally changed. it is useful
-        # because we pass these arrays directly to a GMPE through
-        # a SiteContext object and if a GMPE is implemented poorly it could
-        # modify the site values, thereby corrupting site and all the
-        # subsequent calculation. note that this doesn't protect arrays from
-        # being changed by calling itemset()
+    def _set_read_only(self):
+        """
+        Protect arrays from being accidentally changed.
+        """
+        # it is useful because we pass these arrays directly to a GMPE
+        # through a SiteContext object and if a GMPE is implemented poorly
+        # it could modify the site values, thereby corrupting site and all
+        # the subsequent calculation. note that this doesn't protect arrays
+        # from being changed by calling itemset()
         for arr in (self.vs30, self.vs30measured, self.z1pt0, self.z2pt5,
                     self.mesh.lons, self.mesh.lats):
             arr.flags.writeable = False
 
-    def expand(self, data, total_sites, placeholder):
+    def expand(self, data, total_sites, placeholder, out=None):
         """
         Expand an array that was created for a filtered site collection
         with respect to indices of the sites that were :meth:`filtered
@@ -116,8 +318,8 @@ class SiteCollection(object):
         set of sites which still appears as just a :class:`SiteCollection`
         instance, so that computation code doesn't need to worry about
         filtering, it just needs to handle site collection objects. The
-        calculation result comes in a form of 1d or 2d numpy array (that
-        is, either one value per site or one 1d array per site) with length
+        calculation result comes in a form of numpy array (that is, either
+        one value per site or one array of values per site) with length
         equal to number of sites in a filtered collection. That result
         needs to be expanded to an array of similar structure but the one
         that holds values for all the sites in the original (unfiltered)
@@ -128,44 +330,50 @@ class SiteCollection(object):
         everywhere else.
 
         :param data:
-            1d or 2d numpy array with first dimension representing values
-            computed for site from this collection.
+            Numpy array of any number of dimensions with the first one
+            representing values computed for site from this collection.
         :param total_sites:
             Integer number representing a total number of sites in
             a collection this one was created from.
         :param placeholder:
             A scalar value to be put in result array for those sites that
             were filtered out and no real calculation was performed for them.
+        :param out:
+            Optional preallocated array to write the result to, which
+            allows to avoid allocation when expanding repeatedly. Must
+            have shape ``(total_sites, ) + data.shape[1:]``.
         :returns:
             Array of length ``total_sites`` with values from ``data``
-            distributed in the appropriate places.
+            distributed in the appropriate places. It is ``out`` if it
+            was provided. Otherwise it is a new float array unless this
+            collection was not filtered, in which case ``data`` itself
+            is returned.
         """
         num_sites_computed = data.shape[0]
         assert num_sites_computed == len(self)
+        shape = (total_sites, ) + data.shape[1:]
+        assert out is None or out.shape == shape
 
         if self.indices is None:
             assert total_sites == num_sites_computed
             # nothing to expand: this sites collection was not filtered
-            return data
+            if out is None:
+                return data
+            out[...] = data
+            return out
 
         assert num_sites_computed < total_sites
         assert self.indices[-1] < total_sites
 
-        if data.ndim == 1:
-            # single-dimensional array
-            result = numpy.empty(total_sites)
-            result.fill(placeholder)
-            result.put(self.indices, data)
-            return result
-
-        assert data.ndim == 2
-        # two-dimensional array
-        num_values = data.shape[1]
-        result = numpy.empty((total_sites, num_values))
-        result.fill(placeholder)
-        for i in xrange(num_values):
-            result[:, i].put(self.indices, data[:, i])
-        return result
+        if out is None:
+            out = numpy.empty(shape)
+        out.fill(placeholder)
+        # a single assignment puts all the trailing dimensions in place
+        if self._slice is not None:
+            out[self._slice] = data
+        else:
+            out[self.indices] = data
+        return out
 
     def filter(self, mask):
         """
@@ -182,6 +390,10 @@ class SiteCollection(object):
             in which case method returns ``None``. New collection has data
             of only those sites that were marked for inclusion in mask.
 
+        Site parameters and mesh of the new collection are extracted
+        from the original one lazily, when they are accessed for the first
+        time, so only the values that are actually used are copied.
+
         See also :meth:`expand`.
         """
         assert len(mask) == len(self)
@@ -195,15 +407,6 @@ class SiteCollection(object):
         col = object.__new__(SiteCollection)
         # extract indices of Trues from the mask
         [indices] = mask.nonzero()
-        # take only needed values from this collection
-        # to a new one
-        col.vs30 = self.vs30.take(indices)
-        col.vs30measured = self.vs30measured.take(indices)
-        col.z1pt0 = self.z1pt0.take(indices)
-        col.z2pt5 = self.z2pt5.take(indices)
-        col.mesh = Mesh(self.mesh.lons.take(indices),
-                        self.mesh.lats.take(indices),
-                        depths=None)
         if self.indices is not None:
             # if this collection was already a subset of some other
             # collection (a result of :meth:`filter` itself) than mask's
@@ -215,14 +418,180 @@ class SiteCollection(object):
             col.indices = self.indices.take(indices)
         else:
             col.indices = indices
-        # do the same as in the constructor
-        for arr in (col.vs30, col.vs30measured, col.z1pt0, col.z2pt5,
-                    col.mesh.lons, col.mesh.lats):
-            arr.flags.writeable = False
+        if col.indices[-1] - col.indices[0] + 1 == len(col.indices):
+            # sites that passed the filter form a contiguous range
+            # in the original collection, so a slice can be used
+            # instead of the indices array, which makes values of
+            # filtered collection views rather than copies
+            col._slice = slice(col.indices[0], col.indices[-1] + 1)
+        col._root = self if self._root is None else self._root
+        col._cached_values = collections.OrderedDict()
+        # site parameters and mesh are not copied here, they are taken
+        # from the original collection on first access, see
+        # :class:`_FilteredValue`
         return col
 
+    def get_cached_values(self, key, compute):
+        """
+        Get values that depend only on sites parameters, computing them
+        only once for the whole site collection.
+
+        The typical use case is site terms of a GSIM, which don't depend
+        on a rupture and therefore are the same for all the ruptures that
+        affect the site.
+
+        :param key:
+            Hashable object that identifies the values, for example a tuple
+            of a GSIM object and an intensity measure type.
+        :param compute:
+            A function to call with a site collection as the only argument
+            if the values are not cached yet. Should return a dictionary
+            mapping names to arrays with one value per site in the
+            collection, or ``None`` if there are no values to cache.
+        :returns:
+            A dictionary of the same structure as ``compute`` returns, with
+            values for the sites of this collection, or ``None`` if
+            ``compute`` returned ``None``.
+
+        If this collection is a :meth:`filtered <filter>` one, values are
+        computed (and cached) for the original collection and the ones
+        of filtered out sites are dropped.
+
+        The cache keeps up to :attr:`CACHED_VALUES_SIZE` entries, the oldest
+        one is evicted when it is full.
+        """
+        if key in self._cached_values:
+            return self._cached_values[key]
+        if self._root is None:
+            values = compute(self)
+        else:
+            root_values = self._root.get_cached_values(key, compute)
+            if root_values is None:
+                values = None
+            else:
+                values = dict((name, self._take(array))
+                              for (name, array) in root_values.iteritems())
+        if len(self._cached_values) >= self.CACHED_VALUES_SIZE:
+            self._cached_values.popitem(last=False)
+        self._cached_values[key] = values
+        return values
+
+    def _take(self, array):
+        """
+        Take rows of sites of this filtered collection from an array
+        with one row per site of the original collection.
+        """
+        if self._slice is not None:
+            return array[self._slice]
+        return array.take(self.indices, axis=0)
+
+    def reorder(self, curve='hilbert', bits=16):
+        """
+        Create a new collection with the same sites ordered along
+        a space-filling curve.
+
+        Sites that are close to each other geographically get close
+        indices in the new collection, so sites that pass a distance
+        filter (see :meth:`filter`) mostly form a few contiguous ranges,
+        which makes taking and putting their values much more cache
+        friendly. If they form a single range, filtered collection
+        uses views instead of copies of site parameters.
+
+        :param curve:
+            Either ``'hilbert'`` for Hilbert curve or ``'morton'`` for
+            Z-order (Morton) curve. Hilbert curve has better locality,
+            Morton codes are cheaper to compute.
+        :param bits:
+            Number of bits per coordinate for positions of sites on
+            the curve, from 1 to 31 (codes of both coordinates have
+            to fit in 64 bit integers). Bounding box of sites is divided
+            in a grid of ``2 ** bits`` by ``2 ** bits`` cells.
+        :returns:
+            A tuple of two items: a new :class:`SiteCollection` and
+            a permutation array, such that i-th site of the new collection
+            is the one with index ``permutation[i]`` in this collection.
+            Values computed for the new collection can be restored to the
+            original order with ``values[numpy.argsort(permutation)]``
+            or ``original[permutation] = values``.
+        :raises ValueError:
+            If ``curve`` is unknown, if ``bits`` is out of range or if
+            this collection is a filtered one.
+        """
+        if self.indices is not None:
+            raise ValueError('filtered collections can not be reordered')
+        if not 1 <= bits <= 31:
+            raise ValueError('bits must be from 1 to 31')
+        if curve == 'hilbert':
+            get_codes = _hilbert_codes
+        elif curve == 'morton':
+            get_codes = _morton_codes
+        else:
+            raise ValueError('unknown space-filling curve %r' % curve)
+        x = _to_grid(self.mesh.lons, bits)
+        y = _to_grid(self.mesh.lats, bits)
+        permutation = numpy.argsort(get_codes(x, y, bits), kind='mergesort')
+        col = SiteCollection.from_arrays(
+            *[arr.take(permutation)
+              for arr in (self.mesh.lons, self.mesh.lats, self.vs30,
+                          self.vs30measured, self.z1pt0, self.z2pt5)]
+        )
+        return col, permutation
+
     def __len__(self):
         """
         Return a number of sites in a collection.
         """
+        if self.indices is not None:
+            return len(self.indices)
         return len(self.mesh)
+
+
+def _to_grid(values, bits):
+    """
+    Scale ``values`` to integer coordinates in a range between 0
+    and ``2 ** bits - 1``.
+    """
+    values = values - values.min()
+    max_value = values.max()
+    if max_value > 0:
+        values *= (2 ** bits - 1) / max_value
+    return values.astype(numpy.int64)
+
+
+def _morton_codes(x, y, bits):
+    """
+    Compute positions of points with integer coordinates ``x`` and ``y``
+    on Z-order (Morton) curve, interleaving bits of coordinates.
+    """
+    codes = numpy.zeros(len(x), dtype=numpy.int64)
+    for bit in xrange(bits):
+        codes |= ((x >> bit) & 1) << (2 * bit)
+        codes |= ((y >> bit) & 1) << (2 * bit + 1)
+    return codes
+
+
+def _hilbert_codes(x, y, bits):
+    """
+    Compute positions of points with integer coordinates ``x`` and ``y``
+    on Hilbert curve of order ``bits``.
+
+    Vectorized version of the classical algorithm, see
+    http://en.wikipedia.org/wiki/Hilbert_curve.
+    """
+    n = 2 ** bits
+    x = x.copy()
+    y = y.copy()
+    codes = numpy.zeros(len(x), dtype=numpy.int64)
+    s = n // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        codes += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant
+        flip = ~ry & rx
+        x[flip] = n - 1 - x[flip]
+        y[flip] = n - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap]
+        s //= 2
+    return codes
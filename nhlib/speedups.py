@@ -18,7 +18,13 @@ Module :mod:`nhlib.speedups` contains internal utilities for managing
 alternative implementation of the same functionality depending on their
 availability.
 """
+import bisect
 import inspect
+import threading
+import types
+from timeit import default_timer
+
+import numpy
 
 
 class SpeedupsRegistry(object):
@@ -60,53 +66,331 @@ class SpeedupsRegistry(object):
 
     Global registry is being used here. All speedups are enabled by default.
     In order to disable them, use :meth:`disable`.
+
+    A function can have several alternative implementations. By default
+    the one registered last is used, its code is substituted for
+    the function's code as is. If the function was registered with
+    ``size`` and ``sample`` parameters, registry can pick the fastest
+    implementation depending on the size of the input, see
+    :meth:`calibrate`. Calls of calibrated functions go through
+    a dispatcher, which chooses the implementation for each call.
+
+    :param autotune:
+        If ``True``, functions that can be calibrated are calibrated
+        by the dispatcher on their first call, so that call (made by
+        whatever code happens to call the function first) also runs
+        the benchmark, which can take a while. Otherwise functions
+        are only calibrated by explicit :meth:`calibrate`, which is
+        the recommended way.
+    :param collect_stats:
+        If ``True``, calls to all the registered functions go through
+        the dispatcher, which counts and times them while speedups are
+        enabled, see :meth:`get_stats`. Collection can be switched
+        with :meth:`enable_stats` and :meth:`disable_stats`.
     """
-    def __init__(self):
+    #: Default sizes of input to benchmark implementations for,
+    #: see :meth:`calibrate`.
+    CALIBRATION_SIZES = (10, 100, 1000, 10000, 100000)
+
+    def __init__(self, autotune=False, collect_stats=False):
         self.enabled = True
+        self.autotune = autotune
+        self.collect_stats = collect_stats
         self.funcs = {}
 
-    def register(self, func, altfunc):
+    def register(self, func, altfunc, size=None, sample=None):
         """
         Add a function and its alternative implementation to the registry.
 
         If registry is enabled, function code will be substituted
-        by an alternative implementation immediately.
+        by an alternative implementation (or the dispatcher, see
+        :class:`SpeedupsRegistry`) immediately.
 
         :param func:
             A function object to patch.
         :param altfunc:
             An alternative implementation of the function. Must have
             the same signature and is supposed to behave exactly
-            the same way as ``func``.
+            the same way as ``func``. If the function already has
+            alternative implementations, a new one is added to them.
+        :param size:
+            Optional function with the same signature as ``func``
+            returning the size of the problem (for instance, the number
+            of pairs of points) for the given arguments.
+        :param sample:
+            Optional function taking one argument, problem size,
+            and returning a tuple of positional and keyword arguments
+            for ``func`` representing a problem of about that size.
+            Together with ``size`` allows calibration of the dispatch
+            policy, see :meth:`calibrate`.
         """
         assert inspect.getargspec(func) == inspect.getargspec(altfunc), \
                "functions signatures are different in %s and %s" % \
                (func, altfunc)
-        self.funcs[func] = (func.func_code, altfunc.func_code)
+        entry = self.funcs.get(func)
+        if entry is None:
+            entry = self.funcs[func] = _FunctionEntry(self, func)
+        entry.add(altfunc, size, sample)
         if self.enabled:
             # here we substitute the "func_code" attribute of the function,
             # which allows us not to worry of when and how is this function
             # being imported by other modules
-            func.func_code = altfunc.func_code
+            func.func_code = entry.get_code()
 
     def enable(self):
         """
         Set implementation to "alternative" for all the registered functions.
         """
-        for func in self.funcs:
-            origcode, altcode = self.funcs[func]
-            func.func_code = altcode
+        for func, entry in self.funcs.iteritems():
+            func.func_code = entry.get_code()
         self.enabled = True
 
     def disable(self):
         """
         Set implementation to "original" for all the registered functions.
         """
-        for func in self.funcs:
-            origcode, altcode = self.funcs[func]
-            func.func_code = origcode
+        for func, entry in self.funcs.iteritems():
+            func.func_code = entry.orig_code
         self.enabled = False
 
+    def calibrate(self, func=None, sizes=None, repeat=3):
+        """
+        Run micro-benchmark of all the implementations of a function
+        and set up the dispatch policy, so that the fastest implementation
+        for the size of the input is used in subsequent calls.
+
+        Only functions registered with both ``size`` and ``sample``
+        can be calibrated.
+
+        :param func:
+            Function to calibrate. If omitted, all the functions that
+            can be calibrated are.
+        :param sizes:
+            Sequence of problem sizes to benchmark implementations for.
+            The fastest implementation for a size is used for inputs
+            bigger than the previous size and up to that one, or bigger
+            for the last size. Defaults to :attr:`CALIBRATION_SIZES`.
+        :param repeat:
+            Number of times to run each implementation for each size.
+            The best time is considered.
+        """
+        if sizes is None:
+            sizes = self.CALIBRATION_SIZES
+        if func is None:
+            funcs = [func for (func, entry) in self.funcs.iteritems()
+                     if entry.can_calibrate()]
+        else:
+            funcs = [func]
+        for func in funcs:
+            entry = self.funcs[func]
+            entry.calibrate(sizes, repeat)
+            if self.enabled:
+                # calibrated functions need the dispatcher
+                func.func_code = entry.get_code()
+
+    def enable_stats(self):
+        """
+        Start counting and timing calls, see :meth:`get_stats`.
+        """
+        self.collect_stats = True
+        if self.enabled:
+            self.enable()
+
+    def disable_stats(self):
+        """
+        Stop counting and timing calls. Statistics collected so far
+        are kept.
+        """
+        self.collect_stats = False
+        if self.enabled:
+            self.enable()
+
+    def get_stats(self):
+        """
+        Get call statistics of the registered functions, collected while
+        both speedups and statistics collection were enabled.
+
+        :returns:
+            Dictionary mapping qualified names of functions to dictionaries,
+            which map names of implementations to tuples of number of calls
+            and total time spent in them in seconds. Name of the original
+            implementation is ``'original'``, alternative ones have names
+            of functions registered as alternatives.
+        """
+        return dict((entry.name, entry.get_stats())
+                    for entry in self.funcs.itervalues())
+
+    def reset_stats(self):
+        """
+        Reset call counts and times of all the registered functions.
+        """
+        for entry in self.funcs.itervalues():
+            entry.reset_stats()
+
+
+class _FunctionEntry(object):
+    """
+    Registry record for a function with alternative implementations,
+    which also serves as dispatcher of calls to it.
+
+    Dispatching is done by substituting the function code by the one
+    of a generated function with the same signature, which just passes
+    all the arguments to the entry object. The latter can't be referred
+    to by name from the function's module namespace, so it is placed
+    to constants of the generated code instead. Dispatching is only
+    used if it is needed, see :meth:`get_code`.
+    """
+    def __init__(self, registry, func):
+        self.registry = registry
+        self.name = '%s.%s' % (func.__module__, func.__name__)
+        self.orig_code = func.func_code
+        orig = types.FunctionType(func.func_code, func.func_globals,
+                                  func.func_name, func.func_defaults,
+                                  func.func_closure)
+        self.impls = [('original', orig)]
+        self.size = self.sample = None
+        #: Tuple of two lists: problem sizes and implementations to use
+        #: for them, see :meth:`calibrate`.
+        self.policy = None
+        self.stats = {}
+        # calls can be made from several threads
+        self.stats_lock = threading.Lock()
+        self.calibration_lock = threading.Lock()
+        self.dispatch_code = self._make_dispatch_code(func)
+
+    def _make_dispatch_code(self, func):
+        """
+        Generate the code of a function with the same signature as ``func``
+        that calls this entry object with all the arguments.
+        """
+        args, varargs, varkw, _ = inspect.getargspec(func)
+        signature = inspect.formatargspec(args, varargs, varkw)
+        placeholder = '__dispatcher__'
+        source = 'def %s%s:\n    return %r%s\n' % (
+            func.__name__, signature, placeholder, signature
+        )
+        namespace = {}
+        exec compile(source, func.func_code.co_filename, 'exec') in namespace
+        code = namespace[func.__name__].func_code
+        consts = tuple(self if const == placeholder else const
+                       for const in code.co_consts)
+        return types.CodeType(
+            code.co_argcount, code.co_nlocals, code.co_stacksize,
+            code.co_flags, code.co_code, consts, code.co_names,
+            code.co_varnames, code.co_filename, code.co_name,
+            func.func_code.co_firstlineno, code.co_lnotab,
+            code.co_freevars, code.co_cellvars
+        )
+
+    def get_code(self):
+        """
+        Return the code to substitute for the function's code when
+        speedups are enabled: the dispatcher's if calls have to be
+        timed or implementation has to be chosen per call, otherwise
+        the one of the last registered implementation.
+        """
+        registry = self.registry
+        if registry.collect_stats or self.policy is not None \
+                or (registry.autotune and self.can_calibrate()):
+            return self.dispatch_code
+        _, func = self.impls[-1]
+        return func.func_code
+
+    def add(self, altfunc, size, sample):
+        """
+        Add an alternative implementation. Resets the dispatch policy.
+        """
+        self.impls.append((altfunc.__name__, altfunc))
+        if size is not None:
+            self.size = size
+        if sample is not None:
+            self.sample = sample
+        self.policy = None
+
+    def can_calibrate(self):
+        """
+        Return ``True`` if the function has enough information
+        for calibration.
+        """
+        return self.size is not None and self.sample is not None
+
+    def calibrate(self, sizes, repeat):
+        """
+        Benchmark all the implementations and set the dispatch policy.
+        See :meth:`SpeedupsRegistry.calibrate`.
+        """
+        assert self.can_calibrate(), \
+               '%s is registered without size or sample function' % self.name
+        policy_sizes = []
+        policy_impls = []
+        for size in sorted(sizes):
+            args, kwargs = self.sample(size)
+            timings = []
+            for impl in self.impls:
+                _, func = impl
+                # warm up
+                func(*args, **kwargs)
+                best = float('inf')
+                for _ in xrange(repeat):
+                    start = default_timer()
+                    func(*args, **kwargs)
+                    best = min(best, default_timer() - start)
+                timings.append((best, impl))
+            _, fastest = min(timings)
+            policy_sizes.append(self.size(*args, **kwargs))
+            policy_impls.append(fastest)
+        self.policy = (policy_sizes, policy_impls)
+
+    def choose(self, args, kwargs):
+        """
+        Choose the implementation to use for a call.
+        """
+        policy = self.policy
+        if policy is None:
+            if not (self.registry.autotune and self.can_calibrate()):
+                return self.impls[-1]
+            # calibration happens in the first call, concurrent first
+            # calls wait for it instead of calibrating simultaneously
+            with self.calibration_lock:
+                if self.policy is None:
+                    self.calibrate(self.registry.CALIBRATION_SIZES,
+                                   repeat=3)
+                policy = self.policy
+        sizes, impls = policy
+        idx = bisect.bisect_left(sizes, self.size(*args, **kwargs))
+        return impls[min(idx, len(impls) - 1)]
+
+    def __call__(self, *args, **kwargs):
+        name, func = self.choose(args, kwargs)
+        if not self.registry.collect_stats:
+            return func(*args, **kwargs)
+        start = default_timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = default_timer() - start
+            with self.stats_lock:
+                stats = self.stats.get(name)
+                if stats is None:
+                    stats = self.stats[name] = [0, 0.0]
+                stats[0] += 1
+                stats[1] += elapsed
+
+    def get_stats(self):
+        """
+        Return call counts and times, see :meth:`SpeedupsRegistry.get_stats`.
+        """
+        with self.stats_lock:
+            return dict((name, tuple(stats))
+                        for name, stats in self.stats.iteritems())
+
+    def reset_stats(self):
+        """
+        Reset call counts and times.
+        """
+        with self.stats_lock:
+            self.stats.clear()
+
 
 global_registry = SpeedupsRegistry()
 
@@ -116,3 +400,78 @@ register = global_registry.register
 enable = global_registry.enable
 #: Global (default) registry :meth:`disable`.
 disable = global_registry.disable
+#: Global (default) registry :meth:`calibrate`.
+calibrate = global_registry.calibrate
+#: Global (default) registry :meth:`enable_stats`.
+enable_stats = global_registry.enable_stats
+#: Global (default) registry :meth:`disable_stats`.
+disable_stats = global_registry.disable_stats
+#: Global (default) registry :meth:`get_stats`.
+get_stats = global_registry.get_stats
+#: Global (default) registry :meth:`reset_stats`.
+reset_stats = global_registry.reset_stats
+
+
+#: Number of threads to split the calculation between in speedups
+#: functions that release the GIL (see :func:`map_chunks`). Default
+#: value of 1 means calculation is done in the calling thread.
+THREADS = 1
+#: Minimum number of target points to hand to one thread. Splitting
+#: smaller collections costs more in thread synchronization than it gains.
+MIN_CHUNK_SIZE = 1000
+
+#: Thread pools by their size, see :func:`_get_pool`.
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _get_pool(threads):
+    """
+    Return a thread pool of the requested size, creating it if necessary.
+
+    Pools are created lazily and shared between calls. They are kept
+    for the life of the process and never closed, since other threads
+    may be mapping over them at any time. Pool size is either
+    :data:`THREADS` or the explicit ``threads`` of :func:`map_chunks`,
+    so there are only as many pools as distinct values of those.
+    """
+    with _POOLS_LOCK:
+        pool = _POOLS.get(threads)
+        if pool is None:
+            from multiprocessing.pool import ThreadPool
+            pool = _POOLS[threads] = ThreadPool(threads)
+        return pool
+
+
+def map_chunks(func, num_points, threads=None):
+    """
+    Split the collection of target points in contiguous chunks and
+    process them in parallel threads.
+
+    It only makes sense for functions that release the GIL while doing
+    the heavy lifting, which is the case for the C speedups of
+    :func:`nhlib.geo.geodetic.min_distance` and
+    :func:`nhlib.geo.utils.point_to_polygon_distance`.
+
+    :param func:
+        A function taking one argument, a ``slice`` object, and returning
+        1d numpy array of results for the target points in that slice.
+    :param num_points:
+        Total number of target points.
+    :param threads:
+        Number of threads to use. If omitted, :data:`THREADS` is used.
+        The number of chunks is limited so that each one has at least
+        :data:`MIN_CHUNK_SIZE` points, the size of the pool of threads
+        doesn't depend on it.
+    :returns:
+        1d numpy array of results for all the target points, in order.
+    """
+    if threads is None:
+        threads = THREADS
+    num_chunks = min(threads, num_points // MIN_CHUNK_SIZE)
+    if num_chunks <= 1:
+        return func(slice(None))
+    bounds = numpy.linspace(0, num_points, num_chunks + 1).astype(int)
+    slices = [slice(start, stop)
+              for start, stop in zip(bounds[:-1], bounds[1:])]
+    return numpy.concatenate(_get_pool(threads).map(func, slices))
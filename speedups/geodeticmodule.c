@@ -127,6 +127,13 @@ geodetic_min_distance(
     iternext_m = NpyIter_GetIterNext(iter_m, NULL);
     dataptrarray_m = NpyIter_GetDataPtrArray(iter_m);
 
+    // neither of the iterators is buffered, so iterating over them doesn't
+    // require the GIL. we release it for the whole calculation in order
+    // to let other python threads (possibly running this same function
+    // for another chunk of sites) proceed in parallel
+    char *errmsg = NULL;
+    Py_BEGIN_ALLOW_THREADS
+
     do
     {
         // iterate sites in the outer loop
@@ -170,7 +177,11 @@ geodetic_min_distance(
             }
 
         } while (iternext_m(iter_m));
-        NpyIter_Reset(iter_m, NULL);
+        // passing non-NULL error message pointer makes reset safe
+        // to call without holding the GIL. the error is raised once
+        // the GIL is acquired again
+        if (NpyIter_Reset(iter_m, &errmsg) != NPY_SUCCEED)
+            break;
 
         // save the result for the current site: either index
         // of the closest point or actual minimum distance
@@ -180,6 +191,15 @@ geodetic_min_distance(
             *(double *) dataptrarray_s[3] = min_dist;
     } while (iternext_s(iter_s));
 
+    Py_END_ALLOW_THREADS
+
+    if (errmsg != NULL) {
+        PyErr_SetString(PyExc_RuntimeError, errmsg);
+        NpyIter_Deallocate(iter_s);
+        NpyIter_Deallocate(iter_m);
+        return NULL;
+    }
+
     PyArrayObject *result = NpyIter_GetOperandArray(iter_s)[3];
     Py_INCREF(result);
     if (NpyIter_Deallocate(iter_s) != NPY_SUCCEED
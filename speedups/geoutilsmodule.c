@@ -144,6 +144,11 @@ geoutils_point_to_polygon_distance(
     iternext_p = NpyIter_GetIterNext(iter_p, NULL);
     dataptrarray_p = NpyIter_GetDataPtrArray(iter_p);
 
+    // none of the iterators is buffered, so the loop over target points
+    // doesn't need the GIL and we can let other python threads run
+    char *errmsg = NULL;
+    Py_BEGIN_ALLOW_THREADS
+
     do
     {
         // loop over points
@@ -161,7 +166,11 @@ geoutils_point_to_polygon_distance(
         // zero or even number of intersections means that point is outside
         int intersections = 0;
 
-        NpyIter_Reset(iter_c, NULL);
+        // non-NULL error message pointer makes it safe to call reset
+        // without holding the GIL. the error is raised once the GIL
+        // is acquired again
+        if (NpyIter_Reset(iter_c, &errmsg) != NPY_SUCCEED)
+            break;
 
         ecx = *(double *) dataptrarray_c[0];
         ecy = *(double *) dataptrarray_c[1];
@@ -276,6 +285,15 @@ geoutils_point_to_polygon_distance(
 
     } while (iternext_p(iter_p));
 
+    Py_END_ALLOW_THREADS
+
+    if (errmsg != NULL) {
+        PyErr_SetString(PyExc_RuntimeError, errmsg);
+        NpyIter_Deallocate(iter_c);
+        NpyIter_Deallocate(iter_p);
+        return NULL;
+    }
+
     PyArrayObject *result = NpyIter_GetOperandArray(iter_p)[2];
     Py_INCREF(result);
     if (NpyIter_Deallocate(iter_c) != NPY_SUCCEED
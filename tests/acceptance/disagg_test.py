@@ -21,18 +21,19 @@ from nhlib.source import AreaSource
 from nhlib.pmf import PMF
 from nhlib.scalerel import WC1994
 from nhlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
-from nhlib.calc import disagg
+from nhlib.calc import disagg, filters
 from nhlib.geo import Point, Polygon, NodalPlane
 from nhlib.mfd import TruncatedGRMFD
 from nhlib.imt import SA
 from nhlib.tom import PoissonTOM
-from nhlib.site import Site
+from nhlib.site import Site, SiteCollection
+from nhlib.calc.hazard_curve import hazard_curves_poissonian
 
 
 class DisaggTestCase(unittest.TestCase):
-    def test_areasource(self):
+    def setUp(self):
         nodalplane = NodalPlane(strike=0.0, dip=90.0, rake=0.0)
-        src = AreaSource(
+        self.src = AreaSource(
             source_id='src_1',
             name='area source',
             tectonic_region_type='Active Shallow Crust',
@@ -49,28 +50,30 @@ class DisaggTestCase(unittest.TestCase):
             area_discretization=9.0,
             rupture_mesh_spacing=1.0
         )
-        site = Site(location=Point(0.0,0.0),
-                    vs30=800.0,
-                    vs30measured=True,
-                    z1pt0=500.0,
-                    z2pt5=2.0)
-        gsims = {'Active Shallow Crust': BooreAtkinson2008()}
-        imt = SA(period=0.1,damping=5.0)
-        iml = 0.2
-        time_span = 50.0
-        truncation_level = 3.0
-        tom = PoissonTOM(time_span)
-        n_epsilons = 3
-        mag_bin_width = 0.2
+        self.site = Site(location=Point(0.0,0.0),
+                         vs30=800.0,
+                         vs30measured=True,
+                         z1pt0=500.0,
+                         z2pt5=2.0)
+        self.gsims = {'Active Shallow Crust': BooreAtkinson2008()}
+        self.imt = SA(period=0.1,damping=5.0)
+        self.iml = 0.2
+        self.time_span = time_span = 50.0
+        self.truncation_level = 3.0
+        self.tom = PoissonTOM(time_span)
+        self.n_epsilons = 3
+        self.mag_bin_width = 0.2
         # in km
-        dist_bin_width = 10.0
+        self.dist_bin_width = 10.0
         # in decimal degree
-        coord_bin_width = 0.2
+        self.coord_bin_width = 0.2
 
+    def test_areasource(self):
         # compute disaggregation
         bin_edges, diss_matrix = disagg.disaggregation(
-            [src], site, imt, iml, gsims, tom, truncation_level, n_epsilons,
-            mag_bin_width, dist_bin_width, coord_bin_width
+            [self.src], self.site, self.imt, self.iml, self.gsims, self.tom,
+            self.truncation_level, self.n_epsilons, self.mag_bin_width,
+            self.dist_bin_width, self.coord_bin_width
         )
         mag_bins, dist_bins, lon_bins, lat_bins, eps_bins, trt_bins = bin_edges
         numpy.testing.assert_almost_equal(
@@ -138,3 +141,144 @@ dZGB32PZTMFz7ZOwbSJ/uX50ll2J5FUUxNalx8w6RvvMWwqrddjTa5fcki7HsfdT/w2lsy9ffFD8
 m9n/LZN5Yl8lyWDXpzn+QfuH1zOwPjrrWX1RO3kK9vMS9omuUw+LfjOvCwAAAAAAgLH4A6tzO/E=\
 """.decode('base64').decode('zip')).reshape((8, 8, 6, 6, 3, 1))
         numpy.testing.assert_almost_equal(diss_matrix, expected_matrix)
+
+    def test_areasource_fixed_bins(self):
+        bin_edges, expected_matrix = disagg.disaggregation(
+            [self.src], self.site, self.imt, self.iml, self.gsims, self.tom,
+            self.truncation_level, self.n_epsilons, self.mag_bin_width,
+            self.dist_bin_width, self.coord_bin_width
+        )
+        diss_matrix = disagg.disaggregation_fixed_bins(
+            [self.src], self.site, self.imt, self.iml, self.gsims, self.tom,
+            self.truncation_level, bin_edges
+        )
+        numpy.testing.assert_almost_equal(diss_matrix, expected_matrix)
+
+        # bins defined from the source model are wider than the ones
+        # defined from ruptures, but the marginal distributions
+        # must be the same
+        src_bin_edges = disagg.get_bin_edges(
+            [self.src], self.site, self.mag_bin_width, self.dist_bin_width,
+            self.coord_bin_width, self.truncation_level, self.n_epsilons
+        )
+        mag_bins, dist_bins, lon_bins, lat_bins, eps_bins, trt_bins \
+            = src_bin_edges
+        numpy.testing.assert_almost_equal(mag_bins, bin_edges[0])
+        numpy.testing.assert_almost_equal(
+            dist_bins, [0., 10., 20., 30., 40., 50., 60., 70., 80., 90., 100.]
+        )
+        numpy.testing.assert_almost_equal(
+            lon_bins, [-0.8, -0.6, -0.4, -0.2, 0., 0.2, 0.4, 0.6, 0.8]
+        )
+        numpy.testing.assert_almost_equal(
+            lat_bins, [-0.8, -0.6, -0.4, -0.2, 0., 0.2, 0.4, 0.6, 0.8]
+        )
+        numpy.testing.assert_almost_equal(eps_bins, bin_edges[4])
+        self.assertEqual(trt_bins, ['Active Shallow Crust'])
+
+        diss_matrix = disagg.disaggregation_fixed_bins(
+            [self.src], self.site, self.imt, self.iml, self.gsims, self.tom,
+            self.truncation_level, src_bin_edges
+        )
+        numpy.testing.assert_almost_equal(disagg.mag_pmf(diss_matrix),
+                                          disagg.mag_pmf(expected_matrix))
+        numpy.testing.assert_almost_equal(
+            disagg.lon_lat_pmf(diss_matrix)[1:-1, 1:-1],
+            disagg.lon_lat_pmf(expected_matrix)
+        )
+
+    def test_hazard_curves_and_disaggregation(self):
+        site2 = Site(location=Point(0.3, 0.1), vs30=400.0,
+                     vs30measured=False, z1pt0=100.0, z2pt5=1.0)
+        # the third site is too far from the source
+        site3 = Site(location=Point(10, 10), vs30=400.0,
+                     vs30measured=False, z1pt0=100.0, z2pt5=1.0)
+        sites = SiteCollection([site2, self.site, site3])
+        imts = {self.imt: [0.01, 0.1, 0.2, 0.4, 0.8]}
+        source_site_filter = filters.source_site_distance_filter(100)
+        rupture_site_filter = filters.rupture_site_distance_filter(100)
+        kwargs = dict(source_site_filter=source_site_filter,
+                      rupture_site_filter=rupture_site_filter)
+
+        expected_curves = hazard_curves_poissonian(
+            [self.src], sites, imts, self.time_span, self.gsims,
+            self.truncation_level, **kwargs
+        )
+        curves, results = disagg.hazard_curves_and_disaggregation(
+            [self.src], sites, imts, self.time_span, self.gsims,
+            self.truncation_level, [1, 2], self.imt, self.n_epsilons,
+            self.mag_bin_width, self.dist_bin_width, self.coord_bin_width,
+            iml=self.iml, **kwargs
+        )
+        numpy.testing.assert_almost_equal(curves[self.imt],
+                                          expected_curves[self.imt])
+        self.assertEqual(len(results), 2)
+        self.assertIsNone(results[1])
+        iml, bin_edges, diss_matrix = results[0]
+        self.assertEqual(iml, self.iml)
+        expected_bin_edges, expected_matrix = disagg.disaggregation(
+            [self.src], self.site, self.imt, self.iml, self.gsims, self.tom,
+            self.truncation_level, self.n_epsilons, self.mag_bin_width,
+            self.dist_bin_width, self.coord_bin_width, **kwargs
+        )
+        for edges, expected_edges in zip(bin_edges[:-1],
+                                         expected_bin_edges[:-1]):
+            numpy.testing.assert_almost_equal(edges, expected_edges)
+        self.assertEqual(bin_edges[-1], expected_bin_edges[-1])
+        numpy.testing.assert_almost_equal(diss_matrix, expected_matrix)
+
+        # now disaggregate on the iml of a given poe
+        poe = 0.05
+        curves, results = disagg.hazard_curves_and_disaggregation(
+            [self.src], sites, imts, self.time_span, self.gsims,
+            self.truncation_level, [0, 1], self.imt, self.n_epsilons,
+            self.mag_bin_width, self.dist_bin_width, self.coord_bin_width,
+            poe=poe, sparse=True, **kwargs
+        )
+        for site_idx, site in [(0, site2), (1, self.site)]:
+            iml, bin_edges, diss_matrix = results[site_idx]
+            curve = expected_curves[self.imt][site_idx]
+            self.assertTrue(0.01 < iml < 0.8)
+            # poe of the iml must be consistent with the curve
+            lower = numpy.searchsorted(imts[self.imt], iml) - 1
+            self.assertTrue(curve[lower] >= poe >= curve[lower + 1])
+            expected_bin_edges, expected_matrix = disagg.disaggregation(
+                [self.src], site, self.imt, iml, self.gsims, self.tom,
+                self.truncation_level, self.n_epsilons, self.mag_bin_width,
+                self.dist_bin_width, self.coord_bin_width, **kwargs
+            )
+            self.assertIsInstance(diss_matrix, disagg.SparseDisaggMatrix)
+            numpy.testing.assert_almost_equal(diss_matrix.todense(),
+                                              expected_matrix)
+
+        # levels beyond the truncated distribution make the curve
+        # all zeros, so there is no iml to disaggregate on
+        curves, results = disagg.hazard_curves_and_disaggregation(
+            [self.src], sites, {self.imt: [100, 200]}, self.time_span,
+            self.gsims, self.truncation_level, [0], self.imt,
+            self.n_epsilons, self.mag_bin_width, self.dist_bin_width,
+            self.coord_bin_width, poe=poe, **kwargs
+        )
+        self.assertFalse(curves[self.imt][0].any())
+        self.assertEqual(results, [None])
+
+    def test_hazard_curves_and_disaggregation_wrong_args(self):
+        sites = SiteCollection([self.site])
+        imts = {self.imt: [0.1, 0.2]}
+        args = ([self.src], sites, imts, self.time_span, self.gsims,
+                self.truncation_level, [0], self.imt, self.n_epsilons,
+                self.mag_bin_width, self.dist_bin_width, self.coord_bin_width)
+        with self.assertRaises(ValueError):
+            disagg.hazard_curves_and_disaggregation(*args)
+        with self.assertRaises(ValueError):
+            disagg.hazard_curves_and_disaggregation(*args, iml=0.1, poe=0.1)
+        for truncation_level in [None, 0, -1]:
+            with self.assertRaises(ValueError) as ar:
+                disagg.hazard_curves_and_disaggregation(
+                    *(args[:5] + (truncation_level, ) + args[6:]), iml=0.1
+                )
+            self.assertEqual(str(ar.exception),
+                             'truncation level must be positive')
+        args = args[:7] + (SA(period=1, damping=5), ) + args[8:]
+        with self.assertRaises(ValueError):
+            disagg.hazard_curves_and_disaggregation(*args, iml=0.1)
@@ -322,6 +322,144 @@ class DisaggregateTestCase(_BaseDisaggTestCase):
         self.assertEqual(matrix.sum(), 0)
 
 
+class DisaggregateSparseTestCase(_BaseDisaggTestCase):
+    def test(self):
+        self.gsim.truncation_level = self.truncation_level = 1
+        kwargs = dict(n_epsilons=3, mag_bin_width=3, dist_bin_width=4,
+                      coord_bin_width=2.4)
+        bin_edges, expected_matrix = disagg.disaggregation(
+            self.sources, self.site, self.imt, self.iml, self.gsims,
+            self.tom, self.truncation_level, **kwargs
+        )
+        bin_edges_, matrix = disagg.disaggregation(
+            self.sources, self.site, self.imt, self.iml, self.gsims,
+            self.tom, self.truncation_level, sparse=True, **kwargs
+        )
+        for edges, expected_edges in zip(bin_edges_, bin_edges):
+            numpy.testing.assert_array_equal(edges, expected_edges)
+        self.assertIsInstance(matrix, disagg.SparseDisaggMatrix)
+        self.assertEqual(matrix.nnz, numpy.count_nonzero(expected_matrix))
+        self.assertAlmostEqual(matrix.sum(), 1)
+        numpy.testing.assert_array_almost_equal(matrix.todense(),
+                                                expected_matrix)
+
+
+class DisaggregateFixedBinsTestCase(_BaseDisaggTestCase):
+    def setUp(self):
+        super(DisaggregateFixedBinsTestCase, self).setUp()
+        self.gsim.truncation_level = self.truncation_level = 1
+        self.bin_edges = (
+            numpy.array([3, 6, 9], float),
+            numpy.array([0, 4, 8, 12, 16], float),
+            numpy.array([9.6, 12., 14.4, 16.8, 19.2, 21.6, 24.]),
+            numpy.array([43.2, 45.6, 48.]),
+            numpy.array([-1, -1 / 3., 1 / 3., 1]),
+            ['trt1', 'trt2']
+        )
+
+    def test_same_as_disaggregation(self):
+        bin_edges, expected_matrix = disagg.disaggregation(
+            self.sources, self.site, self.imt, self.iml, self.gsims,
+            self.tom, self.truncation_level, n_epsilons=3,
+            mag_bin_width=3, dist_bin_width=4, coord_bin_width=2.4
+        )
+        matrix = disagg.disaggregation_fixed_bins(
+            self.sources, self.site, self.imt, self.iml, self.gsims,
+            self.tom, self.truncation_level, bin_edges
+        )
+        self.assertEqual(matrix.shape, (2, 4, 6, 2, 3, 2))
+        numpy.testing.assert_array_almost_equal(matrix, expected_matrix)
+
+    def test_ruptures_outside_of_bins(self):
+        mag_bins, dist_bins, lon_bins, lat_bins, eps_bins, trt_bins \
+            = self.bin_edges
+        # ruptures with magnitude above 6.9 and the ones that are closer
+        # than 8 km or further than 12 km are out of bins
+        bin_edges = (numpy.array([3, 6, 6.9]), numpy.array([8, 12]),
+                     lon_bins, lat_bins, eps_bins, trt_bins)
+        matrix = disagg.disaggregation_fixed_bins(
+            self.sources, self.site, self.imt, self.iml, self.gsims,
+            self.tom, self.truncation_level, bin_edges
+        )
+        self.assertEqual(matrix.shape, (2, 1, 6, 2, 3, 2))
+        self.assertAlmostEqual(matrix.sum(), 1)
+        self.assertEqual(matrix[1].sum(), 0)
+        self.assertEqual(matrix[..., 1].sum(), 0)
+        numpy.testing.assert_array_almost_equal(
+            disagg.mag_dist_eps_pmf(matrix)[0, 0],
+            [0.0844 / 0.3356, 0.1528 / 0.3356, 0.0984 / 0.3356]
+        )
+
+    def test_sparse(self):
+        expected_matrix = disagg.disaggregation_fixed_bins(
+            self.sources, self.site, self.imt, self.iml, self.gsims,
+            self.tom, self.truncation_level, self.bin_edges
+        )
+        matrix = disagg.disaggregation_fixed_bins(
+            self.sources, self.site, self.imt, self.iml, self.gsims,
+            self.tom, self.truncation_level, self.bin_edges, sparse=True
+        )
+        self.assertIsInstance(matrix, disagg.SparseDisaggMatrix)
+        self.assertEqual(matrix.shape, expected_matrix.shape)
+        self.assertEqual(matrix.nnz, numpy.count_nonzero(expected_matrix))
+        numpy.testing.assert_array_almost_equal(matrix.todense(),
+                                                expected_matrix)
+
+    def test_wrong_epsilon_bins(self):
+        with self.assertRaises(ValueError) as ar:
+            disagg.disaggregation_fixed_bins(
+                self.sources, self.site, self.imt, self.iml, self.gsims,
+                self.tom, 2, self.bin_edges
+            )
+        self.assertEqual(str(ar.exception),
+                         'epsilon bins do not match truncation level')
+
+    def test_unknown_trt(self):
+        bin_edges = self.bin_edges[:-1] + (['trt1'], )
+        with self.assertRaises(ValueError) as ar:
+            disagg.disaggregation_fixed_bins(
+                self.sources, self.site, self.imt, self.iml, self.gsims,
+                self.tom, self.truncation_level, bin_edges
+            )
+        self.assertEqual(str(ar.exception),
+                         "tectonic region type 'trt2' is not in bins")
+
+
+class GetBinIndexTestCase(unittest.TestCase):
+    def test(self):
+        bins = numpy.array([1.2, 1.4, 1.6])
+        self.assertEqual(disagg._get_bin_index(1.2, bins), 0)
+        self.assertEqual(disagg._get_bin_index(1.2 - 1e-12, bins), 0)
+        self.assertEqual(disagg._get_bin_index(1.3, bins), 0)
+        self.assertEqual(disagg._get_bin_index(1.4, bins), 0)
+        self.assertEqual(disagg._get_bin_index(1.41, bins), 1)
+        self.assertEqual(disagg._get_bin_index(1.6, bins), 1)
+        self.assertIsNone(disagg._get_bin_index(1.1, bins))
+        self.assertIsNone(disagg._get_bin_index(1.61, bins))
+
+
+class InterpolateImlTestCase(unittest.TestCase):
+    def test(self):
+        imls = [0.1, 0.2, 0.4, 0.8]
+        curve = [0.5, 0.1, 0.01, 0]
+        self.assertAlmostEqual(disagg._interpolate_iml(imls, curve, 0.1),
+                               0.2)
+        # log-log interpolation
+        self.assertAlmostEqual(
+            disagg._interpolate_iml(imls, curve, 0.1 ** 0.5 * 0.5 ** 0.5),
+            0.2 ** 0.5 * 0.1 ** 0.5
+        )
+        # zero poes are ignored, values out of range are clipped
+        self.assertAlmostEqual(disagg._interpolate_iml(imls, curve, 0.001),
+                               0.4)
+        self.assertAlmostEqual(disagg._interpolate_iml(imls, curve, 0.9),
+                               0.1)
+
+    def test_zero_curve(self):
+        imls = [0.1, 0.2, 0.4]
+        self.assertIsNone(disagg._interpolate_iml(imls, [0, 0, 0], 0.1))
+
+
 class PMFExtractorsTestCase(unittest.TestCase):
     def setUp(self):
         super(PMFExtractorsTestCase, self).setUp()
@@ -452,3 +590,39 @@ class PMFExtractorsTestCase(unittest.TestCase):
                         [6.35, 5.00, 6.24]],
                        [[4.81, 6.59, 6.34],
                         [5.75, 4.58, 5.23]]])
+
+    def test_sparse(self):
+        sparse_matrix = disagg.SparseDisaggMatrix.from_dense(self.matrix)
+        self.assertEqual(sparse_matrix.nnz,
+                         numpy.count_nonzero(self.matrix))
+        self.assertLess(sparse_matrix.nnz, self.matrix.size)
+        self.aae(sparse_matrix.todense(), self.matrix)
+        for extractor in [disagg.mag_pmf, disagg.dist_pmf, disagg.trt_pmf,
+                          disagg.mag_dist_pmf, disagg.mag_dist_eps_pmf,
+                          disagg.lon_lat_pmf, disagg.mag_lon_lat_pmf,
+                          disagg.lon_lat_trt_pmf]:
+            self.aae(extractor(sparse_matrix), extractor(self.matrix))
+
+
+class SparseDisaggMatrixTestCase(unittest.TestCase):
+    def test_from_cells(self):
+        shape = (2, 1, 1, 2, 3, 2)
+        cells = {(1, 0, 0, 1, 0): numpy.array([0.1, 0, 0.3]),
+                 (0, 0, 0, 0, 1): numpy.array([0, 0, 0.6])}
+        matrix = disagg.SparseDisaggMatrix.from_cells(shape, cells)
+        self.assertEqual(matrix.shape, shape)
+        self.assertEqual(matrix.nnz, 3)
+        self.assertAlmostEqual(matrix.sum(), 1)
+        expected = numpy.zeros(shape)
+        expected[1, 0, 0, 1, 0, 0] = 0.1
+        expected[1, 0, 0, 1, 2, 0] = 0.3
+        expected[0, 0, 0, 0, 2, 1] = 0.6
+        numpy.testing.assert_array_equal(matrix.todense(), expected)
+        matrix /= 2
+        numpy.testing.assert_array_equal(matrix.todense(), expected / 2)
+
+    def test_empty(self):
+        matrix = disagg.SparseDisaggMatrix((2, 1, 1, 2, 3, 2), [], [])
+        self.assertEqual(matrix.nnz, 0)
+        numpy.testing.assert_array_equal(disagg.mag_pmf(matrix), [0, 0])
+        self.assertEqual(matrix.todense().sum(), 0)
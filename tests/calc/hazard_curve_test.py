@@ -56,6 +56,10 @@ class HazardCurvesTestCase(unittest.TestCase):
             assert dctx is self.dists
             return numpy.array([self.poes[(epicenter.latitude, rctx, imt)]
                                 for epicenter in sctx.mesh])
+        def get_poes_for_imts(self, sctx, rctx, dctx, imts, truncation_level):
+            return dict((imt, self.get_poes(sctx, rctx, dctx, imt, imts[imt],
+                                            truncation_level))
+                        for imt in imts)
 
     def test1(self):
         truncation_level = 3.4
@@ -211,3 +215,106 @@ class HazardCurvesFiltersTestCase(unittest.TestCase):
                          [('point2', [1, 3, 4])])
         self.assertEqual(rupture_site_filter.counts,
                          [(6, [4]), (8, [1, 3, 4])])
+
+
+class HazardCurvesSourceContributionsTestCase(unittest.TestCase):
+    def _make_source(self, source_id, location, occurrence_rates):
+        return nhlib.source.PointSource(
+            source_id=source_id, name=source_id,
+            tectonic_region_type=const.TRT.ACTIVE_SHALLOW_CRUST,
+            mfd=nhlib.mfd.EvenlyDiscretizedMFD(
+                min_mag=4, bin_width=2, occurrence_rates=occurrence_rates
+            ),
+            nodal_plane_distribution=nhlib.pmf.PMF([
+                (1, nhlib.geo.NodalPlane(strike=0.0, dip=90.0, rake=0.0))
+            ]),
+            hypocenter_distribution=nhlib.pmf.PMF([(1, 10)]),
+            upper_seismogenic_depth=0.0,
+            lower_seismogenic_depth=10.0,
+            magnitude_scaling_relationship=nhlib.scalerel.PeerMSR(),
+            rupture_aspect_ratio=2,
+            rupture_mesh_spacing=1.0,
+            location=location
+        )
+
+    def setUp(self):
+        self.sources = [
+            self._make_source('point1', Point(10, 10), [0.5, 0.1]),
+            self._make_source('point2', Point(10, 11), [0.5, 0.2]),
+            self._make_source('point3', Point(10, 11.2), [0.1]),
+        ]
+        self.sites = SiteCollection([Site(Point(10.4, 10.3), 1, True, 2, 3),
+                                     Site(Point(10, 16), 2, True, 2, 3),
+                                     Site(Point(10, 10.6), 3, True, 2, 3),
+                                     Site(Point(10, 11.5), 4, True, 2, 3)])
+        from nhlib.gsim.sadigh_1997 import SadighEtAl1997
+        self.gsims = {const.TRT.ACTIVE_SHALLOW_CRUST: SadighEtAl1997()}
+        self.imts = {imt.PGA(): [0.01, 0.1, 0.5], imt.SA(0.2, 5): [0.1, 1]}
+        from nhlib.calc import filters
+        self.filters = dict(
+            source_site_filter=filters.source_site_distance_filter(60),
+            rupture_site_filter=filters.rupture_site_distance_filter(60)
+        )
+
+    def _calc(self, sources, **kwargs):
+        kwargs.update(self.filters)
+        return hazard_curves_poissonian(
+            iter(sources), self.sites, self.imts, time_span=50,
+            gsims=self.gsims, truncation_level=2, **kwargs
+        )
+
+    def test_sources(self):
+        expected_curves = self._calc(self.sources)
+        curves, contributions = self._calc(self.sources,
+                                           source_contributions=True)
+        for imt_ in self.imts:
+            numpy.testing.assert_almost_equal(curves[imt_],
+                                              expected_curves[imt_])
+        self.assertEqual(set(contributions), set(['point1', 'point2',
+                                                  'point3']))
+        for source in self.sources:
+            indices, source_curves = contributions[source.source_id]
+            expected_curves = self._calc([source])
+            # only sites that are not filtered out are present
+            for imt_ in self.imts:
+                self.assertEqual(source_curves[imt_].shape,
+                                 (len(indices), len(self.imts[imt_])))
+                numpy.testing.assert_almost_equal(
+                    source_curves[imt_], expected_curves[imt_][indices]
+                )
+                others = numpy.ones(len(self.sites), bool)
+                others[indices] = False
+                self.assertEqual(expected_curves[imt_][others].sum(), 0)
+        numpy.testing.assert_array_equal(contributions['point1'][0], [0, 2])
+        numpy.testing.assert_array_equal(contributions['point2'][0], [2, 3])
+        numpy.testing.assert_array_equal(contributions['point3'][0], [3])
+
+    def test_groups(self):
+        group = lambda source: source.source_id in ('point1', 'point3')
+        curves, contributions = self._calc(self.sources,
+                                           source_contributions=group)
+        self.assertEqual(set(contributions), set([True, False]))
+        indices, group_curves = contributions[True]
+        numpy.testing.assert_array_equal(indices, [0, 2, 3])
+        expected_curves = self._calc(self.sources[::2])
+        for imt_ in self.imts:
+            numpy.testing.assert_almost_equal(
+                group_curves[imt_], expected_curves[imt_][indices]
+            )
+        # total probability of exceedance is combined from all the groups
+        for imt_ in self.imts:
+            non_exceedance = numpy.ones_like(curves[imt_])
+            for indices, group_curves in contributions.values():
+                non_exceedance[indices] *= 1 - group_curves[imt_]
+            numpy.testing.assert_almost_equal(curves[imt_],
+                                              1 - non_exceedance)
+
+    def test_wrong_source_contributions(self):
+        for value in ['foo', {'point1': 1}, 1]:
+            with self.assertRaises(ValueError) as ar:
+                self._calc(self.sources, source_contributions=value)
+            self.assertEqual(str(ar.exception),
+                             'source_contributions must be True, False '
+                             'or a function')
+        self.assertIsInstance(self._calc(self.sources,
+                                         source_contributions=None), dict)
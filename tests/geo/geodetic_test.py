@@ -17,6 +17,7 @@ import unittest
 
 import numpy
 
+from nhlib import speedups
 from nhlib.geo import geodetic
 
 from tests import SpeedupsTestCase
@@ -189,6 +190,90 @@ class MinDistanceTest(SpeedupsTestCase):
                    expected_mpoint_indices=[0, 1])
 
 
+    def test_threads(self):
+        mlons, mlats = numpy.meshgrid(numpy.linspace(10, 11, 20),
+                                      numpy.linspace(-40, -41, 10))
+        mdepths = numpy.linspace(0, 10, 200).reshape(mlons.shape)
+        slons, slats = numpy.meshgrid(numpy.linspace(9, 12, 60),
+                                      numpy.linspace(-39, -42, 50))
+        sdepths = numpy.zeros_like(slons)
+        expected_dists = geodetic.min_distance(mlons, mlats, mdepths,
+                                               slons, slats, sdepths)
+        expected_indices = geodetic.min_distance(mlons, mlats, mdepths,
+                                                 slons, slats, sdepths,
+                                                 indices=True)
+        expected_geod = geodetic.min_geodetic_distance(
+            mlons, mlats, slons.ravel(), slats.ravel()
+        )
+        orig_threads = speedups.THREADS
+        speedups.THREADS = 4
+        try:
+            dists = geodetic.min_distance(mlons, mlats, mdepths,
+                                          slons, slats, sdepths)
+            indices = geodetic.min_distance(mlons, mlats, mdepths,
+                                            slons, slats, sdepths,
+                                            indices=True)
+            geod = geodetic.min_geodetic_distance(mlons, mlats,
+                                                  slons.ravel(), slats.ravel())
+        finally:
+            speedups.THREADS = orig_threads
+        self.assertEqual(dists.shape, slons.shape)
+        numpy.testing.assert_equal(dists, expected_dists)
+        numpy.testing.assert_equal(indices, expected_indices)
+        numpy.testing.assert_equal(geod, expected_geod)
+
+
+    def test_precomputed_site_coords(self):
+        mlons, mlats = numpy.array([10., 11.]), numpy.array([-40., -41.])
+        mdepths = numpy.array([10., 20.])
+        slons, slats = numpy.array([9., 9.]), numpy.array([-39., -45.])
+        sdepths = numpy.array([0.1, 0.2])
+        srad = (numpy.radians(slons), numpy.radians(slats),
+                numpy.cos(numpy.radians(slats)))
+        for indices in (False, True):
+            numpy.testing.assert_equal(
+                geodetic.min_distance(mlons, mlats, mdepths,
+                                      slons, slats, sdepths, indices, srad),
+                geodetic.min_distance(mlons, mlats, mdepths,
+                                      slons, slats, sdepths, indices)
+            )
+        numpy.testing.assert_equal(
+            geodetic.min_geodetic_distance(mlons, mlats, slons, slats, srad),
+            geodetic.min_geodetic_distance(mlons, mlats, slons, slats)
+        )
+
+    def test_memory_budget(self):
+        mlons, mlats = numpy.meshgrid(numpy.linspace(10, 11, 7),
+                                      numpy.linspace(-40, -41, 5))
+        mdepths = numpy.linspace(0, 10, 35).reshape(mlons.shape)
+        slons = numpy.linspace(9, 12, 40)
+        slats = numpy.linspace(-39, -42, 40)
+        sdepths = numpy.linspace(0, 5, 40)
+        expected_dists = geodetic.min_distance(mlons, mlats, mdepths,
+                                               slons, slats, sdepths)
+        expected_indices = geodetic.min_distance(mlons, mlats, mdepths,
+                                                 slons, slats, sdepths,
+                                                 indices=True)
+        expected_geod = geodetic.min_geodetic_distance(mlons, mlats,
+                                                       slons, slats)
+        orig_budget = geodetic.MIN_DISTANCE_MEMORY_BUDGET
+        # three sites per block
+        geodetic.MIN_DISTANCE_MEMORY_BUDGET = 3 * 3 * 8 * 35
+        try:
+            self.assertEqual(len(list(geodetic._site_blocks(35, 40))), 14)
+            dists = geodetic.min_distance(mlons, mlats, mdepths,
+                                          slons, slats, sdepths)
+            indices = geodetic.min_distance(mlons, mlats, mdepths,
+                                            slons, slats, sdepths,
+                                            indices=True)
+            geod = geodetic.min_geodetic_distance(mlons, mlats, slons, slats)
+        finally:
+            geodetic.MIN_DISTANCE_MEMORY_BUDGET = orig_budget
+        numpy.testing.assert_equal(dists, expected_dists)
+        numpy.testing.assert_equal(indices, expected_indices)
+        numpy.testing.assert_equal(geod, expected_geod)
+
+
 class DistanceToArcTest(unittest.TestCase):
     # values in this test have not been checked by hand
     def test_one_point(self):
@@ -337,3 +422,40 @@ class IntervalsBetweenTest(unittest.TestCase):
         self.assertTrue(numpy.allclose(lons, expected_lons))
         self.assertTrue(numpy.allclose(lats, expected_lats))
         self.assertTrue(numpy.allclose(depths, expected_depths))
+
+
+class EquirectangularFilterTest(unittest.TestCase):
+    def test(self):
+        numpy.random.seed(5)
+        slons = numpy.random.uniform(-180, 180, 10000)
+        slats = numpy.random.uniform(-90, 90, 10000)
+        for lon, lat, radius in [(0, 0, 500), (179, -50, 1000),
+                                 (30, 88, 2000), (-100, 20, 2000)]:
+            closer, unsure = geodetic.equirectangular_filter(
+                lon, lat, slons, slats, radius
+            )
+            dists = geodetic.geodetic_distance(lon, lat, slons, slats)
+            self.assertTrue((dists[closer] <= radius).all())
+            self.assertTrue((dists[~(closer | unsure)] > radius).all())
+            self.assertFalse((closer & unsure).any())
+            if abs(lat) < 60:
+                # uncertainty band is narrow
+                self.assertLess(unsure.sum(), 0.02 * closer.sum())
+
+    def test_precomputed_site_coords(self):
+        slons = numpy.array([[0.1, 0.2], [10., -0.1]])
+        slats = numpy.array([[0.3, -0.2], [0.1, 2.]])
+        srad = (numpy.radians(slons), numpy.radians(slats),
+                numpy.cos(numpy.radians(slats)))
+        closer, unsure = geodetic.equirectangular_filter(0, 0, slons, slats,
+                                                         100, srad)
+        self.assertEqual(closer.shape, (2, 2))
+        numpy.testing.assert_equal(closer, [[1, 1], [0, 0]])
+        numpy.testing.assert_equal(unsure, [[0, 0], [0, 0]])
+
+    def test_whole_globe(self):
+        closer, unsure = geodetic.equirectangular_filter(
+            0, 0, numpy.array([180., 0.]), numpy.array([0., 90.]), 20100
+        )
+        numpy.testing.assert_equal(closer, [1, 1])
+        numpy.testing.assert_equal(unsure, [0, 0])
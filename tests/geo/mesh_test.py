@@ -15,12 +15,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
 import math
+import tempfile
 
 import numpy
+import scipy.spatial.distance
+import shapely.geometry
 
 from nhlib.geo.point import Point
 from nhlib.geo.polygon import Polygon
 from nhlib.geo.mesh import Mesh, RectangularMesh
+from nhlib.geo import geodetic
 from nhlib.geo import utils as geo_utils
 
 from tests import assert_angles_equal
@@ -173,6 +177,27 @@ class MeshSlicingTestCase(_BaseMeshTestCase):
         self.assertIsInstance(submesh, RectangularMesh)
 
 
+class MeshCachedCoordsTestCase(unittest.TestCase):
+    def test_rad_coords(self):
+        mesh = Mesh(numpy.array([[10., 20.]]), numpy.array([[30., -40.]]),
+                    None)
+        lons, lats, cos_lats = mesh.get_rad_coords()
+        numpy.testing.assert_equal(lons, numpy.radians([[10., 20.]]))
+        numpy.testing.assert_equal(lats, numpy.radians([[30., -40.]]))
+        numpy.testing.assert_equal(cos_lats, numpy.cos(lats))
+        self.assertIs(mesh.get_rad_coords()[0], lons)
+
+    def test_cartesian(self):
+        mesh = Mesh(numpy.array([10., 20.]), numpy.array([30., -40.]),
+                    numpy.array([1., 2.]))
+        vectors = mesh.get_cartesian()
+        numpy.testing.assert_equal(
+            vectors, geo_utils.spherical_to_cartesian(mesh.lons, mesh.lats,
+                                                      mesh.depths)
+        )
+        self.assertIs(mesh.get_cartesian(), vectors)
+
+
 class MeshGetMinDistanceTestCase(unittest.TestCase):
     # test case depends on Point.distance() working right
     def _test(self, mesh, target_mesh, expected_distance_indices):
@@ -232,6 +257,50 @@ class MeshGetMinDistanceTestCase(unittest.TestCase):
                    expected_distance_indices=[3, 3, 3, 0, 0, 3, 3, 3, 3])
 
 
+class MeshGetMinDistanceKDTreeTestCase(MeshGetMinDistanceTestCase):
+    # same tests, but using spatial tree
+    def setUp(self):
+        super(MeshGetMinDistanceKDTreeTestCase, self).setUp()
+        self.orig_settings = Mesh.KDTREE_THRESHOLD, Mesh.KDTREE_NEIGHBOURS
+        Mesh.KDTREE_THRESHOLD = 0
+        # make sure that brute force fallback is exercised as well
+        Mesh.KDTREE_NEIGHBOURS = 1
+
+    def tearDown(self):
+        Mesh.KDTREE_THRESHOLD, Mesh.KDTREE_NEIGHBOURS = self.orig_settings
+        super(MeshGetMinDistanceKDTreeTestCase, self).tearDown()
+
+    def test_compare_with_brute_force(self):
+        Mesh.KDTREE_NEIGHBOURS = 4
+        numpy.random.seed(42)
+        lons, lats = numpy.meshgrid(numpy.linspace(10, 10.5, 30),
+                                    numpy.linspace(45, 45.3, 20))
+        depths = numpy.random.uniform(-1, 20, lons.shape)
+        mesh = Mesh(lons, lats, depths)
+        target_mesh = Mesh(numpy.random.uniform(8, 13, 500),
+                           numpy.random.uniform(43, 47, 500),
+                           numpy.random.uniform(0, 2, 500))
+        dists = mesh.get_min_distance(target_mesh)
+        closest = mesh.get_closest_points(target_mesh)
+        Mesh.KDTREE_THRESHOLD = float('inf')
+        numpy.testing.assert_almost_equal(
+            dists, mesh.get_min_distance(target_mesh), decimal=9
+        )
+        expected_closest = mesh.get_closest_points(target_mesh)
+        numpy.testing.assert_equal(closest.lons, expected_closest.lons)
+        numpy.testing.assert_equal(closest.lats, expected_closest.lats)
+        numpy.testing.assert_equal(closest.depths, expected_closest.depths)
+
+    def test_tree_cached(self):
+        mesh = Mesh.from_points_list([Point(0, 0), Point(0, 1)])
+        target_mesh = Mesh.from_points_list([Point(1, 1)])
+        mesh.get_min_distance(target_mesh)
+        tree = mesh._kdtree
+        self.assertIsNotNone(tree)
+        mesh.get_closest_points(target_mesh)
+        self.assertIs(mesh._kdtree, tree)
+
+
 class MeshGetDistanceMatrixTestCase(unittest.TestCase):
     def test_zeroes(self):
         mesh = Mesh(numpy.zeros(1000), numpy.zeros(1000), None)
@@ -252,6 +321,50 @@ class MeshGetDistanceMatrixTestCase(unittest.TestCase):
             for j in xrange(i, 4):
                 self.assertEqual(matrix[i, j], matrix[j, i])
 
+    def _get_mesh(self):
+        numpy.random.seed(13)
+        return Mesh(numpy.random.uniform(-10, 10, 50),
+                    numpy.random.uniform(-10, 10, 50), None)
+
+    def test_blocks(self):
+        mesh = self._get_mesh()
+        expected = geodetic.geodetic_distance(
+            mesh.lons.reshape((-1, 1)), mesh.lats.reshape((-1, 1)),
+            mesh.lons, mesh.lats
+        )
+        # seven rows per block
+        mesh.DISTANCE_MATRIX_BLOCK_MEMORY = 7 * 5 * 8 * 50
+        matrix = mesh.get_distance_matrix()
+        numpy.testing.assert_equal(matrix, expected)
+
+    def test_float32(self):
+        mesh = self._get_mesh()
+        expected = mesh.get_distance_matrix()
+        matrix = mesh.get_distance_matrix(dtype=numpy.float32)
+        self.assertEqual(matrix.dtype, numpy.float32)
+        numpy.testing.assert_allclose(matrix, expected, rtol=1e-6)
+
+    def test_condensed(self):
+        mesh = self._get_mesh()
+        mesh.DISTANCE_MATRIX_BLOCK_MEMORY = 1
+        expected = mesh.get_distance_matrix()
+        condensed = mesh.get_distance_matrix(condensed=True)
+        self.assertEqual(condensed.shape, (50 * 49 / 2, ))
+        numpy.testing.assert_equal(
+            scipy.spatial.distance.squareform(condensed), expected
+        )
+
+    def test_out(self):
+        mesh = self._get_mesh()
+        expected = mesh.get_distance_matrix()
+        with tempfile.NamedTemporaryFile() as fileobj:
+            out = numpy.memmap(fileobj.name, dtype=float, mode='w+',
+                               shape=(50, 50))
+            matrix = mesh.get_distance_matrix(out=out)
+            self.assertIsInstance(matrix, numpy.matrix)
+            numpy.testing.assert_equal(out, expected)
+            del matrix, out
+
 
 class MeshConvexHullTestCase(unittest.TestCase):
     def test_two_points(self):
@@ -378,6 +491,30 @@ class MeshJoynerBooreDistanceTestCase(unittest.TestCase):
         expected_dists = [0, Point(0.5, 0).distance(Point(1, 0))]
         self.assertTrue(numpy.allclose(dists, expected_dists, atol=0.2))
 
+    def test_geometry_cached(self):
+        lons = numpy.array([numpy.arange(-1, 1.2, 0.2)] * 11)
+        lats = lons.transpose() + 1
+        mesh = RectangularMesh(lons, lats, None)
+        calls = []
+        get_proj_enclosing_polygon = mesh._get_proj_enclosing_polygon
+
+        def counting_get_proj_enclosing_polygon():
+            calls.append(1)
+            return get_proj_enclosing_polygon()
+
+        mesh._get_proj_enclosing_polygon = counting_get_proj_enclosing_polygon
+        target_mesh = Mesh.from_points_list([Point(0, 0.5), Point(0.6, -1),
+                                             Point(-0.8, 2.1)])
+        dists = mesh.get_joyner_boore_distance(target_mesh)
+        geometry = mesh._get_jb_geometry()
+        numpy.testing.assert_array_equal(
+            mesh.get_joyner_boore_distance(target_mesh), dists
+        )
+        self.assertIs(mesh._get_jb_geometry(), geometry)
+        self.assertEqual(len(calls), 1)
+        proj, polygon, prepared = geometry
+        self.assertTrue(prepared.contains(shapely.geometry.Point(0, 0)))
+
     def _test(self, points, site, expected_distance):
         lons, lats, depths = numpy.array(points).transpose()
         lons = lons.transpose()
@@ -18,6 +18,7 @@ import unittest
 import numpy
 
 from nhlib import geo
+from nhlib.geo import geodetic
 from nhlib.geo.utils import EARTH_RADIUS, spherical_to_cartesian
 
 
@@ -240,6 +241,21 @@ class PointCloserThanTestCase(unittest.TestCase):
         closer = p.closer_than(mesh, 60)
         numpy.testing.assert_array_equal(closer, [1, 1, 1, 1, 1, 1])
 
+    def test_compare_with_exact(self):
+        numpy.random.seed(3)
+        mesh = geo.Mesh(numpy.random.uniform(-180, 180, 20000),
+                        numpy.random.uniform(-90, 90, 20000), None)
+        for point, radius in [(geo.Point(20, 30, 10), 1000),
+                              (geo.Point(179.9, 60), 2000),
+                              (geo.Point(-10, 89.5, 5), 3000),
+                              (geo.Point(0, 0), 15000),
+                              (geo.Point(0, 0), 30000),
+                              (geo.Point(0, 0, 50), 20)]:
+            closer = point.closer_than(mesh, radius)
+            dists = geodetic.distance(point.longitude, point.latitude,
+                                      point.depth, mesh.lons, mesh.lats, 0)
+            numpy.testing.assert_array_equal(closer, dists <= radius)
+
 
 class PointWktTestCase(unittest.TestCase):
     def test_point_wkt2d(self):
@@ -17,8 +17,10 @@ import unittest
 
 import numpy
 import shapely.geometry
+import shapely.prepared
 
 from nhlib import geo
+from nhlib import speedups
 from nhlib.geo import utils
 
 from tests import SpeedupsTestCase
@@ -323,6 +325,19 @@ class ConvexToPointDistanceTestCase(SpeedupsTestCase):
         numpy.testing.assert_almost_equal(dist, [[1.4142135, 0.1],
                                                  [2.9107559, 0.3]])
 
+    def test_threads(self):
+        pxx, pyy = numpy.meshgrid(numpy.linspace(-1, 2, 60),
+                                  numpy.linspace(-1, 2, 50))
+        expected = utils.point_to_polygon_distance(self.polygon, pxx, pyy)
+        orig_threads = speedups.THREADS
+        speedups.THREADS = 3
+        try:
+            dist = utils.point_to_polygon_distance(self.polygon, pxx, pyy)
+        finally:
+            speedups.THREADS = orig_threads
+        self.assertEqual(dist.shape, pxx.shape)
+        numpy.testing.assert_equal(dist, expected)
+
     def test_nonconvex_polygon(self):
         coords = [(0, 0), (0, 3), (2, 2), (1, 2), (1, 1), (1, 0), (0, 0)]
         for polygon_coords in (coords, list(reversed(coords))):
@@ -336,3 +351,12 @@ class ConvexToPointDistanceTestCase(SpeedupsTestCase):
             pyy = numpy.array([1.5, 2.0, 2.0])
             dist = utils.point_to_polygon_distance(polygon, pxx, pyy)
             numpy.testing.assert_almost_equal(dist, [0.5, 1, 2])
+
+    def test_prepared(self):
+        prepared = shapely.prepared.prep(self.polygon)
+        pxx = [-1., 0.3, -0.25, 0.5]
+        pyy = [2., 1.1, 3.9, 0.5]
+        dist = utils.point_to_polygon_distance(self.polygon, pxx, pyy,
+                                               prepared)
+        numpy.testing.assert_almost_equal(dist, [1.4142135, 0.1, 2.9107559,
+                                                 0])
@@ -15,15 +15,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
 import collections
+import copy
+import pickle
 
 import numpy
 
 from nhlib import const
 from nhlib.gsim.base import GMPE, IPE, SitesContext, RuptureContext, \
-                            DistancesContext
+                            DistancesContext, CoeffsTable
+from nhlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
 from nhlib.geo.mesh import Mesh
 from nhlib.geo.point import Point
-from nhlib.imt import PGA, PGV
+from nhlib.imt import PGA, PGV, SA
 from nhlib.site import Site, SiteCollection
 from nhlib.source.rupture import Rupture
 
@@ -189,6 +192,104 @@ class GetPoEsTestCase(_FakeGSIMTestCase):
         self.assertAlmostEqual(poe23, 0.5521092)
 
 
+class ForIMTsTestCase(_FakeGSIMTestCase):
+    def setUp(self):
+        super(ForIMTsTestCase, self).setUp()
+        self.calls = []
+
+        def get_mean_and_stddevs(sctx, rctx, dctx, imt, stddev_types):
+            self.calls.append(imt)
+            mean = {PGA(): numpy.array([1., 2.]),
+                    PGV(): numpy.array([3., 4.])}[imt]
+            return mean, [mean / 2] * len(stddev_types)
+
+        self.gsim.get_mean_and_stddevs = get_mean_and_stddevs
+        self.gsim.DEFINED_FOR_INTENSITY_MEASURE_TYPES.add(PGV)
+        self.gsim.DEFINED_FOR_STANDARD_DEVIATION_TYPES.add(
+            const.StdDev.TOTAL
+        )
+
+    def test_mean_and_stddevs_fallback(self):
+        means, stddevs = self.gsim.get_mean_and_stddevs_for_imts(
+            SitesContext(), RuptureContext(), DistancesContext(),
+            [PGV(), PGA()], [const.StdDev.TOTAL, const.StdDev.TOTAL]
+        )
+        numpy.testing.assert_array_equal(means, [[3, 4], [1, 2]])
+        self.assertEqual(len(stddevs), 2)
+        numpy.testing.assert_array_equal(stddevs[1], [[1.5, 2], [0.5, 1]])
+        self.assertEqual(self.calls, [PGV(), PGA()])
+
+    def test_poes(self):
+        imts = {PGA(): [1, 2, 3], PGV(): [2.5, 5]}
+        for truncation_level in [None, 0, 1.5]:
+            poes = self.gsim.get_poes_for_imts(
+                SitesContext(), RuptureContext(), DistancesContext(), imts,
+                truncation_level
+            )
+            self.assertEqual(set(poes), set(imts))
+            for imt in imts:
+                expected_poes = self._get_poes(
+                    imt=imt, imls=imts[imt], truncation_level=truncation_level
+                )
+                numpy.testing.assert_array_equal(poes[imt], expected_poes)
+
+    def test_poes_wrong_input(self):
+        self.gsim.DEFINED_FOR_INTENSITY_MEASURE_TYPES.remove(PGV)
+        self.assertRaises(ValueError, self.gsim.get_poes_for_imts,
+                          SitesContext(), RuptureContext(),
+                          DistancesContext(), {PGV(): [1]}, 1)
+        self.assertRaises(ValueError, self.gsim.get_poes_for_imts,
+                          SitesContext(), RuptureContext(),
+                          DistancesContext(), {PGA(): [1]}, -1)
+
+
+class ApproximatePoEsTestCase(_FakeGSIMTestCase):
+    def setUp(self):
+        super(ApproximatePoEsTestCase, self).setUp()
+
+        def get_mean_and_stddevs(sctx, rctx, dctx, imt, stddev_types):
+            mean = numpy.linspace(-2, 2, 50)
+            return mean, [numpy.linspace(0.1, 1.5, 50)] * len(stddev_types)
+
+        self.gsim.get_mean_and_stddevs = get_mean_and_stddevs
+        self.gsim.DEFINED_FOR_STANDARD_DEVIATION_TYPES.add(
+            const.StdDev.TOTAL
+        )
+        self.imls = numpy.linspace(-5, 5, 100)
+
+    def test_approximate(self):
+        for truncation_level in [None, 0, 0.5, 1, 3, 10]:
+            poes = self._get_poes(imls=self.imls,
+                                  truncation_level=truncation_level)
+            approx_poes = self._get_poes(imls=self.imls,
+                                         truncation_level=truncation_level,
+                                         approximate=True)
+            self.assertEqual(approx_poes.shape, poes.shape)
+            numpy.testing.assert_allclose(approx_poes, poes, rtol=0,
+                                          atol=1e-7)
+
+    def test_outside_of_truncation_range(self):
+        poes = self._get_poes(imls=self.imls, truncation_level=1,
+                              approximate=True)
+        mean, [stddev] = self.gsim.get_mean_and_stddevs(None, None, None,
+                                                        None, [None])
+        imls = self.gsim.to_distribution_values(self.imls)
+        values = (imls - mean.reshape(-1, 1)) / stddev.reshape(-1, 1)
+        self.assertTrue((poes[values <= -1] == 1).all())
+        self.assertTrue((poes[values >= 1] == 0).all())
+
+    def test_for_imts(self):
+        imts = {PGA(): self.imls}
+        poes = self.gsim.get_poes_for_imts(
+            SitesContext(), RuptureContext(), DistancesContext(), imts, 2,
+            approximate=True
+        )
+        numpy.testing.assert_allclose(
+            poes[PGA()], self._get_poes(imls=self.imls, truncation_level=2),
+            rtol=0, atol=1e-7
+        )
+
+
 class DisaggregatePoETestCase(_FakeGSIMTestCase):
     def test_zero_poe(self):
         self.gsim_class.DEFINED_FOR_STANDARD_DEVIATION_TYPES.add(
@@ -294,6 +395,34 @@ class DisaggregatePoETestCase(_FakeGSIMTestCase):
                  [0.03467403, 0.23896796, 0.45271601, 0.23896796, 0.03467403]]
         aaae(poes, epoes)
 
+    def test_several_imls(self):
+        self.gsim_class.DEFINED_FOR_STANDARD_DEVIATION_TYPES.add(
+            const.StdDev.TOTAL
+        )
+
+        def get_mean_and_stddevs(sites, rup, dists, imt, stddev_types):
+            mean = numpy.array([9.4, 8])
+            stddev = numpy.array([0.75, 1])
+            return mean, [stddev]
+
+        self.gsim.get_mean_and_stddevs = get_mean_and_stddevs
+        aaae = numpy.testing.assert_array_almost_equal
+
+        poes = self._disaggregate_poe(imt=self.DEFAULT_IMT(),
+                                      iml=[9.7, 8.5, 5.3],
+                                      n_epsilons=5, truncation_level=2)
+        self.assertIsInstance(poes, numpy.ndarray)
+        self.assertEqual(poes.shape, (2, 3, 5))
+        epoes = [[[0, 0, 0, 0.24044908, 0.09672034],
+                  [0, 0.24044908, 0.32566115, 0.24044908, 0.09672034],
+                  [0.09672034, 0.24044908, 0.32566115, 0.24044908,
+                   0.09672034]],
+                 [[0, 0, 0, 0, 0],
+                  [0, 0, 0, 0.20269033, 0.09672034],
+                  [0.09672034, 0.24044908, 0.32566115, 0.24044908,
+                   0.09672034]]]
+        aaae(poes, epoes)
+
 
 class ToIMTUnitsToDistributionTestCase(unittest.TestCase):
     def test_gmpe(self):
@@ -465,6 +594,237 @@ class MakeContextsTestCase(_FakeGSIMTestCase):
         self.assertFalse(hasattr(sctx, 'z2pt0'))
         self.assertFalse(hasattr(dctx, 'rrup'))
         self.assertFalse(hasattr(dctx, 'ztor'))
+        self.assertIs(sctx.site_collection, sites)
         self.assertEqual(self.fake_surface.call_counts,
                          {'get_rx_distance': 1,
                           'get_joyner_boore_distance': 1})
+
+
+class SiteTermsTestCase(_FakeGSIMTestCase):
+    def setUp(self):
+        super(SiteTermsTestCase, self).setUp()
+        self.calls = []
+
+        def compute_site_terms(sites, imt):
+            self.calls.append(imt)
+            return {'vs30': sites.vs30 * 2}
+
+        self.gsim._compute_site_terms = compute_site_terms
+        self.gsim.REQUIRES_SITES_PARAMETERS = set(['vs30'])
+        self.sites = SiteCollection([
+            Site(Point(1, 2), vs30=456, vs30measured=False,
+                 z1pt0=12.1, z2pt5=15.1),
+            Site(Point(2, 3), vs30=1456, vs30measured=False,
+                 z1pt0=12.1, z2pt5=15.1)
+        ])
+
+    def test_cached(self):
+        sctx = self.gsim._make_sites_context(self.sites)
+        terms = self.gsim._get_site_terms(sctx, PGA())
+        numpy.testing.assert_array_equal(terms['vs30'], [912, 2912])
+        sctx = self.gsim._make_sites_context(self.sites)
+        self.assertIs(self.gsim._get_site_terms(sctx, PGA()), terms)
+        self.assertEqual(self.calls, [PGA()])
+        self.gsim._get_site_terms(sctx, PGV())
+        self.assertEqual(self.calls, [PGA(), PGV()])
+
+    def test_filtered_collection(self):
+        sites = self.sites.filter(numpy.array([False, True]))
+        sctx = self.gsim._make_sites_context(sites)
+        terms = self.gsim._get_site_terms(sctx, PGA())
+        numpy.testing.assert_array_equal(terms['vs30'], [2912])
+        sctx = self.gsim._make_sites_context(self.sites)
+        terms = self.gsim._get_site_terms(sctx, PGA())
+        numpy.testing.assert_array_equal(terms['vs30'], [912, 2912])
+        self.assertEqual(self.calls, [PGA()])
+
+    def test_not_cached(self):
+        sctx = SitesContext()
+        sctx.vs30 = numpy.array([1, 2])
+        terms = self.gsim._get_site_terms(sctx, PGA())
+        numpy.testing.assert_array_equal(terms['vs30'], [2, 4])
+        self.gsim._get_site_terms(sctx, PGA())
+        self.assertEqual(self.calls, [PGA(), PGA()])
+
+    def test_no_terms(self):
+        gsim = self.gsim_class()
+        gsim.REQUIRES_SITES_PARAMETERS = set(['vs30'])
+        sctx = SitesContext()
+        sctx.vs30 = numpy.array([1, 2])
+        self.assertIsNone(gsim._get_site_terms(sctx, PGA()))
+        sites = self.sites.filter(numpy.array([False, True]))
+        sctx = gsim._make_sites_context(sites)
+        self.assertIsNone(gsim._get_site_terms(sctx, PGA()))
+
+
+class RuptureTermsTestCase(_FakeGSIMTestCase):
+    def setUp(self):
+        super(RuptureTermsTestCase, self).setUp()
+        self.calls = []
+
+        def compute_rupture_terms(rup, imt):
+            self.calls.append((rup.mag, imt))
+            return {'mag': rup.mag * 2, 'imt': len(self.calls)}
+
+        self.gsim._compute_rupture_terms = compute_rupture_terms
+
+    def _make_rupture(self, mag, rake=90):
+        rctx = RuptureContext()
+        rctx.mag = mag
+        rctx.rake = rake
+        return rctx
+
+    def test_memoized(self):
+        terms = self.gsim._get_rupture_terms(self._make_rupture(5), PGA())
+        self.assertEqual(terms, {'mag': 10, 'imt': 1})
+        # another context object with the same parameters
+        self.assertIs(
+            self.gsim._get_rupture_terms(self._make_rupture(5), PGA()), terms
+        )
+        self.gsim._get_rupture_terms(self._make_rupture(5), PGV())
+        self.gsim._get_rupture_terms(self._make_rupture(6), PGA())
+        self.gsim._get_rupture_terms(self._make_rupture(5, rake=0), PGA())
+        self.assertEqual(self.calls, [(5, PGA()), (5, PGV()), (6, PGA()),
+                                      (5, PGA())])
+
+    def test_cache_size(self):
+        self.gsim.RUPTURE_TERMS_CACHE_SIZE = 2
+        for mag in [5, 6, 7, 6, 5]:
+            self.gsim._get_rupture_terms(self._make_rupture(mag), PGA())
+        self.assertEqual([mag for mag, imt in self.calls], [5, 6, 7, 5])
+        self.assertEqual(len(self.gsim._rupture_terms), 2)
+
+    def test_for_imts(self):
+        terms = self.gsim._get_rupture_terms_for_imts(self._make_rupture(5),
+                                                      [PGA(), PGV(), PGA()])
+        self.assertEqual(sorted(terms), ['imt', 'mag'])
+        numpy.testing.assert_array_equal(terms['mag'], [[10], [10], [10]])
+        numpy.testing.assert_array_equal(terms['imt'], [[1], [2], [1]])
+
+    def test_no_terms(self):
+        gsim = self.gsim_class()
+        rctx = self._make_rupture(5)
+        self.assertIsNone(gsim._get_rupture_terms(rctx, PGA()))
+        self.assertEqual(gsim._get_rupture_terms_for_imts(rctx, [PGA()]), {})
+        self.assertEqual(len(gsim._rupture_terms), 0)
+
+    def test_subclass_not_calling_base_constructor(self):
+        class GSIM(self.gsim_class):
+            def __init__(self):
+                self.foo = 'bar'
+
+        gsim = GSIM()
+        gsim._compute_rupture_terms = self.gsim._compute_rupture_terms
+        terms = gsim._get_rupture_terms(self._make_rupture(5), PGA())
+        self.assertEqual(terms, {'mag': 10, 'imt': 1})
+        self.assertIs(gsim._get_rupture_terms(self._make_rupture(5), PGA()),
+                      terms)
+        # memos are per object
+        self.assertIsNone(self.gsim._rupture_terms)
+
+
+class PickleTestCase(unittest.TestCase):
+    def setUp(self):
+        super(PickleTestCase, self).setUp()
+        self.gsim = BooreAtkinson2008()
+        rctx = RuptureContext()
+        rctx.mag = 6.5
+        rctx.rake = 90
+        self.gsim._get_rupture_terms(rctx, PGA())
+        self.sites = SiteCollection([
+            Site(Point(1, 2), vs30=456, vs30measured=False,
+                 z1pt0=12.1, z2pt5=15.1),
+            Site(Point(2, 3), vs30=1456, vs30measured=False,
+                 z1pt0=12.1, z2pt5=15.1)
+        ])
+        sctx = self.gsim._make_sites_context(self.sites)
+        self.gsim._get_site_terms(sctx, PGA())
+
+    def _check_gsim(self, gsim):
+        self.assertIsInstance(gsim, BooreAtkinson2008)
+        # memo is not copied, but created again on first use
+        self.assertNotIn('_rupture_terms', vars(gsim))
+        self.assertNotIn('_rupture_terms_lock', vars(gsim))
+        rctx = RuptureContext()
+        rctx.mag = 6.5
+        rctx.rake = 90
+        self.assertEqual(gsim._get_rupture_terms(rctx, PGA()),
+                         self.gsim._get_rupture_terms(rctx, PGA()))
+        self.assertEqual(len(gsim._rupture_terms), 1)
+        self.assertIsNot(gsim._rupture_terms_lock,
+                         self.gsim._rupture_terms_lock)
+
+    def test_pickle_gsim(self):
+        self._check_gsim(pickle.loads(pickle.dumps(self.gsim)))
+        self._check_gsim(pickle.loads(pickle.dumps(self.gsim, -1)))
+
+    def test_deepcopy_gsim(self):
+        self._check_gsim(copy.deepcopy(self.gsim))
+
+    def test_used_site_collection(self):
+        for sites in (pickle.loads(pickle.dumps(self.sites, -1)),
+                      copy.deepcopy(self.sites)):
+            [(gsim, imt)] = sites._cached_values
+            self._check_gsim(gsim)
+            self.assertEqual(imt, PGA())
+            numpy.testing.assert_array_equal(sites.vs30, self.sites.vs30)
+
+
+class CoeffsTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.table = CoeffsTable(sa_damping=5, table="""
+            imt   a    b
+            pga   1    2
+            0.1   10   20
+            1.0   1    2
+            10    2    4
+        """)
+
+    def test_memoized_interpolation(self):
+        imt = SA(period=0.2, damping=5)
+        coeffs = self.table[imt]
+        self.assertIs(self.table[SA(period=0.2, damping=5)], coeffs)
+        vector = self.table.get_vector(imt)
+        self.assertEqual(vector.tolist(), [coeffs['a'], coeffs['b']])
+        self.assertFalse(vector.flags.writeable)
+        self.assertEqual(len(self.table._interpolated), 1)
+
+    def test_cache_size(self):
+        self.table.INTERPOLATION_CACHE_SIZE = 3
+        periods = [0.2, 0.3, 0.4, 0.5]
+        for period in periods:
+            self.table[SA(period=period, damping=5)]
+        self.assertEqual(self.table._interpolated.keys(),
+                         [SA(period=period, damping=5)
+                          for period in periods[1:]])
+
+    def test_get_vectors(self):
+        vectors = self.table.get_vectors([SA(period=1.0, damping=5),
+                                          PGA(), SA(period=3, damping=5)])
+        numpy.testing.assert_almost_equal(
+            vectors, [[1, 2], [1, 2], [1.4771213, 2.9542425]]
+        )
+        self.assertEqual(self.table.columns, {'a': 0, 'b': 1})
+        self.assertRaises(KeyError, self.table.get_vector, PGV())
+        self.assertRaises(KeyError, self.table.get_vector,
+                          SA(period=20, damping=5))
+        self.assertRaises(KeyError, self.table.get_vector,
+                          SA(period=3, damping=10))
+
+    def test_threads(self):
+        import threading
+        imts = [SA(period=period, damping=5)
+                for period in numpy.linspace(0.11, 9.9, 50)]
+        results = []
+
+        def lookup():
+            results.append([self.table[imt]['a'] for imt in imts])
+
+        threads = [threading.Thread(target=lookup) for _ in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 4)
+        for result in results:
+            self.assertEqual(result, results[0])
@@ -13,6 +13,10 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import numpy
+
+from nhlib.gsim.base import SitesContext, RuptureContext, DistancesContext
+from nhlib.imt import PGA, PGV, SA
 from nhlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
 
 from tests.gsim.utils import BaseGSIMTestCase
@@ -47,4 +51,57 @@ class BooreAtkinson2008TestCase(BaseGSIMTestCase):
                     
     def test_std_total_strike_slip(self):
         self.check('NGA/BA08/BA08_SIGTM_SS.csv',
-                    max_discrep_percentage=0.1)
\ No newline at end of file
+                    max_discrep_percentage=0.1)
+
+    def test_cached_site_terms(self):
+        self.check_cached_site_terms()
+
+    def test_mean_and_stddevs_for_imts(self):
+        imts = [PGA(), PGV(), SA(period=0.2, damping=5),
+                  SA(period=1.5, damping=5), SA(period=3, damping=5)]
+        self.check_mean_and_stddevs_for_imts(imts)
+
+    def test_pga4nl_computed_once_for_imts(self):
+        gsim = self.GSIM_CLASS()
+        sctx = SitesContext()
+        sctx.vs30 = numpy.array([200., 400., 800.])
+        rctx = RuptureContext()
+        rctx.mag = 6.5
+        rctx.rake = 45
+        dctx = DistancesContext()
+        dctx.rjb = numpy.array([1., 10., 100.])
+        calls = []
+        compute_distance_scaling = gsim._compute_distance_scaling
+
+        def counting_distance_scaling(rup, dists, C):
+            calls.append(C)
+            return compute_distance_scaling(rup, dists, C)
+
+        gsim._compute_distance_scaling = counting_distance_scaling
+        imts = [PGA(), PGV(), SA(period=0.2, damping=5)]
+        means, _ = gsim.get_mean_and_stddevs_for_imts(sctx, rctx, dctx,
+                                                      imts, [])
+        for imt, mean in zip(imts, means):
+            expected_mean, _ = self.GSIM_CLASS().get_mean_and_stddevs(
+                sctx, rctx, dctx, imt, []
+            )
+            numpy.testing.assert_almost_equal(mean, expected_mean)
+        # distance scaling is computed once for all the imts
+        # and once for the reference PGA
+        self.assertEqual(len(calls), 2)
+
+        # nothing is kept between calls, so modified contexts
+        # give updated results
+        dctx.rjb = dctx.rjb * 2
+        means2, _ = gsim.get_mean_and_stddevs_for_imts(sctx, rctx, dctx,
+                                                       imts, [])
+        expected_mean, _ = self.GSIM_CLASS().get_mean_and_stddevs(
+            sctx, rctx, dctx, PGA(), []
+        )
+        numpy.testing.assert_almost_equal(means2[0], expected_mean)
+
+        # new contexts mean new reference PGA
+        dctx2 = DistancesContext()
+        dctx2.rjb = numpy.array([2., 20., 200.])
+        gsim.get_mean_and_stddevs(sctx, rctx, dctx2, PGA(), [])
+        self.assertEqual(len(calls), len(imts) + 3)
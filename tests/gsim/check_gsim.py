@@ -17,8 +17,10 @@
 """
 Check GMPE/IPE class versus data file in CSV format by calculating standard
 deviation and/or mean value and comparing the result to the expected value.
+Optionally benchmark the GMPE/IPE using contexts from the data file.
 """
 import csv
+import json
 import math
 import sys
 import time
@@ -91,6 +93,211 @@ def check_gsim(gsim_cls, datafile, max_discrep_percentage, debug=False):
     return errors, _format_stats(time.time() - started, discrepancies, errors)
 
 
+def benchmark_gsim(gsim_cls, datafile, num_sites, num_ruptures,
+                   vectorized=True, truncation_level=3.0, num_imls=20):
+    """
+    Measure throughput of GSIM on contexts taken from the data file.
+
+    Site and distance parameters of test contexts are replicated up
+    to ``num_sites`` sites, and contexts are cycled through until
+    ``num_ruptures`` ruptures are collected, each rupture getting its
+    own context objects. Each intensity measure type that the data
+    file has expected results for is then exercised for every rupture.
+    GSIM's memoized values are cleared before moving to the next
+    rupture, so values computed for earlier ruptures (or in earlier
+    measurements) with the same parameters are not reused.
+
+    :param gsim_cls:
+        A subclass of either :class:`~nhlib.gsim.base.GMPE`
+        or :class:`~nhlib.gsim.base.IPE` to benchmark.
+    :param datafile:
+        A file object containing test data in csv format.
+    :param num_sites:
+        Number of sites in each replicated context.
+    :param num_ruptures:
+        Number of ruptures to evaluate GSIM for.
+    :param vectorized:
+        If ``True``, GSIM is called once for all the sites of a rupture,
+        otherwise it is called for each site separately.
+    :param truncation_level:
+        Truncation level to pass to
+        :meth:`~nhlib.gsim.base.GroundShakingIntensityModel.get_poes`.
+    :param num_imls:
+        Number of intensity measure levels to calculate PoEs of.
+
+    :returns:
+        A list of tuples of two items: a name of measured function
+        (``'mean'``, one of standard deviation types or ``'poes'``)
+        and a rate of evaluations per second, that is number of
+        "site -- rupture -- IMT" triples processed in a second.
+    """
+    gsim = gsim_cls()
+    testcases = []
+    imts = []
+    for testcase in _parse_csv(datafile, debug=False):
+        sctx, rctx, dctx, _, expected_results, _ = testcase
+        testcases.append((sctx, rctx, dctx))
+        for imt in expected_results:
+            if not imt in imts:
+                imts.append(imt)
+    contexts = [
+        _replicate_contexts(*(testcases[i % len(testcases)] + (num_sites, )))
+        for i in xrange(num_ruptures)
+    ]
+    if not vectorized:
+        contexts = [single_site_contexts
+                    for all_sites_contexts in contexts
+                    for single_site_contexts
+                    in _split_contexts(*all_sites_contexts)]
+
+    # choose levels around mean values of the first rupture
+    imls = {}
+    for imt in imts:
+        mean, _ = gsim.get_mean_and_stddevs(*(contexts[0] + (imt, [])))
+        imls[imt] = gsim.to_imt_unit_values(
+            numpy.linspace(mean.min() - 2, mean.max() + 2, num_imls)
+        )
+
+    measurements = [('mean', lambda ctxs, imt: gsim.get_mean_and_stddevs(
+        *(ctxs + (imt, []))
+    ))]
+    for stddev_type in sorted(gsim.DEFINED_FOR_STANDARD_DEVIATION_TYPES):
+        measurements.append((stddev_type, lambda ctxs, imt, st=stddev_type:
+                             gsim.get_mean_and_stddevs(
+                                 *(ctxs + (imt, [st]))
+                             )))
+    measurements.append(('poes', lambda ctxs, imt: gsim.get_poes(
+        *(ctxs + (imt, imls[imt], truncation_level))
+    )))
+
+    evaluations = num_sites * num_ruptures * len(imts)
+    rates = []
+    for name, func in measurements:
+        last_rctx = None
+        started = time.time()
+        for ctxs in contexts:
+            if ctxs[1] is not last_rctx:
+                # single site contexts of one rupture share rupture
+                # context, memos are only cleared for a new rupture
+                _clear_memos(gsim)
+                last_rctx = ctxs[1]
+            for imt in imts:
+                func(ctxs, imt)
+        rates.append((name, evaluations / (time.time() - started)))
+    return rates
+
+
+def compare_benchmark(rates, baseline, tolerance):
+    """
+    Compare benchmark results to a baseline.
+
+    :param rates:
+        A list of benchmark results as returned by :func:`benchmark_gsim`.
+    :param baseline:
+        A dictionary mapping names of measured functions to baseline
+        rates of evaluations per second.
+    :param tolerance:
+        Allowed slowdown relative to the baseline, in percents.
+    :returns:
+        A tuple of two elements: a number of regressions (functions
+        that got slower by more than ``tolerance`` percents) and a string
+        representing benchmark results.
+    """
+    regressions = 0
+    lines = []
+    for name, rate in rates:
+        line = '%-20s %14.1f evals/sec' % (name, rate)
+        if name in baseline:
+            change = (rate / baseline[name] - 1) * 100
+            line += ' (%+.1f%% vs baseline %.1f)' % (change, baseline[name])
+            if change < - tolerance:
+                regressions += 1
+                line += ' REGRESSION'
+        lines.append(line)
+    return regressions, '\n'.join(lines)
+
+
+def save_baseline(rates, filename):
+    """
+    Store benchmark results in a json file to use as a baseline.
+
+    :param rates:
+        A list of benchmark results as returned by :func:`benchmark_gsim`.
+    :param filename:
+        Path to the file to write.
+    """
+    with open(filename, 'w') as baseline_file:
+        json.dump(dict(rates), baseline_file, indent=4)
+
+
+def load_baseline(filename):
+    """
+    Load a baseline stored by :func:`save_baseline`.
+
+    :returns:
+        A dictionary in a format of :func:`compare_benchmark`
+        ``baseline`` parameter.
+    """
+    with open(filename) as baseline_file:
+        return json.load(baseline_file)
+
+
+def _replicate_contexts(sctx, rctx, dctx, num_sites):
+    """
+    Make copies of all the contexts, with attributes of sites and
+    distances contexts replicated up to ``num_sites`` values.
+
+    :returns:
+        A tuple of new sites, rupture and distances contexts.
+    """
+    new_sctx = SitesContext()
+    new_rctx = RuptureContext()
+    new_dctx = DistancesContext()
+    for slot in RuptureContext.__slots__:
+        if hasattr(rctx, slot):
+            setattr(new_rctx, slot, getattr(rctx, slot))
+    for old_ctx, new_ctx in ((sctx, new_sctx), (dctx, new_dctx)):
+        for slot in type(old_ctx).__slots__:
+            if hasattr(old_ctx, slot):
+                setattr(new_ctx, slot,
+                        numpy.resize(getattr(old_ctx, slot), num_sites))
+    return new_sctx, new_rctx, new_dctx
+
+
+def _clear_memos(gsim):
+    """
+    Forget values that ``gsim`` memoized for ruptures evaluated before.
+    """
+    memo, lock = gsim._get_rupture_terms_memo()
+    with lock:
+        memo.clear()
+
+
+def _split_contexts(sctx, rctx, dctx):
+    """
+    Split sites and distances contexts into single-site ones.
+
+    :returns:
+        A list of tuples of sites, rupture and distances contexts,
+        one tuple per site.
+    """
+    sattrs = [slot for slot in SitesContext.__slots__ if hasattr(sctx, slot)]
+    dattrs = [slot for slot in DistancesContext.__slots__
+              if hasattr(dctx, slot)]
+    num_sites = len(getattr(sctx, sattrs[0]) if sattrs
+                    else getattr(dctx, dattrs[0]))
+    split = []
+    for i in xrange(num_sites):
+        new_sctx = SitesContext()
+        new_dctx = DistancesContext()
+        for slot in sattrs:
+            setattr(new_sctx, slot, getattr(sctx, slot)[i:i + 1])
+        for slot in dattrs:
+            setattr(new_dctx, slot, getattr(dctx, slot)[i:i + 1])
+        split.append((new_sctx, rctx, new_dctx))
+    return split
+
+
 def _format_stats(time_spent, discrepancies, errors):
     """
     Format a GMPE test statistics.
@@ -312,9 +519,53 @@ if __name__ == '__main__':
     dbg_group.add_argument('-q', '--quiet', action='store_true',
                            help="don't print stats at the end. use exit " \
                                 "code to determine if test succeeded.")
+    bench_group = parser.add_argument_group('benchmark')
+    bench_group.add_argument('-b', '--benchmark', action='store_true',
+                             help='measure GSIM throughput instead of ' \
+                                  'checking results')
+    bench_group.add_argument('--sites', type=int, default=1000,
+                             dest='num_sites', metavar='N',
+                             help='number of sites per rupture. ' \
+                                  'default value is 1000.')
+    bench_group.add_argument('--ruptures', type=int, default=100,
+                             dest='num_ruptures', metavar='R',
+                             help='number of ruptures. default value ' \
+                                  'is 100.')
+    bench_group.add_argument('--scalar', action='store_true',
+                             help='call GSIM for each site separately')
+    bench_group.add_argument('--baseline', metavar='FILE',
+                             help='json file with baseline results ' \
+                                  'to compare to')
+    bench_group.add_argument('--save-baseline', metavar='FILE',
+                             help='store results in a json file ' \
+                                  'to use as a baseline later')
+    bench_group.add_argument('--tolerance', type=float, default=10,
+                             metavar='prcnt',
+                             help='the maximum slowdown relative to ' \
+                                  'the baseline, in percents. default ' \
+                                  'value is 10.')
 
     args = parser.parse_args()
 
+    if args.benchmark:
+        rates = benchmark_gsim(
+            gsim_cls=args.gsim, datafile=args.datafile,
+            num_sites=args.num_sites, num_ruptures=args.num_ruptures,
+            vectorized=not args.scalar
+        )
+        baseline = {}
+        if args.baseline:
+            baseline = load_baseline(args.baseline)
+        regressions, stats = compare_benchmark(rates, baseline,
+                                               args.tolerance)
+        if args.save_baseline:
+            save_baseline(rates, args.save_baseline)
+        if not args.quiet:
+            print >> sys.stderr, stats
+        if regressions:
+            exit(127)
+        exit(0)
+
     errors, stats = check_gsim(
         gsim_cls=args.gsim, datafile=args.datafile,
         max_discrep_percentage=args.max_discrep_percentage,
@@ -0,0 +1,104 @@
+# nhlib: A New Hazard Library
+# Copyright (C) 2012 GEM Foundation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from nhlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
+from tests.gsim.check_gsim import benchmark_gsim, compare_benchmark, \
+    save_baseline, load_baseline
+
+
+DATA = """\
+rup_mag,rup_rake,dist_rjb,site_vs30,result_type,damping,pga,1.00E-01
+4.00E+00,0.00E+00,0.00E+00,1.50E+02,MEAN,5.00E+00,1.81E-01,3.28E-01
+4.00E+00,0.00E+00,1.00E+01,1.80E+02,MEAN,5.00E+00,1.69E-01,3.14E-01
+6.00E+00,0.00E+00,1.00E+01,2.55E+02,MEAN,5.00E+00,1.50E-01,2.89E-01
+"""
+
+
+class _CountingBooreAtkinson2008(BooreAtkinson2008):
+    computed_rupture_terms = 0
+
+    def _compute_rupture_terms(self, rup, imt):
+        type(self).computed_rupture_terms += 1
+        return super(_CountingBooreAtkinson2008,
+                     self)._compute_rupture_terms(rup, imt)
+
+
+class BenchmarkGSIMTestCase(unittest.TestCase):
+    def setUp(self):
+        _CountingBooreAtkinson2008.computed_rupture_terms = 0
+
+    def _benchmark(self, **kwargs):
+        return benchmark_gsim(_CountingBooreAtkinson2008, StringIO(DATA),
+                              num_sites=5, num_ruptures=4, num_imls=3,
+                              **kwargs)
+
+    def test_rates(self):
+        rates = self._benchmark()
+        self.assertEqual([name for (name, rate) in rates],
+                         ['mean', 'Inter event', 'Intra event', 'Total',
+                          'poes'])
+        for name, rate in rates:
+            self.assertTrue(rate > 0)
+
+    def test_memos_cleared_between_ruptures(self):
+        # each of five measurements has to compute the terms of two
+        # imts again for each of four ruptures, even though the data
+        # file has only two distinct ruptures
+        self._benchmark()
+        counted = _CountingBooreAtkinson2008.computed_rupture_terms
+        self.assertTrue(counted >= 5 * 4 * 2, counted)
+
+    def test_scalar(self):
+        rates = self._benchmark(vectorized=False)
+        self.assertEqual(len(rates), 5)
+        counted = _CountingBooreAtkinson2008.computed_rupture_terms
+        # sites of one rupture still share the memoized terms
+        self.assertTrue(counted < 5 * 4 * 2 * 5, counted)
+
+
+class CompareBenchmarkTestCase(unittest.TestCase):
+    def test(self):
+        rates = [('mean', 1000.0), ('Total', 500.0), ('poes', 100.0)]
+        baseline = {'mean': 1050.0, 'Total': 1000.0}
+        regressions, stats = compare_benchmark(rates, baseline, tolerance=10)
+        self.assertEqual(regressions, 1)
+        lines = stats.splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn('-4.8% vs baseline', lines[0])
+        self.assertNotIn('REGRESSION', lines[0])
+        self.assertIn('-50.0% vs baseline', lines[1])
+        self.assertIn('REGRESSION', lines[1])
+        self.assertNotIn('baseline', lines[2])
+
+    def test_baseline_round_trip(self):
+        rates = benchmark_gsim(BooreAtkinson2008, StringIO(DATA),
+                               num_sites=3, num_ruptures=2, num_imls=3)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'baseline.json')
+            save_baseline(rates, filename)
+            baseline = load_baseline(filename)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(baseline, dict(rates))
+        regressions, stats = compare_benchmark(rates, baseline, tolerance=0)
+        self.assertEqual(regressions, 0)
+        self.assertEqual(stats.count('+0.0% vs baseline'), len(rates))
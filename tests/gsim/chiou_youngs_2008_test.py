@@ -13,6 +13,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from nhlib.imt import PGA, PGV, SA
 from nhlib.gsim.chiou_youngs_2008 import ChiouYoungs2008
 
 from tests.gsim.utils import BaseGSIMTestCase
@@ -56,3 +57,11 @@ class ChiouYoungs2008TestCase(BaseGSIMTestCase):
         # data generated from opensha
         self.check('NGA/CY08/CY08_INTRA_EVENT_SIGMA.csv',
                    max_discrep_percentage=0.001)
+
+    def test_cached_site_terms(self):
+        self.check_cached_site_terms()
+
+    def test_mean_and_stddevs_for_imts(self):
+        imts = [PGA(), PGV(), SA(period=0.2, damping=5),
+                  SA(period=1.5, damping=5), SA(period=3, damping=5)]
+        self.check_mean_and_stddevs_for_imts(imts)
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from nhlib.gsim.sadigh_1997 import SadighEtAl1997
+from nhlib.imt import PGA, SA
 
 from tests.gsim.utils import BaseGSIMTestCase
 
@@ -38,3 +39,8 @@ class SadighEtAl1997TestCase(BaseGSIMTestCase):
     def test_total_stddev_soil(self):
         self.check('SADIGH97/SADIGH1997_SOIL_STD_TOTAL.csv',
                    max_discrep_percentage=1e-10)
+
+    def test_mean_and_stddevs_for_imts(self):
+        imts = [PGA(), SA(period=0.2, damping=5),
+                  SA(period=1.5, damping=5), SA(period=3, damping=5)]
+        self.check_mean_and_stddevs_for_imts(imts)
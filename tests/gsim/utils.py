@@ -16,6 +16,13 @@
 import unittest
 import os
 
+import numpy
+
+from nhlib import const
+from nhlib.gsim.base import SitesContext, RuptureContext, DistancesContext
+from nhlib.geo import Point
+from nhlib.imt import PGA, SA
+from nhlib.site import Site, SiteCollection
 from tests.gsim.check_gsim import check_gsim
 
 
@@ -32,3 +39,76 @@ class BaseGSIMTestCase(unittest.TestCase):
             raise AssertionError(stats)
         print
         print stats
+
+    def check_mean_and_stddevs_for_imts(self, imts):
+        """
+        Check that ``get_mean_and_stddevs_for_imts()`` gives the same
+        results as calling ``get_mean_and_stddevs()`` for each of ``imts``.
+        """
+        gsim = self.GSIM_CLASS()
+        sctx = SitesContext()
+        sctx.vs30 = numpy.array([150, 250, 400, 800, 1500.])
+        sctx.vs30measured = numpy.array([True, False, True, False, True])
+        sctx.z1pt0 = numpy.array([10, 100, 500, 30, 1000.])
+        sctx.z2pt5 = numpy.array([1, 2, 3, 4, 5.])
+        dctx = DistancesContext()
+        dctx.rrup = numpy.array([1, 5, 20, 80, 200.])
+        dctx.rjb = dctx.rrup - 1
+        dctx.rx = numpy.array([-10, 0, 5, 50, 150.])
+        stddev_types = list(gsim.DEFINED_FOR_STANDARD_DEVIATION_TYPES)
+        for mag, rake in [(5, 0), (6.7, 90), (7.5, -90)]:
+            rctx = RuptureContext()
+            rctx.mag = mag
+            rctx.rake = rake
+            rctx.dip = 60
+            rctx.ztor = 2
+            means, stddevs = gsim.get_mean_and_stddevs_for_imts(
+                sctx, rctx, dctx, imts, stddev_types
+            )
+            self.assertEqual(means.shape, (len(imts), len(sctx.vs30)))
+            self.assertEqual(len(stddevs), len(stddev_types))
+            for i, imt in enumerate(imts):
+                mean, imt_stddevs = gsim.get_mean_and_stddevs(
+                    sctx, rctx, dctx, imt, stddev_types
+                )
+                numpy.testing.assert_almost_equal(means[i], mean)
+                for stddev, imt_stddev in zip(stddevs, imt_stddevs):
+                    numpy.testing.assert_almost_equal(stddev[i], imt_stddev)
+
+    def check_cached_site_terms(self):
+        """
+        Check that GSIM gives the same results for sites contexts created
+        from a filtered site collection (that cache site terms) as for
+        plain sites contexts, and that site terms are cached for the
+        original collection.
+        """
+        sites = SiteCollection([
+            Site(Point(0, 0), vs30=vs30, vs30measured=False, z1pt0=z1pt0,
+                 z2pt5=1)
+            for vs30, z1pt0 in [(200, 100), (400, 300), (800, 30),
+                                (1200, 1000)]
+        ]).filter(numpy.array([True, True, False, True]))
+        rctx = RuptureContext()
+        rctx.mag = 6.5
+        rctx.rake = 45
+        rctx.dip = 60
+        rctx.ztor = 3
+        dctx = DistancesContext()
+        dctx.rjb = dctx.rx = numpy.array([1, 10, 100])
+        dctx.rrup = numpy.array([3, 11, 102])
+        gsim = self.GSIM_CLASS()
+        sctx = SitesContext()
+        for param in gsim.REQUIRES_SITES_PARAMETERS:
+            setattr(sctx, param, getattr(sites, param))
+        for imt in [PGA(), SA(period=0.5, damping=5)]:
+            stddev_types = [const.StdDev.TOTAL]
+            expected = gsim.get_mean_and_stddevs(sctx, rctx, dctx, imt,
+                                                 stddev_types)
+            for i in xrange(2):
+                cached_sctx = gsim._make_sites_context(sites)
+                mean, stddevs = gsim.get_mean_and_stddevs(
+                    cached_sctx, rctx, dctx, imt, stddev_types
+                )
+                numpy.testing.assert_array_equal(mean, expected[0])
+                numpy.testing.assert_array_equal(stddevs, expected[1])
+        self.assertEqual(len(sites._root._cached_values), 2)
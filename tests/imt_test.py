@@ -13,6 +13,8 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import copy
+import pickle
 import unittest
 
 from nhlib import imt as imt_module
@@ -69,6 +71,13 @@ class BaseIMTTestCase(unittest.TestCase):
         imt2 = TestIMT2('some', 'thing')
         self.assertNotEqual(hash(imt1), hash(imt2))
 
+    def test_pickle(self):
+        for imt in (imt_module.PGA(), imt_module.SA(0.1, 5)):
+            for protocol in (0, pickle.HIGHEST_PROTOCOL):
+                self.assertEqual(pickle.loads(pickle.dumps(imt, protocol)),
+                                 imt)
+            self.assertEqual(copy.deepcopy(imt), imt)
+
 
 class SATestCase(unittest.TestCase):
     def test_wrong_period(self):
@@ -13,6 +13,9 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import shutil
+import tempfile
 import unittest
 
 import numpy
@@ -87,6 +90,137 @@ class SiteCollectionCreationTestCase(unittest.TestCase):
         self.assertEqual(len(cll), 2)
 
 
+class SiteCollectionFromArraysTestCase(unittest.TestCase):
+    def setUp(self):
+        self.arrays = dict(
+            lons=numpy.array([10, -1.2]), lats=numpy.array([20, -3.4]),
+            vs30=numpy.array([1.2, 55.4]),
+            vs30measured=numpy.array([True, False]),
+            z1pt0=numpy.array([3.4, 66.7]), z2pt5=numpy.array([5.6, 88.9])
+        )
+
+    def _assert_collection(self, cll):
+        expected = SiteCollection([
+            Site(location=Point(10, 20), vs30=1.2, vs30measured=True,
+                 z1pt0=3.4, z2pt5=5.6),
+            Site(location=Point(-1.2, -3.4), vs30=55.4, vs30measured=False,
+                 z1pt0=66.7, z2pt5=88.9)
+        ])
+        for attr in ('vs30', 'vs30measured', 'z1pt0', 'z2pt5'):
+            arr = getattr(cll, attr)
+            numpy.testing.assert_array_equal(arr, getattr(expected, attr))
+            self.assertEqual(arr.dtype, getattr(expected, attr).dtype)
+            self.assertEqual(arr.flags.writeable, False)
+        numpy.testing.assert_array_equal(cll.mesh.lons, expected.mesh.lons)
+        numpy.testing.assert_array_equal(cll.mesh.lats, expected.mesh.lats)
+        self.assertEqual(cll.mesh.lons.flags.writeable, False)
+        self.assertIs(cll.mesh.depths, None)
+        self.assertIs(cll.indices, None)
+        self.assertEqual(len(cll), 2)
+
+    def test_from_arrays(self):
+        cll = SiteCollection.from_arrays(**self.arrays)
+        self._assert_collection(cll)
+        for attr in ('vs30', 'vs30measured', 'z1pt0', 'z2pt5'):
+            self.assertIs(getattr(cll, attr).base, self.arrays[attr])
+            # original arrays stay writeable
+            self.assertEqual(self.arrays[attr].flags.writeable, True)
+        self.assertIs(cll.mesh.lons.base, self.arrays['lons'])
+        filtered = cll.filter(numpy.array([False, True]))
+        numpy.testing.assert_array_equal(filtered.vs30, [55.4])
+
+    def test_from_arrays_conversion(self):
+        self.arrays['vs30'] = [1.2, 55.4]
+        self.arrays['vs30measured'] = numpy.array([1, 0])
+        self.arrays['lons'] = numpy.array([10, -1.2], dtype=numpy.float32)
+        cll = SiteCollection.from_arrays(**self.arrays)
+        self.assertEqual(cll.mesh.lons.dtype, float)
+        numpy.testing.assert_allclose(cll.mesh.lons, [10, -1.2], rtol=1e-6)
+        numpy.testing.assert_array_equal(cll.vs30measured, [True, False])
+
+    def test_from_structured_array(self):
+        array = numpy.zeros(2, dtype=SiteCollection.DTYPE)
+        for name in SiteCollection.DTYPE.names:
+            array[name] = self.arrays[name]
+        cll = SiteCollection.from_structured_array(array)
+        self._assert_collection(cll)
+        # no copy is made
+        array['vs30'][0] = 123
+        self.assertEqual(cll.vs30[0], 123)
+
+    def test_wrong_input(self):
+        def assert_error(error, **kwargs):
+            arrays = dict(self.arrays, **kwargs)
+            with self.assertRaises(ValueError) as ar:
+                SiteCollection.from_arrays(**arrays)
+            self.assertEqual(str(ar.exception), error)
+
+        assert_error('vs30 must be positive', vs30=numpy.array([1, 0]))
+        assert_error('z1pt0 must be positive', z1pt0=numpy.array([1, -1]))
+        assert_error('z2pt5 must be positive', z2pt5=numpy.array([0, 1]))
+        error = 'site parameters must be 1d arrays of the same length'
+        assert_error(error, lats=numpy.array([1, 2, 3]))
+        assert_error(error, lons=numpy.array([[1, 2]]))
+        assert_error('at least one site is required',
+                     **dict((name, []) for name in self.arrays))
+        with self.assertRaises(ValueError) as ar:
+            SiteCollection.from_structured_array(numpy.zeros(2))
+        self.assertEqual(str(ar.exception),
+                         'structured array must have fields lons, lats, '
+                         'vs30, vs30measured, z1pt0, z2pt5')
+
+
+class SiteCollectionSaveLoadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dirname)
+        self.col = SiteCollection([
+            Site(location=Point(10, 20), vs30=1.2, vs30measured=True,
+                 z1pt0=3.4, z2pt5=5.6),
+            Site(location=Point(-1.2, -3.4), vs30=55.4, vs30measured=False,
+                 z1pt0=66.7, z2pt5=88.9)
+        ])
+
+    def _is_memmapped(self, arr):
+        while arr is not None:
+            if isinstance(arr, numpy.memmap):
+                return True
+            arr = getattr(arr, 'base', None)
+        return False
+
+    def _assert_loaded(self, col, expected):
+        arreq = numpy.testing.assert_array_equal
+        for attr in ('vs30', 'vs30measured', 'z1pt0', 'z2pt5'):
+            arreq(getattr(col, attr), getattr(expected, attr))
+            self.assertEqual(getattr(col, attr).flags.writeable, False)
+        arreq(col.mesh.lons, expected.mesh.lons)
+        arreq(col.mesh.lats, expected.mesh.lats)
+        self.assertIs(col.indices, None)
+
+    def test_mmap(self):
+        dirname = os.path.join(self.dirname, 'sites')
+        self.col.save(dirname)
+        self.assertEqual(sorted(os.listdir(dirname)),
+                         ['lats.npy', 'lons.npy', 'vs30.npy',
+                          'vs30measured.npy', 'z1pt0.npy', 'z2pt5.npy'])
+        col = SiteCollection.load(dirname)
+        self._assert_loaded(col, self.col)
+        self.assertTrue(self._is_memmapped(col.vs30))
+        filtered = col.filter(numpy.array([False, True]))
+        numpy.testing.assert_array_equal(filtered.z1pt0, [66.7])
+
+    def test_no_mmap(self):
+        self.col.save(self.dirname)
+        col = SiteCollection.load(self.dirname, mmap=False)
+        self._assert_loaded(col, self.col)
+        self.assertFalse(self._is_memmapped(col.vs30))
+
+    def test_filtered(self):
+        filtered = self.col.filter(numpy.array([False, True]))
+        filtered.save(self.dirname)
+        self._assert_loaded(SiteCollection.load(self.dirname), filtered)
+
+
 class SiteCollectionFilterTestCase(unittest.TestCase):
     SITES = [
         Site(location=Point(10, 20, 30), vs30=1.2, vs30measured=True,
@@ -149,6 +283,46 @@ class SiteCollectionFilterTestCase(unittest.TestCase):
         filtered2 = filtered.filter(numpy.array([True, False, True]))
         arreq(filtered2.indices, [0, 3])
 
+    def test_filtered_mesh_caches(self):
+        col = SiteCollection(self.SITES)
+        col.mesh.get_cartesian()
+        filtered = col.filter(numpy.array([True, False, True, True]))
+        filtered2 = filtered.filter(numpy.array([False, True, True]))
+        root_rad_coords = col.mesh.get_rad_coords()
+        arreq = numpy.testing.assert_array_equal
+        for fcol, indices in [(filtered, [0, 2, 3]), (filtered2, [2, 3])]:
+            mesh = fcol.mesh
+            # caches are taken from the root, not computed again
+            self.assertIsNotNone(mesh._rad_coords)
+            self.assertIsNotNone(mesh._cartesian)
+            for arr, root_arr in zip(mesh.get_rad_coords(), root_rad_coords):
+                arreq(arr, root_arr.take(indices))
+            arreq(mesh.get_cartesian(),
+                  col.mesh.get_cartesian().take(indices, axis=0))
+        self.assertIs(col.mesh.get_rad_coords(), root_rad_coords)
+
+    def test_lazy_filter(self):
+        col = SiteCollection(self.SITES)
+        filtered = col.filter(numpy.array([True, False, True, True]))
+        filtered2 = filtered.filter(numpy.array([False, True, True]))
+        self.assertEqual(len(filtered2), 2)
+        for attr in ('mesh', 'vs30', 'vs30measured', 'z1pt0', 'z2pt5'):
+            self.assertNotIn(attr, vars(filtered))
+            self.assertNotIn(attr, vars(filtered2))
+        vs30 = filtered2.vs30
+        numpy.testing.assert_array_equal(vs30, [2, 4])
+        self.assertEqual(vs30.flags.writeable, False)
+        self.assertIs(filtered2.vs30, vs30)
+        self.assertEqual(sorted(attr for attr in vars(filtered2)
+                                if not attr.startswith('_')),
+                         ['indices', 'vs30'])
+        mesh = filtered2.mesh
+        numpy.testing.assert_array_equal(mesh.lons, [0, 1])
+        self.assertEqual(mesh.lats.flags.writeable, False)
+        self.assertIs(filtered2.mesh, mesh)
+        # intermediate collection is not materialized
+        self.assertNotIn('vs30', vars(filtered))
+
     def test_expand_2d(self):
         col = SiteCollection(self.SITES)
         col.indices = numpy.array([1, 3, 5, 6])
@@ -181,6 +355,37 @@ class SiteCollectionFilterTestCase(unittest.TestCase):
         data_expanded_expected = numpy.array([5, 100, 6, 7])
         numpy.testing.assert_array_equal(data_expanded, data_expanded_expected)
 
+    def test_expand_3d(self):
+        col = SiteCollection(self.SITES)
+        col = col.filter(numpy.array([0, 1, 0, 1]))
+        data_condensed = numpy.arange(12).reshape((2, 3, 2))
+        data_expanded = col.expand(data_condensed, total_sites=4,
+                                   placeholder=0)
+        self.assertEqual(data_expanded.shape, (4, 3, 2))
+        numpy.testing.assert_array_equal(data_expanded[[0, 2]], 0)
+        numpy.testing.assert_array_equal(data_expanded[[1, 3]],
+                                         data_condensed)
+
+    def test_expand_out(self):
+        col = SiteCollection(self.SITES)
+        filtered = col.filter(numpy.array([1, 0, 1, 1]))
+        out = numpy.empty((4, 2))
+        data_expanded = filtered.expand(numpy.array([[1, 2], [3, 4],
+                                                     [5, 6]]),
+                                        total_sites=4, placeholder=0,
+                                        out=out)
+        self.assertIs(data_expanded, out)
+        numpy.testing.assert_array_equal(out, [[1, 2], [0, 0], [3, 4],
+                                               [5, 6]])
+        data_condensed = numpy.array([[1, 2], [3, 4], [5, 6], [7, 8]])
+        data_expanded = col.expand(data_condensed, total_sites=4,
+                                   placeholder=0, out=out)
+        self.assertIs(data_expanded, out)
+        numpy.testing.assert_array_equal(out, data_condensed)
+        self.assertRaises(AssertionError, filtered.expand,
+                          numpy.array([1, 2, 3]), total_sites=4,
+                          placeholder=0, out=out)
+
     def test_expand_no_filtering(self):
         col = SiteCollection(self.SITES)
         data_condensed = numpy.array([3, 2, 1, 0])
@@ -188,3 +393,134 @@ class SiteCollectionFilterTestCase(unittest.TestCase):
                                    placeholder=100)
         data_expanded_expected = data_condensed
         numpy.testing.assert_array_equal(data_expanded, data_expanded_expected)
+
+
+class SiteCollectionReorderTestCase(unittest.TestCase):
+    def setUp(self):
+        # 8x8 grid of sites in a random order
+        lons, lats = numpy.meshgrid(numpy.arange(8.), numpy.arange(8.))
+        order = numpy.random.RandomState(42).permutation(64)
+        self.col = SiteCollection.from_arrays(
+            lons.ravel()[order], lats.ravel()[order],
+            vs30=numpy.arange(1., 65), vs30measured=numpy.arange(64) % 2,
+            z1pt0=numpy.arange(2., 66), z2pt5=numpy.arange(3., 67)
+        )
+
+    def _check(self, curve):
+        col, permutation = self.col.reorder(curve=curve)
+        self.assertEqual(sorted(permutation), range(64))
+        for attr in ('vs30', 'vs30measured', 'z1pt0', 'z2pt5'):
+            numpy.testing.assert_array_equal(
+                getattr(col, attr), getattr(self.col, attr)[permutation]
+            )
+            self.assertEqual(getattr(col, attr).flags.writeable, False)
+        numpy.testing.assert_array_equal(col.mesh.lons,
+                                         self.col.mesh.lons[permutation])
+        numpy.testing.assert_array_equal(
+            col.vs30[numpy.argsort(permutation)], self.col.vs30
+        )
+        return col
+
+    def test_hilbert(self):
+        col = self._check('hilbert')
+        # consecutive sites along hilbert curve are grid neighbours
+        steps = (numpy.abs(numpy.diff(col.mesh.lons))
+                 + numpy.abs(numpy.diff(col.mesh.lats)))
+        numpy.testing.assert_array_equal(steps, 1)
+        # sites of one quadrant form a contiguous range
+        filtered = col.filter((col.mesh.lons < 4) & (col.mesh.lats < 4))
+        self.assertEqual(filtered._slice, slice(0, 16))
+        numpy.testing.assert_array_equal(filtered.vs30, col.vs30[:16])
+        self.assertIs(filtered.vs30.base, col.vs30.base)
+
+    def test_morton(self):
+        col = self._check('morton')
+        numpy.testing.assert_array_equal(col.mesh.lons[:4], [0, 1, 0, 1])
+        numpy.testing.assert_array_equal(col.mesh.lats[:4], [0, 0, 1, 1])
+
+    def test_unknown_curve(self):
+        with self.assertRaises(ValueError) as ar:
+            self.col.reorder(curve='peano')
+        self.assertEqual(str(ar.exception),
+                         "unknown space-filling curve 'peano'")
+
+    def test_wrong_bits(self):
+        for bits in [0, -1, 32]:
+            with self.assertRaises(ValueError) as ar:
+                self.col.reorder(bits=bits)
+            self.assertEqual(str(ar.exception), 'bits must be from 1 to 31')
+        col, _ = self.col.reorder(bits=31)
+        self.assertEqual(len(col), len(self.col))
+
+    def test_filtered(self):
+        filtered = self.col.filter(numpy.arange(64) >= 60)
+        with self.assertRaises(ValueError) as ar:
+            filtered.reorder()
+        self.assertEqual(str(ar.exception),
+                         'filtered collections can not be reordered')
+
+    def test_expand_slice(self):
+        col, _ = self.col.reorder()
+        filtered = col.filter(numpy.arange(64) >= 60)
+        self.assertEqual(filtered._slice, slice(60, 64))
+        expanded = filtered.expand(numpy.ones((4, 2)), total_sites=64,
+                                   placeholder=0)
+        numpy.testing.assert_array_equal(expanded.sum(axis=1),
+                                         [0] * 60 + [2] * 4)
+
+
+class SiteCollectionCachedValuesTestCase(unittest.TestCase):
+    SITES = SiteCollectionFilterTestCase.SITES
+
+    def setUp(self):
+        self.calls = []
+
+    def compute(self, sitecol):
+        self.calls.append(sitecol)
+        return {'double_vs30': sitecol.vs30 * 2,
+                'z': numpy.array([sitecol.z1pt0, sitecol.z2pt5]).T}
+
+    def test_whole_collection(self):
+        col = SiteCollection(self.SITES)
+        values = col.get_cached_values('key', self.compute)
+        numpy.testing.assert_array_equal(values['double_vs30'],
+                                         [2.4, 110.8, 4, 8])
+        self.assertIs(col.get_cached_values('key', self.compute), values)
+        self.assertEqual(self.calls, [col])
+        col.get_cached_values('other key', self.compute)
+        self.assertEqual(self.calls, [col, col])
+
+    def test_no_values(self):
+        col = SiteCollection(self.SITES)
+        filtered = col.filter(numpy.array([True, False, True, True]))
+        compute = lambda sitecol: self.calls.append(sitecol)
+        self.assertIsNone(filtered.get_cached_values('key', compute))
+        self.assertIsNone(filtered.get_cached_values('key', compute))
+        self.assertIsNone(col.get_cached_values('key', compute))
+        self.assertEqual(self.calls, [col])
+
+    def test_size_limit(self):
+        col = SiteCollection(self.SITES)
+        col.CACHED_VALUES_SIZE = 2
+        for key in ['a', 'b', 'c']:
+            col.get_cached_values(key, self.compute)
+        # the oldest entry is evicted
+        self.assertEqual(list(col._cached_values), ['b', 'c'])
+        col.get_cached_values('c', self.compute)
+        self.assertEqual(len(self.calls), 3)
+        col.get_cached_values('a', self.compute)
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(list(col._cached_values), ['c', 'a'])
+
+    def test_filtered_collection(self):
+        col = SiteCollection(self.SITES)
+        filtered = col.filter(numpy.array([True, False, True, True]))
+        filtered2 = filtered.filter(numpy.array([False, True, True]))
+        values = filtered2.get_cached_values('key', self.compute)
+        numpy.testing.assert_array_equal(values['double_vs30'], [4, 8])
+        numpy.testing.assert_array_equal(values['z'], [[9, 17], [22, 11]])
+        values = filtered.get_cached_values('key', self.compute)
+        numpy.testing.assert_array_equal(values['double_vs30'],
+                                         [2.4, 4, 8])
+        # values are computed only once for the whole collection
+        self.assertEqual(self.calls, [col])
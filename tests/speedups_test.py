@@ -13,8 +13,12 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import inspect
+import time
 import unittest
 
+import numpy
+
 from nhlib import speedups
 
 
@@ -61,3 +65,234 @@ class SpeedupsRegistryTestCase(unittest.TestCase):
             self.registry.register(self.orig, alt2)
         self.assertTrue(str(ar.exception).startswith('functions signatures ' \
                                                      'are different'))
+
+
+class SpeedupsDispatchTestCase(unittest.TestCase):
+    def setUp(self):
+        super(SpeedupsDispatchTestCase, self).setUp()
+
+        def func(size, extra=None):
+            # constant overhead
+            time.sleep(0.005)
+            return 'orig'
+        def alt1(size, extra=None):
+            return 'alt1'
+        def alt2(size, extra=None):
+            # cost proportional to the size
+            time.sleep(size * 1e-4)
+            return 'alt2'
+        def size(size, extra=None):
+            return size
+        def sample(size):
+            return (size, ), {}
+
+        self.func = func
+        self.alt1 = alt1
+        self.alt2 = alt2
+        self.size = size
+        self.sample = sample
+        self.registry = speedups.SpeedupsRegistry()
+
+    def test_several_implementations(self):
+        self.registry.register(self.func, self.alt1)
+        self.registry.register(self.func, self.alt2)
+        self.assertEqual(self.registry.funcs.keys(), [self.func])
+        # last registered is used by default
+        self.assertEqual(self.func(0), 'alt2')
+        self.registry.disable()
+        self.assertEqual(self.func(0), 'orig')
+        self.registry.enable()
+        self.assertEqual(self.func(0, extra=1), 'alt2')
+
+    def test_no_dispatcher(self):
+        self.registry.register(self.func, self.alt1,
+                               size=self.size, sample=self.sample)
+        # without calibration and stats, code is substituted as is
+        self.assertIs(self.func.func_code, self.alt1.func_code)
+        self.assertEqual(self.func(0), 'alt1')
+        self.assertEqual(self.registry.get_stats(),
+                         {'%s.func' % __name__: {}})
+
+    def test_calibrate(self):
+        self.registry.register(self.func, self.alt2,
+                               size=self.size, sample=self.sample)
+        self.registry.calibrate(sizes=[1, 100], repeat=1)
+        entry = self.registry.funcs[self.func]
+        self.assertIs(self.func.func_code, entry.dispatch_code)
+        self.assertEqual(self.func(1), 'alt2')
+        self.assertEqual(self.func(0), 'alt2')
+        self.assertEqual(self.func(100), 'orig')
+        self.assertEqual(self.func(1000), 'orig')
+
+    def test_calibrate_without_sample(self):
+        self.registry.register(self.func, self.alt1)
+        # not calibratable functions are skipped
+        self.registry.calibrate(sizes=[1, 100], repeat=1)
+        self.assertIsNone(self.registry.funcs[self.func].policy)
+        with self.assertRaises(AssertionError):
+            self.registry.calibrate(self.func, sizes=[1, 100], repeat=1)
+
+    def test_autotune(self):
+        self.registry.autotune = True
+        self.registry.CALIBRATION_SIZES = [1, 100]
+        self.registry.register(self.func, self.alt2,
+                               size=self.size, sample=self.sample)
+        self.assertIsNone(self.registry.funcs[self.func].policy)
+        self.assertEqual(self.func(100), 'orig')
+        self.assertIsNotNone(self.registry.funcs[self.func].policy)
+        self.assertEqual(self.func(1), 'alt2')
+
+    def test_autotune_threads(self):
+        from multiprocessing.pool import ThreadPool
+        self.registry.autotune = True
+        self.registry.CALIBRATION_SIZES = [1, 100]
+        self.registry.register(self.func, self.alt2,
+                               size=self.size, sample=self.sample)
+        entry = self.registry.funcs[self.func]
+        calibrations = []
+        calibrate = entry.calibrate
+        entry.calibrate = lambda sizes, repeat: \
+                calibrations.append(sizes) or calibrate(sizes, repeat)
+        pool = ThreadPool(4)
+        try:
+            results = pool.map(self.func, [100, 1] * 4)
+        finally:
+            pool.close()
+        self.assertEqual(len(calibrations), 1)
+        self.assertEqual(results, ['orig', 'alt2'] * 4)
+
+    def test_stats(self):
+        self.registry.enable_stats()
+        self.registry.register(self.func, self.alt2,
+                               size=self.size, sample=self.sample)
+        self.registry.calibrate(sizes=[1, 100], repeat=1)
+        self.func(0)
+        self.func(1)
+        self.func(200)
+        self.registry.disable()
+        # calls to original code are not dispatched
+        self.func(200)
+        self.registry.enable()
+        name = '%s.%s' % (__name__, 'func')
+        stats = self.registry.get_stats()
+        self.assertEqual(stats.keys(), [name])
+        self.assertEqual(sorted(stats[name]), ['alt2', 'original'])
+        calls, seconds = stats[name]['alt2']
+        self.assertEqual(calls, 2)
+        self.assertAlmostEqual(seconds, 1e-4, delta=3e-3)
+        calls, seconds = stats[name]['original']
+        self.assertEqual(calls, 1)
+        self.assertAlmostEqual(seconds, 5e-3, delta=3e-3)
+        self.registry.reset_stats()
+        self.assertEqual(self.registry.get_stats(), {name: {}})
+
+    def test_enable_disable_stats(self):
+        self.registry.register(self.func, self.alt1)
+        name = '%s.%s' % (__name__, 'func')
+        entry = self.registry.funcs[self.func]
+        self.registry.enable_stats()
+        self.assertIs(self.func.func_code, entry.dispatch_code)
+        self.func(0)
+        self.registry.disable_stats()
+        self.assertIs(self.func.func_code, self.alt1.func_code)
+        self.func(0)
+        # stats collected before are kept
+        [(calls, _)] = self.registry.get_stats()[name].values()
+        self.assertEqual(calls, 1)
+        self.registry.disable()
+        self.registry.enable_stats()
+        # registry is still disabled
+        self.assertIs(self.func.func_code, entry.orig_code)
+
+    def test_stats_threads(self):
+        from multiprocessing.pool import ThreadPool
+        self.registry.enable_stats()
+        self.registry.register(self.func, self.alt1)
+        pool = ThreadPool(4)
+        try:
+            pool.map(lambda i: [self.func(i) for _ in xrange(200)],
+                     range(8))
+        finally:
+            pool.close()
+        name = '%s.%s' % (__name__, 'func')
+        calls, _ = self.registry.get_stats()[name]['alt1']
+        self.assertEqual(calls, 8 * 200)
+
+    def test_signature_preserved(self):
+        self.registry.register(self.func, self.alt1)
+        self.assertEqual(inspect.getargspec(self.func),
+                         (['size', 'extra'], None, None, (None, )))
+
+
+class MapChunksTestCase(unittest.TestCase):
+    def setUp(self):
+        super(MapChunksTestCase, self).setUp()
+        self.orig_min_chunk_size = speedups.MIN_CHUNK_SIZE
+        speedups.MIN_CHUNK_SIZE = 10
+        self.values = numpy.arange(95)
+        self.slices = []
+
+    def tearDown(self):
+        speedups.MIN_CHUNK_SIZE = self.orig_min_chunk_size
+        super(MapChunksTestCase, self).tearDown()
+
+    def func(self, sl):
+        self.slices.append(sl)
+        return self.values[sl] * 2
+
+    def test_single_thread(self):
+        result = speedups.map_chunks(self.func, 95, threads=1)
+        numpy.testing.assert_equal(result, self.values * 2)
+        self.assertEqual(self.slices, [slice(None)])
+
+    def test_several_threads(self):
+        result = speedups.map_chunks(self.func, 95, threads=4)
+        numpy.testing.assert_equal(result, self.values * 2)
+        self.assertEqual(sorted(self.slices), [slice(0, 23), slice(23, 47),
+                                               slice(47, 71), slice(71, 95)])
+
+    def test_pool_reused(self):
+        pool = speedups._get_pool(2)
+        self.assertIs(speedups._get_pool(2), pool)
+        pool3 = speedups._get_pool(3)
+        self.assertIsNot(pool3, pool)
+        self.assertIs(speedups._get_pool(3), pool3)
+        # pools are not closed when another size is requested
+        self.assertEqual(pool.map(abs, [-1, -2]), [1, 2])
+
+    def test_pool_size_independent_of_input_size(self):
+        pools = set()
+        get_pool = speedups._get_pool
+        speedups._get_pool = lambda threads: pools.add(threads) \
+                or get_pool(threads)
+        try:
+            for num_points in [25, 35, 95, 60]:
+                self.values = numpy.arange(num_points)
+                result = speedups.map_chunks(self.func, num_points,
+                                             threads=8)
+                numpy.testing.assert_equal(result, self.values * 2)
+        finally:
+            speedups._get_pool = get_pool
+        self.assertEqual(pools, set([8]))
+
+    def test_concurrent_calls_with_mixed_sizes(self):
+        from multiprocessing.pool import ThreadPool
+        values = numpy.arange(100)
+
+        def call(num_points):
+            return speedups.map_chunks(lambda sl: values[:num_points][sl],
+                                       num_points, threads=4)
+
+        sizes = [25, 100, 35, 90] * 25
+        outer = ThreadPool(4)
+        try:
+            results = outer.map(call, sizes)
+        finally:
+            outer.close()
+        for num_points, result in zip(sizes, results):
+            numpy.testing.assert_equal(result, values[:num_points])
+
+    def test_too_few_points(self):
+        result = speedups.map_chunks(self.func, 25, threads=8)
+        numpy.testing.assert_equal(result, self.values[:25] * 2)
+        self.assertEqual(len(self.slices), 2)